@@ -0,0 +1,214 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from posts.models import Comment, Follow, Group, Post
+
+User = get_user_model()
+
+
+class ApiTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='auth', first_name='Лев', last_name='Толстой')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test-slug',
+            description='Тестовое описание',
+        )
+        cls.posts = [
+            Post.objects.create(
+                author=cls.author, text=f'Пост {number}', group=cls.group)
+            for number in range(5)
+        ]
+        cls.post = cls.posts[-1]
+        cls.comments = [
+            Comment.objects.create(
+                post=cls.post,
+                author=User.objects.create_user(username=f'commentator{n}'),
+                text=f'Комментарий {n}',
+            )
+            for n in range(3)
+        ]
+        Follow.objects.create(user=cls.reader, author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+        self.reader_client = Client()
+        self.reader_client.force_login(self.reader)
+
+    def walk(self, url, **params):
+        """Все страницы списка по курсору next."""
+        results, pages = [], 0
+        while True:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            results += data['results']
+            pages += 1
+            if data['next'] is None:
+                return results, pages
+            params['after'] = data['next']
+
+    def test_posts_cursor_pages(self):
+        """Лента постов листается курсором без пропусков и повторов"""
+        results, pages = self.walk(reverse('api:posts'), limit=2)
+        self.assertEqual(pages, 3)
+        self.assertEqual(
+            [row['id'] for row in results],
+            [post.pk for post in reversed(self.posts)])
+        self.assertEqual(results[0], {
+            'id': self.post.pk,
+            'text': self.post.text,
+            'pub_date': results[0]['pub_date'],
+            'author': 'auth',
+            'group': 'test-slug',
+            'image': None,
+            'comments_count': 3,
+        })
+
+    def test_sparse_fields(self):
+        """?fields= оставляет в ответе только перечисленные поля"""
+        response = self.client.get(
+            reverse('api:posts'), {'fields': 'id,author'})
+        self.assertEqual(
+            response.json()['results'][0],
+            {'id': self.post.pk, 'author': 'auth'})
+
+    def test_bad_parameters(self):
+        """Неизвестное поле или неверный limit - ошибка 400"""
+        for params in (
+            {'fields': 'id,password'},
+            {'limit': '0'},
+            {'limit': 'много'},
+        ):
+            with self.subTest(params=params):
+                response = self.client.get(reverse('api:posts'), params)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('error', response.json())
+
+    def test_group_and_profile(self):
+        """Группа, профиль и их ленты"""
+        self.assertEqual(
+            self.client.get(
+                reverse('api:group', args=[self.group.slug]),
+                {'fields': 'slug,posts_count'},
+            ).json(),
+            {'slug': 'test-slug', 'posts_count': 5},
+        )
+        self.assertEqual(
+            self.client.get(reverse('api:groups')).json()['results'][0]['id'],
+            self.group.pk,
+        )
+        self.assertEqual(
+            self.client.get(
+                reverse('api:profile', args=['auth']),
+                {'fields': 'username,last_name,posts_count,followers_count'},
+            ).json(),
+            {'username': 'auth', 'last_name': 'Толстой',
+             'posts_count': 5, 'followers_count': 1},
+        )
+        for url in (
+            reverse('api:group_posts', args=[self.group.slug]),
+            reverse('api:profile_posts', args=['auth']),
+        ):
+            with self.subTest(url=url):
+                results, _ = self.walk(url, limit=3, fields='id')
+                self.assertEqual(len(results), 5)
+
+    def test_post_and_comments(self):
+        """Пост и его комментарии от старых к новым"""
+        response = self.client.get(
+            reverse('api:post', args=[self.post.pk]), {'fields': 'text'})
+        self.assertEqual(response.json(), {'text': self.post.text})
+        results, pages = self.walk(
+            reverse('api:comments', args=[self.post.pk]), limit=2)
+        self.assertEqual(pages, 2)
+        self.assertEqual(
+            [row['id'] for row in results],
+            [comment.pk for comment in self.comments])
+        self.assertEqual(results[0]['author'], 'commentator0')
+
+    def test_not_found(self):
+        """Несуществующие объекты - 404 в JSON"""
+        for url in (
+            reverse('api:post', args=[0]),
+            reverse('api:comments', args=[0]),
+            reverse('api:group', args=['nope']),
+            reverse('api:group_posts', args=['nope']),
+            reverse('api:profile', args=['nope']),
+            reverse('api:profile_posts', args=['nope']),
+        ):
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 404)
+                self.assertEqual(response.json(), {'error': 'Не найдено'})
+
+    def test_follow(self):
+        """Лента подписок только для вошедших"""
+        self.assertEqual(
+            self.client.get(reverse('api:follow')).status_code, 401)
+        response = self.reader_client.get(
+            reverse('api:follow'), {'fields': 'id,text', 'limit': 2})
+        data = response.json()
+        self.assertEqual(data['results'], [
+            {'id': post.pk, 'text': post.text}
+            for post in self.posts[:2:-1]
+        ])
+        self.assertIsNotNone(data['next'])
+
+    def test_etag(self):
+        """Повторный запрос с If-None-Match получает 304"""
+        for url in (
+            reverse('api:posts'),
+            reverse('api:groups'),
+            reverse('api:post', args=[self.post.pk]),
+        ):
+            with self.subTest(url=url):
+                etag = self.client.get(url)['ETag']
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+        etag = self.client.get(reverse('api:posts'))['ETag']
+        Post.objects.create(author=self.author, text='Новый пост')
+        response = self.client.get(
+            reverse('api:posts'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_profile_etag_follows_rename(self):
+        """Смена имени автора не отдается из кеша как 304"""
+        url = reverse('api:profile', args=['auth'])
+        etag = self.client.get(url)['ETag']
+        author = User.objects.get(pk=self.author.pk)
+        author.last_name = 'Тургенев'
+        author.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['last_name'], 'Тургенев')
+
+    def test_profile_etag_follows_subscriptions(self):
+        """Подписка меняет ETag профилей автора и подписчика"""
+        urls = (
+            reverse('api:profile', args=['auth']),
+            reverse('api:profile', args=['commentator0']),
+        )
+        etags = {url: self.client.get(url)['ETag'] for url in urls}
+        follow = Follow.objects.create(
+            user=self.comments[0].author, author=self.author)
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etags[url])
+                self.assertEqual(response.status_code, 200)
+                etags[url] = response['ETag']
+        self.assertEqual(
+            self.client.get(urls[0]).json()['followers_count'], 2)
+        follow.delete()
+        response = self.client.get(urls[0], HTTP_IF_NONE_MATCH=etags[urls[0]])
+        self.assertEqual(response.json()['followers_count'], 1)
+
+    def test_read_only(self):
+        """Запись через API не принимается"""
+        response = self.reader_client.post(reverse('api:posts'))
+        self.assertEqual(response.status_code, 405)
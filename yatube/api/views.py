@@ -0,0 +1,273 @@
+"""
+JSON API только для чтения: /api/v1/.
+
+Ответ собирается из строк values(), без моделей и шаблонов. Списки
+листаются курсором ?after=, ?limit= задает размер страницы (не больше
+API_MAX_PAGE_SIZE), а ?fields=id,text оставляет в ответе только
+перечисленные поля. Ленты отвечают 304 по версиям feed_cache, не
+выполняя запросов к постам; остальным ETag считается по телу ответа.
+"""
+from functools import wraps
+from operator import itemgetter
+
+from django.conf import settings
+from django.http import JsonResponse
+from django.utils.dateparse import parse_datetime
+from django.views.decorators.http import conditional_page, require_safe
+
+from core import sharding
+from core.paginators import CursorPaginator, decode_cursor, encode_cursor
+from core.replicas import replica_reads
+from posts import feed_cache
+from posts.models import Comment, Group, Post, TimelineEntry, User
+from posts.timeline import FeedPaginator, heavy_authors
+from posts.views import (group_scopes, index_scopes, post_scopes,
+                         profile_scopes)
+
+# Поле ответа -> поле values().
+POST_FIELDS = {
+    'id': 'id',
+    'text': 'text',
+    'pub_date': 'pub_date',
+    'author': 'author__username',
+    'group': 'group__slug',
+    'image': 'image',
+    'comments_count': 'comments_count',
+}
+GROUP_FIELDS = {
+    'id': 'id',
+    'slug': 'slug',
+    'title': 'title',
+    'description': 'description',
+    'posts_count': 'posts_count',
+}
+PROFILE_FIELDS = {
+    'id': 'id',
+    'username': 'username',
+    'first_name': 'first_name',
+    'last_name': 'last_name',
+    'posts_count': 'profile__posts_count',
+    'followers_count': 'profile__followers_count',
+    'following_count': 'profile__following_count',
+}
+COMMENT_FIELDS = {
+    'id': 'id',
+    'post': 'post_id',
+    'author': 'author__username',
+    'text': 'text',
+    'created': 'created',
+}
+
+JSON_PARAMS = {'ensure_ascii': False, 'separators': (',', ':')}
+
+
+class ApiError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def not_found():
+    return ApiError('Не найдено', status=404)
+
+
+def api_view(scopes=None):
+    """
+    View JSON API: словарь, который вернул view, отдается как JSON.
+
+    С scopes страница отвечает 304 по версиям feed_cache, как HTML-ленты.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            try:
+                data, status = view(request, *args, **kwargs), 200
+            except ApiError as error:
+                data, status = {'error': str(error)}, error.status
+            return JsonResponse(
+                data, status=status, json_dumps_params=JSON_PARAMS)
+        if scopes is not None:
+            wrapper = feed_cache.conditional(scopes)(wrapper)
+        return replica_reads(require_safe(conditional_page(wrapper)))
+    return decorator
+
+
+def _fields(request, available):
+    """Запрошенные в ?fields= поля, по умолчанию все."""
+    names = [
+        name for name in request.GET.get('fields', '').split(',') if name
+    ]
+    if not names:
+        return list(available)
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        raise ApiError('Неизвестные поля: {}'.format(', '.join(unknown)))
+    return list(dict.fromkeys(names))
+
+
+def _limit(request):
+    limit = request.GET.get('limit')
+    if limit is None:
+        return settings.API_PAGE_SIZE
+    if not limit.isdigit() or not (
+            1 <= int(limit) <= settings.API_MAX_PAGE_SIZE):
+        raise ApiError(
+            f'limit должен быть от 1 до {settings.API_MAX_PAGE_SIZE}')
+    return int(limit)
+
+
+def _lookups(names, fields, *required):
+    return list(dict.fromkeys((*required, *(fields[name] for name in names))))
+
+
+def _image_url(name):
+    return Post._meta.get_field('image').storage.url(name) if name else None
+
+
+CONVERTERS = {'image': _image_url}
+
+
+def _serialize(rows, names, fields):
+    converters = [
+        (name, fields[name], CONVERTERS.get(name)) for name in names
+    ]
+    return [
+        {
+            name: convert(row[lookup]) if convert else row[lookup]
+            for name, lookup, convert in converters
+        }
+        for row in rows
+    ]
+
+
+def _pk(queryset):
+    pk = queryset.values_list('pk', flat=True).first()
+    if pk is None:
+        raise not_found()
+    return pk
+
+
+def _one(request, queryset, fields):
+    names = _fields(request, fields)
+    row = queryset.values(*_lookups(names, fields)).first()
+    if row is None:
+        raise not_found()
+    return _serialize([row], names, fields)[0]
+
+
+def _page(request, queryset, fields, date_field='pub_date',
+          parse=parse_datetime, newest_first=True, scatter=False):
+    """
+    Страница строк после курсора ?after= и курсор следующей.
+
+    scatter=True собирает страницу со всех шардов.
+    """
+    limit = _limit(request)
+    names = _fields(request, fields)
+    after = request.GET.get('after')
+    cursor = decode_cursor(after, parse) if after else None
+    if newest_first:
+        lookup, ordering = 'lt', (f'-{date_field}', '-id')
+    else:
+        lookup, ordering = 'gt', (date_field, 'id')
+    queryset = queryset.order_by(*ordering).values(
+        *_lookups(names, fields, date_field, 'id'))
+    paginator = CursorPaginator(
+        queryset, limit, date_field=date_field, id_field='id')
+    queryset = paginator.seek(queryset, cursor, lookup)
+    key = itemgetter(date_field, 'id')
+    if scatter:
+        rows = sharding.scatter_gather(
+            queryset, limit + 1, key=key, reverse=newest_first)
+    else:
+        rows = list(queryset[:limit + 1])
+    return {
+        'results': _serialize(rows[:limit], names, fields),
+        'next': encode_cursor(*key(rows[limit - 1]))
+        if len(rows) > limit else None,
+    }
+
+
+@api_view(index_scopes)
+def posts(request):
+    return _page(request, Post.objects.all(), POST_FIELDS, scatter=True)
+
+
+@api_view(post_scopes)
+def post(request, post_id):
+    return _one(
+        request,
+        Post.objects.on_shard(pk=post_id).filter(pk=post_id),
+        POST_FIELDS,
+    )
+
+
+@api_view(post_scopes)
+def comments(request, post_id):
+    page = _page(
+        request,
+        Comment.objects.on_shard(pk=post_id).filter(post_id=post_id),
+        COMMENT_FIELDS,
+        date_field='created',
+        newest_first=False,
+    )
+    if not page['results'] and not Post.objects.on_shard(
+            pk=post_id).filter(pk=post_id).exists():
+        raise not_found()
+    return page
+
+
+@api_view()
+def groups(request):
+    return _page(
+        request, Group.objects.all(), GROUP_FIELDS,
+        date_field='id', parse=int, newest_first=False,
+    )
+
+
+@api_view(group_scopes)
+def group(request, slug):
+    return _one(request, Group.objects.filter(slug=slug), GROUP_FIELDS)
+
+
+@api_view(group_scopes)
+def group_posts(request, slug):
+    group_id = _pk(Group.objects.filter(slug=slug))
+    return _page(
+        request, Post.objects.filter(group_id=group_id), POST_FIELDS,
+        scatter=True,
+    )
+
+
+@api_view(profile_scopes)
+def profile(request, username):
+    return _one(
+        request, User.objects.filter(username=username), PROFILE_FIELDS)
+
+
+@api_view(profile_scopes)
+def profile_posts(request, username):
+    author_id = _pk(User.objects.filter(username=username))
+    return _page(
+        request,
+        Post.objects.on_shard(key=author_id).filter(author_id=author_id),
+        POST_FIELDS,
+    )
+
+
+@api_view()
+def follow(request):
+    if not request.user.is_authenticated:
+        raise ApiError('Нужно войти', status=401)
+    names = _fields(request, POST_FIELDS)
+    paginator = FeedPaginator(
+        TimelineEntry.objects.filter(user=request.user),
+        _limit(request),
+        heavy_author_ids=heavy_authors(request.user),
+        posts=Post.objects.values(*_lookups(names, POST_FIELDS, 'id')),
+    )
+    page = paginator.get_page(after=request.GET.get('after'))
+    return {
+        'results': _serialize(page.object_list, names, POST_FIELDS),
+        'next': page.next_cursor,
+    }
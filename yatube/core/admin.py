@@ -0,0 +1,104 @@
+from django.contrib import admin
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.forms.models import BaseModelFormSet
+
+from .models import Job, index_seek
+from .paginators import EstimatedCountPaginator
+
+
+class PreloadedAutocompleteSelect(AutocompleteSelect):
+    """
+    Виджет автодополнения, который берет выбранный объект из строки.
+
+    Обычный виджет читает подпись выбранного значения отдельным запросом,
+    в списке с list_editable это запрос на каждую строку.
+    """
+
+    preloaded = None
+
+    def optgroups(self, name, value, attr=None):
+        selected = {str(v) for v in value if v not in ('', None)}
+        if (self.preloaded is None
+                or selected != {str(self.preloaded.pk)}):
+            return super().optgroups(name, value, attr)
+        options = []
+        if not self.is_required:
+            options.append(self.create_option(name, '', '', False, 0))
+        options.append(self.create_option(
+            name,
+            self.preloaded.pk,
+            self.choices.field.label_from_instance(self.preloaded),
+            selected,
+            len(options),
+        ))
+        return [(None, options, 0)]
+
+
+class PreloadedFormSet(BaseModelFormSet):
+    """Передает виджетам автодополнения объекты из select_related."""
+
+    def _construct_form(self, i, **kwargs):
+        form = super()._construct_form(i, **kwargs)
+        for name, field in form.fields.items():
+            # Админка оборачивает виджеты связей в RelatedFieldWidgetWrapper.
+            widget = getattr(field.widget, 'widget', field.widget)
+            if not isinstance(widget, PreloadedAutocompleteSelect):
+                continue
+            model_field = self.model._meta.get_field(name)
+            if model_field.is_cached(form.instance):
+                widget.preloaded = model_field.get_cached_value(
+                    form.instance)
+        return form
+
+
+class ScalableModelAdmin(admin.ModelAdmin):
+    """
+    Админка для таблиц на миллионы строк.
+
+    Число строк оценивается, общий COUNT(*) без фильтров не выполняется,
+    связи из autocomplete_fields не грузят все варианты в <select>,
+    date_hierarchy берет MIN/MAX и даты поиском по индексу.
+    """
+
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        return index_seek(super().get_queryset(request))
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.name in self.get_autocomplete_fields(request):
+            kwargs.setdefault('widget', PreloadedAutocompleteSelect(
+                db_field.remote_field,
+                self.admin_site,
+                using=kwargs.get('using'),
+            ))
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+    def get_changelist_formset(self, request, **kwargs):
+        kwargs.setdefault('formset', PreloadedFormSet)
+        return super().get_changelist_formset(request, **kwargs)
+
+
+class JobAdmin(ScalableModelAdmin):
+    list_display = (
+        'pk',
+        'name',
+        'status',
+        'priority',
+        'attempts',
+        'available_at',
+        'updated',
+    )
+    list_filter = ('status', 'name')
+    search_fields = ('key',)
+    readonly_fields = (
+        'name', 'params', 'priority', 'status', 'key', 'attempts',
+        'max_attempts', 'available_at', 'error', 'created', 'updated',
+    )
+
+    def has_add_permission(self, request):
+        return False
+
+
+admin.site.register(Job, JobAdmin)
@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.db.backends.sqlite3 import base
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    SQLite, в котором транзакции начинаются в SQLITE_TRANSACTION_MODE.
+
+    Обычный BEGIN откладывает блокировку записи до первого изменения.
+    Если к этому моменту базу успел изменить другой писатель, SQLite
+    сразу отвечает "database is locked", не дожидаясь busy_timeout.
+    BEGIN IMMEDIATE берет блокировку в начале и ждет ее как положено.
+    """
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute(f'BEGIN {settings.SQLITE_TRANSACTION_MODE}')
@@ -0,0 +1,393 @@
+"""
+Двухуровневый кеш: LRU в памяти процесса перед общим кешем на диске.
+
+SQLiteCache хранит данные в отдельном файле SQLite и виден всем
+процессам на машине. TwoLevelCache держит горячие ключи в памяти
+процесса (L1) и читает остальное из общего кеша (L2). Запись в ключ
+увеличивает в L2 штамп его корзины; процессы перечитывают штампы
+не чаще раза в SYNC_INTERVAL секунд и перестают доверять записям L1
+из изменившихся корзин.
+"""
+import pickle
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+_l1 = {}
+_l1_state = {}
+_l1_locks = {}
+
+
+class SQLiteCache(BaseCache):
+    """Кеш в файле SQLite: общий для процессов, без внешних сервисов."""
+
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        self._location = location
+        self._local = threading.local()
+
+    @property
+    def _db(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(
+                self._location, timeout=30, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            db.execute(
+                'CREATE TABLE IF NOT EXISTS cache ('
+                'key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL)')
+            db.execute(
+                'CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)')
+            self._local.db = db
+        return db
+
+    def _key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def _dumps(self, value):
+        return pickle.dumps(value, self.pickle_protocol)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        db = self._db
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            db.execute(
+                'DELETE FROM cache WHERE key = ? AND expires <= ?',
+                (key, time.time()))
+            added = db.execute(
+                'INSERT OR IGNORE INTO cache VALUES (?, ?, ?)',
+                (key, self._dumps(value), self.get_backend_timeout(timeout)),
+            ).rowcount == 1
+        finally:
+            db.execute('COMMIT')
+        if added:
+            self._maybe_cull()
+        return added
+
+    def get(self, key, default=None, version=None):
+        key = self._key(key, version)
+        row = self._db.execute(
+            'SELECT value FROM cache WHERE key = ? '
+            'AND (expires IS NULL OR expires > ?)',
+            (key, time.time()),
+        ).fetchone()
+        return default if row is None else pickle.loads(row[0])
+
+    def get_many(self, keys, version=None):
+        made = {self._key(key, version): key for key in keys}
+        if not made:
+            return {}
+        placeholders = ', '.join('?' * len(made))
+        rows = self._db.execute(
+            f'SELECT key, value FROM cache WHERE key IN ({placeholders}) '
+            'AND (expires IS NULL OR expires > ?)',
+            (*made, time.time()),
+        )
+        return {made[key]: pickle.loads(value) for key, value in rows}
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        self._db.execute(
+            'INSERT OR REPLACE INTO cache VALUES (?, ?, ?)',
+            (key, self._dumps(value), self.get_backend_timeout(timeout)),
+        )
+        self._maybe_cull()
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        return self._db.execute(
+            'UPDATE cache SET expires = ? WHERE key = ? '
+            'AND (expires IS NULL OR expires > ?)',
+            (self.get_backend_timeout(timeout), key, time.time()),
+        ).rowcount == 1
+
+    def delete(self, key, version=None):
+        key = self._key(key, version)
+        self._db.execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    def incr(self, key, delta=1, version=None):
+        key = self._key(key, version)
+        db = self._db
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            row = db.execute(
+                'SELECT value FROM cache WHERE key = ? '
+                'AND (expires IS NULL OR expires > ?)',
+                (key, time.time()),
+            ).fetchone()
+            if row is None:
+                raise ValueError(f"Key '{key}' not found")
+            value = pickle.loads(row[0]) + delta
+            db.execute(
+                'UPDATE cache SET value = ? WHERE key = ?',
+                (self._dumps(value), key))
+        finally:
+            db.execute('COMMIT')
+        return value
+
+    def has_key(self, key, version=None):
+        key = self._key(key, version)
+        return self._db.execute(
+            'SELECT 1 FROM cache WHERE key = ? '
+            'AND (expires IS NULL OR expires > ?)',
+            (key, time.time()),
+        ).fetchone() is not None
+
+    def clear(self):
+        self._db.execute('DELETE FROM cache')
+
+    def _maybe_cull(self):
+        db = self._db
+        db.execute(
+            'DELETE FROM cache WHERE expires <= ?', (time.time(),))
+        count, = db.execute('SELECT COUNT(*) FROM cache').fetchone()
+        if count > self._max_entries:
+            db.execute(
+                'DELETE FROM cache WHERE key IN ('
+                'SELECT key FROM cache ORDER BY expires IS NULL, expires '
+                'LIMIT ?)',
+                (count // self._cull_frequency if self._cull_frequency
+                 else count,),
+            )
+
+
+class TwoLevelCache(BaseCache):
+    """
+    LRU процесса (L1) перед общим кешем (L2).
+
+    Параметры OPTIONS:
+    L2 - имя общего кеша в CACHES;
+    L1_MAX_ENTRIES - сколько ключей держать в памяти процесса;
+    L1_TIMEOUT - сколько секунд запись живет в L1 без обращения к L2;
+    SYNC_INTERVAL - как часто перечитывать штампы корзин из L2;
+    STAMP_BUCKETS - на сколько корзин делятся ключи.
+
+    Чужая запись становится видна не позже чем через SYNC_INTERVAL,
+    своя - сразу. Ключ с таймаутом короче L1_TIMEOUT кладет рядом в L2
+    свой срок, и L1 не держит значение дольше, чем оно живет в L2.
+    """
+
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, name, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._l2_alias = options.get('L2', 'shared')
+        self._l1_max_entries = int(options.get('L1_MAX_ENTRIES', 1000))
+        self._l1_timeout = float(options.get('L1_TIMEOUT', 60))
+        self._sync_interval = float(options.get('SYNC_INTERVAL', 1))
+        self._buckets = int(options.get('STAMP_BUCKETS', 64))
+        self._lru = _l1.setdefault(name, OrderedDict())
+        self._state = _l1_state.setdefault(name, {
+            'stamps': {}, 'synced': None,
+            'l1_hits': 0, 'l1_misses': 0, 'l2_hits': 0, 'l2_misses': 0,
+        })
+        self._lock = _l1_locks.setdefault(name, threading.Lock())
+
+    @property
+    def l2(self):
+        return caches[self._l2_alias]
+
+    def _key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def _bucket(self, key):
+        return zlib.crc32(key.encode()) % self._buckets
+
+    @staticmethod
+    def _stamp_key(bucket):
+        return f'__stamp__:{bucket}'
+
+    @staticmethod
+    def _expires_key(key):
+        return f'__expires__:{key}'
+
+    def _write_expiry(self, key, timeout):
+        """Запоминает в L2 срок ключа, который живет меньше L1_TIMEOUT."""
+        if timeout is not None and 0 < timeout < self._l1_timeout:
+            self.l2.set(
+                self._expires_key(key), time.time() + timeout, timeout)
+
+    def _l1_ttl(self, expires):
+        """Сколько держать в L1 значение, истекающее в L2 в expires."""
+        if expires is None:
+            return self._l1_timeout
+        return min(self._l1_timeout, expires - time.time())
+
+    def _stamps(self):
+        """Штампы корзин, перечитанные из L2 не раньше SYNC_INTERVAL."""
+        now = time.monotonic()
+        synced = self._state['synced']
+        if synced is not None and now - synced < self._sync_interval:
+            return self._state['stamps']
+        keys = {self._stamp_key(bucket): bucket
+                for bucket in range(self._buckets)}
+        found = self.l2.get_many(keys)
+        for key in keys.keys() - found.keys():
+            self.l2.add(key, time.time_ns(), None)
+            found[key] = self.l2.get(key)
+        stamps = {keys[key]: stamp for key, stamp in found.items()}
+        with self._lock:
+            self._state['stamps'] = stamps
+            self._state['synced'] = now
+        return stamps
+
+    def _bump(self, key):
+        """Сообщает всем процессам, что значения в корзине ключа устарели."""
+        bucket = self._bucket(key)
+        stamp_key = self._stamp_key(bucket)
+        try:
+            stamp = self.l2.incr(stamp_key)
+        except ValueError:
+            stamp = time.time_ns()
+            self.l2.set(stamp_key, stamp, None)
+        with self._lock:
+            self._lru.pop(key, None)
+            self._state['stamps'] = {
+                **self._state['stamps'], bucket: stamp}
+
+    def _count(self, counter):
+        with self._lock:
+            self._state[counter] += 1
+
+    def _l1_get(self, key, stamp):
+        with self._lock:
+            entry = self._lru.get(key)
+            if entry is None:
+                self._state['l1_misses'] += 1
+                return None
+            pickled, expires, entry_stamp = entry
+            if entry_stamp != stamp or expires <= time.monotonic():
+                del self._lru[key]
+                self._state['l1_misses'] += 1
+                return None
+            self._lru.move_to_end(key)
+            self._state['l1_hits'] += 1
+            return pickled
+
+    def _l1_set(self, key, value, stamp, ttl):
+        if ttl <= 0:
+            with self._lock:
+                self._lru.pop(key, None)
+            return
+        pickled = pickle.dumps(value, self.pickle_protocol)
+        with self._lock:
+            self._lru[key] = (pickled, time.monotonic() + ttl, stamp)
+            self._lru.move_to_end(key)
+            while len(self._lru) > self._l1_max_entries:
+                self._lru.popitem(last=False)
+
+    def get(self, key, default=None, version=None):
+        key = self._key(key, version)
+        # Штамп берется до чтения L2: если значение успеют перезаписать,
+        # запись в L1 окажется со старым штампом и не будет использована.
+        stamp = self._stamps().get(self._bucket(key))
+        pickled = self._l1_get(key, stamp)
+        if pickled is not None:
+            return pickle.loads(pickled)
+        expires_key = self._expires_key(key)
+        found = self.l2.get_many([key, expires_key])
+        if key not in found:
+            self._count('l2_misses')
+            return default
+        self._count('l2_hits')
+        value = found[key]
+        self._l1_set(
+            key, value, stamp, self._l1_ttl(found.get(expires_key)))
+        return value
+
+    def get_many(self, keys, version=None):
+        stamps = self._stamps()
+        found = {}
+        wanted = {}
+        for key in keys:
+            made = self._key(key, version)
+            stamp = stamps.get(self._bucket(made))
+            pickled = self._l1_get(made, stamp)
+            if pickled is None:
+                wanted[made] = (key, stamp)
+            else:
+                found[key] = pickle.loads(pickled)
+        if wanted:
+            from_l2 = self.l2.get_many(
+                [*wanted, *map(self._expires_key, wanted)])
+            hits = wanted.keys() & from_l2.keys()
+            with self._lock:
+                self._state['l2_hits'] += len(hits)
+                self._state['l2_misses'] += len(wanted) - len(hits)
+            for made in hits:
+                key, stamp = wanted[made]
+                value = from_l2[made]
+                expires = from_l2.get(self._expires_key(made))
+                self._l1_set(made, value, stamp, self._l1_ttl(expires))
+                found[key] = value
+        return found
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        timeout = self._timeout(timeout)
+        added = self.l2.add(key, value, timeout)
+        if added:
+            self._write_expiry(key, timeout)
+            self._bump(key)
+        return added
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        timeout = self._timeout(timeout)
+        # Срок пишется первым: значение без срока не попадет в чужой L1.
+        self._write_expiry(key, timeout)
+        self.l2.set(key, value, timeout)
+        self._bump(key)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        timeout = self._timeout(timeout)
+        touched = self.l2.touch(key, timeout)
+        if touched:
+            self._write_expiry(key, timeout)
+            self._bump(key)
+        return touched
+
+    def delete(self, key, version=None):
+        key = self._key(key, version)
+        self.l2.delete(key)
+        self._bump(key)
+
+    def incr(self, key, delta=1, version=None):
+        key = self._key(key, version)
+        value = self.l2.incr(key, delta)
+        self._bump(key)
+        return value
+
+    def clear(self):
+        # Штампы удаляются вместе с данными, и при следующей сверке
+        # каждый процесс получит новые значения и забудет свой L1.
+        self.l2.clear()
+        with self._lock:
+            self._lru.clear()
+            self._state['synced'] = None
+
+    def _timeout(self, timeout):
+        return self.default_timeout if timeout is DEFAULT_TIMEOUT else timeout
+
+    def stats(self):
+        """Попадания и промахи по уровням для этого процесса."""
+        with self._lock:
+            return {
+                counter: self._state[counter]
+                for counter in ('l1_hits', 'l1_misses', 'l2_hits', 'l2_misses')
+            }
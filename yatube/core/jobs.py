@@ -0,0 +1,189 @@
+"""
+Фоновые задачи в таблице базы без внешнего брокера.
+
+Функция-задача помечается декоратором task и ставится в очередь через
+enqueue: строка Job пишется в той же транзакции, что и данные, и
+воркер увидит ее только после коммита. Воркеры (команда run_workers)
+берут самую приоритетную доступную задачу и на JOB_VISIBILITY_TIMEOUT
+скрывают ее от остальных. Упавшая задача повторяется через
+JOB_RETRY_BACKOFF секунд, с каждой попыткой вдвое позже, пока не
+кончатся попытки.
+
+Задача может выполниться больше одного раза (воркер упал после
+работы, но до отчета), поэтому задачи должны быть идемпотентными.
+Долгая задача продлевает свою видимость вызовом touch после каждой
+порции работы, иначе по таймауту ее возьмет второй воркер.
+"""
+import datetime
+import json
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+TASKS = {}
+
+_running = threading.local()
+
+# Выполненные задачи удаляются не чаще раза в час.
+PURGE_INTERVAL = 60 * 60
+
+
+class LeaseLost(Exception):
+    """Время видимости истекло, и задачу уже выполняет другой воркер."""
+
+
+def task(func):
+    """Регистрирует функцию как задачу очереди под ее полным именем."""
+    func.job_name = f'{func.__module__}.{func.__qualname__}'
+    TASKS[func.job_name] = func
+    return func
+
+
+def enqueue(func, params=None, priority=0, key=None, delay=0,
+            max_attempts=None):
+    """
+    Ставит задачу func(**params) в очередь и возвращает ее Job.
+
+    Пока задача с тем же key не завершилась, вместо новой
+    возвращается она.
+    """
+    if key is not None:
+        pending = Job.objects.filter(key=key, status__in=Job.PENDING).first()
+        if pending is not None:
+            return pending
+    job = Job(
+        name=func.job_name,
+        params=json.dumps(params or {}),
+        priority=priority,
+        key=key,
+        max_attempts=max_attempts or settings.JOB_MAX_ATTEMPTS,
+        available_at=timezone.now() + datetime.timedelta(seconds=delay),
+    )
+    try:
+        with transaction.atomic():
+            job.save()
+    except IntegrityError:
+        if key is None:
+            raise
+        return Job.objects.get(key=key, status__in=Job.PENDING)
+    return job
+
+
+def backoff(attempt):
+    """Пауза перед повтором после попытки attempt, в секундах."""
+    return settings.JOB_RETRY_BACKOFF * 2 ** (attempt - 1)
+
+
+def claim():
+    """Берет следующую задачу и скрывает ее от других воркеров."""
+    now = timezone.now()
+    with transaction.atomic():
+        job = Job.objects.select_for_update(skip_locked=True).filter(
+            status__in=Job.PENDING, available_at__lte=now,
+        ).order_by('-priority', 'available_at', 'pk').first()
+        if job is None:
+            return None
+        job.status = Job.RUNNING
+        job.attempts += 1
+        job.available_at = now + datetime.timedelta(
+            seconds=settings.JOB_VISIBILITY_TIMEOUT)
+        job.save(update_fields=(
+            'status', 'attempts', 'available_at', 'updated'))
+    return job
+
+
+def _finish(job, **fields):
+    """
+    Записывает итог попытки.
+
+    Если время видимости истекло и задачу уже взял другой воркер,
+    номер попытки не совпадет и итог не запишется.
+    """
+    return Job.objects.filter(
+        pk=job.pk, status=Job.RUNNING, attempts=job.attempts,
+    ).update(updated=timezone.now(), **fields)
+
+
+def touch():
+    """
+    Продлевает видимость выполняемой задачи на JOB_VISIBILITY_TIMEOUT.
+
+    Вызывается из задачи после каждой порции работы, лучше в той же
+    транзакции: если задачу уже взял другой воркер, LeaseLost откатит
+    порцию. Вне воркера ничего не делает.
+    """
+    job = getattr(_running, 'job', None)
+    if job is None:
+        return
+    if not _finish(job, available_at=timezone.now() + datetime.timedelta(
+            seconds=settings.JOB_VISIBILITY_TIMEOUT)):
+        raise LeaseLost(f'Задачу {job} уже выполняет другой воркер')
+
+
+def perform(job):
+    """Выполняет взятую задачу и записывает успех, повтор или ошибку."""
+    _running.job = job
+    try:
+        func = TASKS.get(job.name) or import_string(job.name)
+        if getattr(func, 'job_name', None) != job.name:
+            raise ImportError(f'{job.name} не помечена как задача')
+        func(**job.options)
+    except LeaseLost:
+        # Итог запишет воркер, который взял задачу следующим.
+        logger.warning('Задачу %s забрал другой воркер', job)
+        return False
+    except Exception as error:
+        logger.exception('Задача %s упала', job)
+        if job.attempts < job.max_attempts:
+            _finish(
+                job,
+                status=Job.QUEUED,
+                available_at=timezone.now() + datetime.timedelta(
+                    seconds=backoff(job.attempts)),
+                error=repr(error),
+            )
+        else:
+            _finish(job, status=Job.FAILED, error=repr(error))
+        return False
+    finally:
+        _running.job = None
+    _finish(job, status=Job.DONE, error='')
+    return True
+
+
+def purge():
+    """Удаляет выполненные задачи старше JOB_KEEP_DONE секунд."""
+    border = timezone.now() - datetime.timedelta(
+        seconds=settings.JOB_KEEP_DONE)
+    return Job.objects.filter(status=Job.DONE, updated__lt=border).delete()[0]
+
+
+def work(burst=False, stopping=lambda: False):
+    """
+    Выполняет задачи, пока stopping() не вернет True.
+
+    С burst=True возвращается, как только доступных задач не осталось.
+    Возвращает число выполненных задач.
+    """
+    done, purged = 0, float('-inf')
+    while not stopping():
+        job = claim()
+        if job is not None:
+            done += perform(job)
+            continue
+        if burst:
+            break
+        if time.monotonic() - purged > PURGE_INTERVAL:
+            purge()
+            purged = time.monotonic()
+        time.sleep(settings.JOB_POLL_INTERVAL)
+    return done
@@ -0,0 +1,69 @@
+import multiprocessing
+import signal
+
+import django
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from core import jobs
+
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def _serve(burst):
+    """Цикл процесса-воркера: по SIGTERM дописывает текущую задачу."""
+    if not apps.ready:
+        django.setup()
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(1))
+    # Ctrl+C приходит всей группе процессов, останавливает их родитель.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        jobs.work(burst=burst, stopping=lambda: bool(stopping))
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = (
+        'Запускает воркеры фоновых задач core.jobs: JOB_WORKERS процессов, '
+        'каждый берет задачи из таблицы очереди.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int)
+        parser.add_argument(
+            '--burst',
+            action='store_true',
+            help='Завершиться, когда доступных задач не останется.',
+        )
+
+    def handle(self, *args, **options):
+        processes = options['processes'] or settings.JOB_WORKERS
+        if processes == 1:
+            done = jobs.work(burst=options['burst'])
+            self.stdout.write(f'Выполнено задач: {done}')
+            return
+        # Дочерние процессы открывают свои соединения.
+        connections.close_all()
+        workers = [
+            multiprocessing.Process(
+                target=_serve, args=(options['burst'],), name=f'worker-{n}')
+            for n in range(processes)
+        ]
+        for worker in workers:
+            worker.start()
+        signal.signal(signal.SIGTERM, _interrupt)
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            for worker in workers:
+                worker.terminate()
+            for worker in workers:
+                worker.join()
+        self.stdout.write(f'Воркеры остановлены: {processes}')
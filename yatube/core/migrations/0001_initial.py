@@ -0,0 +1,25 @@
+# Generated by Django 2.2.16 on 2026-10-17 04:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredFile',
+            fields=[
+                ('name', models.CharField(max_length=255, primary_key=True, serialize=False, verbose_name='Имя файла')),
+                ('refs', models.PositiveIntegerField(default=1, verbose_name='Число ссылок')),
+            ],
+            options={
+                'verbose_name': 'Сохраненный файл',
+                'verbose_name_plural': 'Сохраненные файлы',
+            },
+        ),
+    ]
@@ -1,4 +1,10 @@
+import datetime
+import json
+
+from django.conf import settings
 from django.db import models
+from django.db.models import F, Max, Min, Q, Subquery
+from django.utils import timezone
 
 
 class CreatedModel(models.Model):
@@ -10,3 +16,211 @@ class CreatedModel(models.Model):
 
     class Meta:
         abstract = True
+
+
+class StoredFile(models.Model):
+    """Файл контентно-адресуемого хранилища и число ссылок на него."""
+    name = models.CharField('Имя файла', max_length=255, primary_key=True)
+    refs = models.PositiveIntegerField('Число ссылок', default=1)
+
+    class Meta:
+        verbose_name = 'Сохраненный файл'
+        verbose_name_plural = 'Сохраненные файлы'
+
+    def __str__(self):
+        return self.name
+
+
+class Job(models.Model):
+    """
+    Задача фоновой очереди, см. core.jobs.
+
+    Взятая воркером задача остается в статусе RUNNING и скрыта до
+    available_at. Если воркер к этому времени не отчитался, задачу
+    берет следующий. Ключ key не дает поставить задачу повторно,
+    пока первая не завершилась.
+    """
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = (
+        (QUEUED, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Готово'),
+        (FAILED, 'Ошибка'),
+    )
+    PENDING = (QUEUED, RUNNING)
+
+    name = models.CharField('Задача', max_length=200)
+    params = models.TextField('Параметры', default='{}')
+    priority = models.SmallIntegerField('Приоритет', default=0)
+    status = models.CharField(
+        'Состояние', max_length=16, choices=STATUSES, default=QUEUED)
+    key = models.CharField(
+        'Ключ идемпотентности', max_length=200, null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField('Попыток', default=0)
+    max_attempts = models.PositiveSmallIntegerField('Предел попыток')
+    available_at = models.DateTimeField('Доступна с', default=timezone.now)
+    error = models.TextField('Ошибка', blank=True)
+    created = models.DateTimeField('Создана', auto_now_add=True)
+    updated = models.DateTimeField('Изменена', auto_now=True)
+
+    class Meta:
+        verbose_name = 'Фоновая задача'
+        verbose_name_plural = 'Фоновые задачи'
+        # Только незавершенные задачи: выполненные не мешают поиску.
+        indexes = [models.Index(
+            fields=('-priority', 'available_at', 'id'),
+            condition=Q(status__in=('queued', 'running')),
+            name='job_pending_idx')]
+        constraints = [models.UniqueConstraint(
+            fields=('key',),
+            condition=Q(status__in=('queued', 'running')),
+            name='job_pending_key')]
+
+    def __str__(self):
+        return f'{self.name} #{self.pk}'
+
+    @property
+    def options(self):
+        """Аргументы задачи: словарь из JSON в поле params."""
+        return json.loads(self.params)
+
+
+class IndexSeekQuerySet(models.QuerySet):
+    """
+    QuerySet, у которого MIN/MAX и dates() идут поиском по индексу.
+
+    SQLite берет из индекса только одиночный MIN или MAX, а dates()
+    усекает дату у каждой строки и делает DISTINCT, то есть читает всю
+    выборку. Здесь каждое значение находится подзапросом
+    ORDER BY ... LIMIT 1, которому хватает индекса по полю.
+    """
+
+    def _edge_query(self, field_name, last=False):
+        return self.filter(**{f'{field_name}__isnull': False}).order_by(
+            f'-{field_name}' if last else field_name
+        ).values_list(field_name, flat=True)[:1]
+
+    def _edges(self, wanted):
+        """
+        Крайние значения полей одним запросом: {(поле, last): значение}.
+
+        Найденное запоминается, чтобы dates() после aggregate() по тому
+        же QuerySet не искал их заново.
+        """
+        known = self.__dict__.setdefault('_known_edges', {})
+        missing = [edge for edge in wanted if edge not in known]
+        if missing and self.query.is_empty():
+            known.update(dict.fromkeys(missing))
+        elif missing:
+            subqueries = {
+                f'edge{number}': Subquery(self._edge_query(*edge))
+                for number, edge in enumerate(missing)
+            }
+            row = self.model._base_manager.using(self.db).order_by(
+            ).annotate(**subqueries).values(*subqueries).first() or {}
+            for number, edge in enumerate(missing):
+                known[edge] = row.get(f'edge{number}')
+        return {edge: known[edge] for edge in wanted}
+
+    @staticmethod
+    def _seekable(aggregate):
+        expressions = aggregate.get_source_expressions()
+        return (
+            type(aggregate) in (Min, Max)
+            and aggregate.filter is None
+            and len(expressions) == 1
+            and isinstance(expressions[0], F)
+        )
+
+    def aggregate(self, *args, **kwargs):
+        """Только MIN и MAX по полям считаются поиском по индексу."""
+        if (args or not kwargs or not self.query.can_filter()
+                or self.query.distinct or self.query.group_by
+                or not all(map(self._seekable, kwargs.values()))):
+            return super().aggregate(*args, **kwargs)
+        wanted = {
+            name: (
+                aggregate.get_source_expressions()[0].name,
+                isinstance(aggregate, Max),
+            )
+            for name, aggregate in kwargs.items()
+        }
+        found = self._edges(wanted.values())
+        return {name: found[edge] for name, edge in wanted.items()}
+
+    def dates(self, field_name, kind, order='ASC'):
+        """
+        Годы, месяцы или дни, в которые есть строки, списком.
+
+        Первый и последний период берутся из крайних значений поля,
+        каждый следующий - отдельным поиском первой строки не раньше
+        его начала.
+        """
+        if kind not in ('year', 'month', 'day'):
+            return super().dates(field_name, kind, order)
+        field = self.model._meta.get_field(field_name)
+        is_datetime = isinstance(field, models.DateTimeField)
+        aware = settings.USE_TZ and is_datetime
+
+        def period(value):
+            if is_datetime:
+                value = (timezone.localtime(value) if aware else value).date()
+            return _truncate(value, kind)
+
+        edges = self._edges([(field_name, False), (field_name, True)])
+        first, last = edges[(field_name, False)], edges[(field_name, True)]
+        if first is None:
+            return []
+        periods = [period(first)]
+        final = period(last)
+        while periods[-1] < final:
+            start = _next_period(periods[-1], kind)
+            if is_datetime:
+                start = datetime.datetime.combine(start, datetime.time.min)
+                if aware:
+                    start = timezone.make_aware(start)
+            periods.append(period(self.filter(
+                **{f'{field_name}__gte': start})._edge_query(field_name)[0]))
+        return periods[::-1] if order == 'DESC' else periods
+
+
+_index_seek_classes = {}
+
+
+def index_seek(queryset):
+    """
+    Копия queryset, у которой MIN/MAX и dates() идут поиском по индексу.
+
+    Менеджеры моделей остаются обычными: подмена нужна только там, где
+    ее ждут, например в списках админки с date_hierarchy.
+    """
+    base = type(queryset)
+    if not issubclass(base, IndexSeekQuerySet):
+        if base not in _index_seek_classes:
+            _index_seek_classes[base] = type(
+                f'IndexSeek{base.__name__}', (IndexSeekQuerySet, base), {})
+        base = _index_seek_classes[base]
+    clone = queryset._chain()
+    clone.__class__ = base
+    return clone
+
+
+def _truncate(day, kind):
+    if kind == 'year':
+        return day.replace(month=1, day=1)
+    if kind == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def _next_period(period, kind):
+    if kind == 'year':
+        return period.replace(year=period.year + 1)
+    if kind == 'month':
+        if period.month == 12:
+            return period.replace(year=period.year + 1, month=1)
+        return period.replace(month=period.month + 1)
+    return period + datetime.timedelta(days=1)
@@ -0,0 +1,187 @@
+import base64
+import binascii
+
+from django.conf import settings
+from django.core.paginator import Page, Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+
+from . import sharding
+
+
+def encode_cursor(value, pk):
+    """Упаковывает позицию (значение, id) в непрозрачный токен для URL."""
+    value = value.isoformat() if hasattr(value, 'isoformat') else repr(value)
+    raw = f'{value}|{pk}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token, parse=parse_datetime):
+    """Распаковывает токен курсора, для битого токена возвращает None."""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        value, pk = raw.decode().rsplit('|', 1)
+        value = parse(value)
+        pk = int(pk)
+    except (ValueError, TypeError, binascii.Error, UnicodeDecodeError):
+        return None
+    if value is None:
+        return None
+    return value, pk
+
+
+class CursorPaginator(Paginator):
+    """
+    Постраничная навигация по ключу (дата, id) вместо OFFSET/LIMIT.
+
+    Любая страница читает не больше per_page + 1 строк начиная
+    с позиции курсора, поэтому глубокие страницы стоят столько же,
+    сколько первая, а COUNT(*) не выполняется вовсе.
+    """
+
+    parse_value = staticmethod(parse_datetime)
+
+    def __init__(self, object_list, per_page, date_field='pub_date',
+                 id_field='pk'):
+        super().__init__(object_list, per_page)
+        self.date_field = date_field
+        self.id_field = id_field
+        self.number = 1
+        self.has_next = False
+
+    @property
+    def num_pages(self):
+        """Без COUNT(*) известны только текущая и следующая страницы."""
+        return self.number + 1 if self.has_next else self.number
+
+    def encode(self, obj):
+        return encode_cursor(
+            getattr(obj, self.date_field), getattr(obj, self.id_field))
+
+    def seek(self, queryset, cursor, lookup):
+        """
+        Отсекает строки до позиции курсора (lookup: 'lt' или 'gt').
+
+        Лишнее условие date <= value (>= для 'gt') дает SQLite границу
+        диапазона в индексе: без него OR заставляет идти по индексу
+        от самой первой строки.
+        """
+        if cursor is None:
+            return queryset
+        value, pk = cursor
+        return queryset.filter(
+            Q(**{f'{self.date_field}__{lookup}e': value}),
+            Q(**{f'{self.date_field}__{lookup}': value})
+            | Q(**{self.date_field: value, f'{self.id_field}__{lookup}': pk}),
+        )
+
+    def _rows(self, cursor, lookup, ordering):
+        queryset = self.seek(self.object_list, cursor, lookup)
+        return list(queryset.order_by(*ordering)[:self.per_page + 1])
+
+    def get_page(self, after=None, before=None):
+        """
+        Возвращает страницу после курсора after или перед курсором before.
+
+        Битый или пустой курсор даёт первую страницу. page.cursor_key -
+        заново упакованный курсор страницы для ключей кеша: любая
+        строка в URL не заводит новую запись, первая страница одна.
+        """
+        field, id_field = self.date_field, self.id_field
+        cursor = decode_cursor(before, self.parse_value) if before else None
+        direction = 'before'
+        if cursor is not None:
+            rows = self._rows(cursor, 'gt', (field, id_field))
+            has_previous = len(rows) > self.per_page
+            self.has_next = True
+            rows = rows[:self.per_page][::-1]
+        else:
+            cursor = decode_cursor(after, self.parse_value) if after else None
+            direction = 'after'
+            rows = self._rows(cursor, 'lt', (f'-{field}', f'-{id_field}'))
+            has_previous = cursor is not None
+            self.has_next = len(rows) > self.per_page
+            rows = rows[:self.per_page]
+        self.number = 2 if has_previous else 1
+        page = Page(rows, self.number, self)
+        page.next_cursor = (
+            self.encode(rows[-1]) if self.has_next and rows else None
+        )
+        page.previous_cursor = (
+            self.encode(rows[0]) if has_previous and rows else None
+        )
+        page.cursor_key = (
+            '' if cursor is None
+            else f'{direction}:{encode_cursor(*cursor)}'
+        )
+        return page
+
+
+class ShardedCursorPaginator(CursorPaginator):
+    """
+    Лента по всем шардам: CursorPaginator поверх scatter_gather.
+
+    Каждый шард отдает per_page + 1 строк после курсора, страница
+    собирается слиянием ответов. При одном шарде это обычный запрос.
+    """
+
+    @cached_property
+    def count(self):
+        return sharding.count(self.object_list)
+
+    def sort_key(self, obj):
+        return getattr(obj, self.date_field), getattr(obj, self.id_field)
+
+    def _rows(self, cursor, lookup, ordering):
+        queryset = self.seek(self.object_list, cursor, lookup)
+        return sharding.scatter_gather(
+            queryset.order_by(*ordering),
+            self.per_page + 1,
+            key=self.sort_key,
+            reverse=lookup == 'lt',
+        )
+
+
+def estimate_count(queryset, exact_below=0):
+    """
+    Число строк таблицы без COUNT(*) или None, если оценить нельзя.
+
+    В SQLite это разброс rowid: два поиска по первичному ключу, после
+    удалений оценка завышена. Если по оценке строк не больше
+    exact_below, тем же запросом они считаются точно.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'sqlite':
+        return None
+    table = connection.ops.quote_name(queryset.model._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT CASE WHEN span > %s THEN span '
+            f'ELSE (SELECT count(*) FROM {table}) END '
+            f'FROM (SELECT (SELECT max(rowid) FROM {table}) '
+            f'- (SELECT min(rowid) FROM {table}) + 1 AS span)',
+            (exact_below,),
+        )
+        estimate, = cursor.fetchone()
+    return estimate
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator для больших таблиц: COUNT(*) только там, где он дешев.
+
+    Без фильтров число строк оценивается, а точно считается, только если
+    по оценке их не больше ADMIN_EXACT_COUNT_LIMIT. С фильтрами строки
+    считаются до ADMIN_EXACT_COUNT_LIMIT, дальше страницы не листаются.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        limit = settings.ADMIN_EXACT_COUNT_LIMIT
+        if queryset.query.where or queryset.query.distinct:
+            return queryset.order_by()[:limit].count()
+        estimate = estimate_count(queryset, exact_below=limit)
+        return queryset.count() if estimate is None else estimate
@@ -0,0 +1,102 @@
+"""
+Чтение с реплик и запись в основную базу.
+
+View, помеченные replica_reads, читают модели приложений REPLICA_APPS
+со случайной реплики из DATABASE_REPLICAS, все остальное идет в
+default. Сессии и пользователи всегда читаются из default: только что
+вошедший пользователь мог еще не доехать до реплики.
+
+Реплика отстает, поэтому после запроса, который что-то записал в
+REPLICA_APPS, браузер получает подписанную cookie и PRIMARY_PIN_SECONDS
+секунд читает только из default - пользователь сразу видит свои
+изменения. По той же причине прочитанное с реплики не кешируется
+надолго и не получает ETag, см. reading_replica.
+"""
+import random
+import threading
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+PIN_COOKIE = 'primary_pin'
+
+_state = threading.local()
+
+
+def replica_reads(view):
+    """Помечает view, чтения которой можно отдать реплике."""
+    view.replica_reads = True
+    return view
+
+
+def reading_replica():
+    """
+    Реплика, с которой читает текущий запрос, или None.
+
+    Такая страница может быть старше версий лент в кеше: ее нельзя
+    класть в кеш под текущей версией и отдавать с ETag.
+    """
+    return getattr(_state, 'replica', None)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label in settings.REPLICA_APPS:
+            return getattr(_state, 'replica', None)
+        return None
+
+    def db_for_write(self, model, **hints):
+        # Служебные записи при чтении (очередь задач, сессии) не
+        # закрепляют: читатель не ждет их на страницах.
+        if model._meta.app_label in settings.REPLICA_APPS:
+            _state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # На репликах те же данные, что и в default.
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        # Схему на реплики приносит репликация.
+        return False if db in settings.DATABASE_REPLICAS else None
+
+
+class ReplicaMiddleware:
+    """Выбирает базу для чтения на время запроса и закрепляет писателей."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        _state.replica = None
+        _state.wrote = False
+        try:
+            response = self.get_response(request)
+        finally:
+            wrote = _state.wrote
+            _state.replica = None
+            _state.wrote = False
+        if wrote:
+            response.set_signed_cookie(
+                PIN_COOKIE, '1',
+                salt=PIN_COOKIE,
+                max_age=settings.PRIMARY_PIN_SECONDS,
+                httponly=True,
+            )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        replicas = settings.DATABASE_REPLICAS
+        if (replicas
+                and request.method in ('GET', 'HEAD')
+                and getattr(view_func, 'replica_reads', False)
+                and not self.pinned(request)):
+            _state.replica = random.choice(replicas)
+
+    @staticmethod
+    def pinned(request):
+        return request.get_signed_cookie(
+            PIN_COOKIE, None,
+            salt=PIN_COOKIE,
+            max_age=settings.PRIMARY_PIN_SECONDS,
+        ) is not None
@@ -0,0 +1,213 @@
+"""
+Шардирование строк по нескольким базам из DATABASE_SHARDS.
+
+Модель-наследник ShardedModel сама говорит, в каком шарде лежит строка.
+При нескольких шардах id новой строки выдается так, что id % N - номер
+ее шарда: строку можно найти по одному id, а id не повторяются между
+шардами. При одном шарде (по умолчанию ['default']) id выдает база,
+роутер молчит, и все работает как без шардирования.
+
+Остальные таблицы живут в default. Модели из SHARD_REFERENCE_MODELS
+(автор и группа) - справочные: шард держит их копию, потому что на
+шарде выполняются JOIN к ним и проверка внешних ключей. Новый шард
+создается копией default, дальше каждая запись и удаление справочной
+строки в default повторяются на всех шардах, см. replicate_reference.
+Запросы без ключа шарда опрашивают все шарды, см. scatter_gather.
+"""
+import heapq
+import threading
+import zlib
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from django.conf import settings
+from django.apps import apps
+from django.db import DEFAULT_DB_ALIAS, connections, models, transaction
+from django.db.models.signals import post_delete, post_save
+
+_pool = None
+_lock = threading.Lock()
+
+
+def is_sharded():
+    return len(settings.DATABASE_SHARDS) > 1
+
+
+def shard_by_key(key):
+    """Шард строки с ключом шардирования key, например id автора."""
+    shards = settings.DATABASE_SHARDS
+    return shards[zlib.crc32(str(key).encode()) % len(shards)]
+
+
+def shard_by_id(pk):
+    """Шард строки с этим id."""
+    shards = settings.DATABASE_SHARDS
+    return shards[pk % len(shards)]
+
+
+class ShardedModel(models.Model):
+    """Модель, строки которой распределены по DATABASE_SHARDS."""
+
+    class Meta:
+        abstract = True
+
+    def get_shard(self):
+        raise NotImplementedError
+
+    @classmethod
+    def shard_for_related(cls, instance):
+        """Шард строк, связанных с instance, или None, если их шардов много."""
+        return None
+
+    def save(self, force_insert=False, force_update=False, using=None,
+             update_fields=None):
+        if not is_sharded():
+            return super().save(force_insert, force_update, using,
+                                update_fields)
+        # Строка пишется только в свой шард, куда бы ее ни отправили.
+        using = self.get_shard()
+        with transaction.atomic(using=using):
+            if self.pk is None:
+                self.pk = self._next_id(using)
+                force_insert = True
+            super().save(force_insert, force_update, using, update_fields)
+
+    def _next_id(self, using):
+        # Транзакция уже держит блокировку записи: max(id) не устареет.
+        shards = settings.DATABASE_SHARDS
+        count, index = len(shards), shards.index(using)
+        last = type(self)._base_manager.using(using).order_by(
+            '-pk').values_list('pk', flat=True).first()
+        return (last // count + 1) * count + index if last else count + index
+
+
+class ShardedQuerySet(models.QuerySet):
+    def on_shard(self, pk=None, key=None):
+        """Запрос к шарду строки с id pk или ключом шардирования key."""
+        if not is_sharded():
+            return self
+        alias = shard_by_id(pk) if key is None else shard_by_key(key)
+        return self.using(alias)
+
+
+def _copy(sender, instance, using, raw=False, update_fields=None,
+          **kwargs):
+    """Повторяет запись справочной строки из default на шардах."""
+    if raw or using != DEFAULT_DB_ALIAS or not is_sharded():
+        return
+    values = {
+        field.attname: getattr(instance, field.attname)
+        for field in sender._meta.concrete_fields
+    }
+    changed = {
+        field.attname: values[field.attname]
+        for field in sender._meta.concrete_fields
+        if update_fields is None or field.name in update_fields
+    }
+    for alias in settings.DATABASE_SHARDS:
+        if alias == using:
+            continue
+        # Без save(): сигналы модели не должны сработать еще раз.
+        manager = sender._base_manager.using(alias)
+        if not manager.filter(pk=instance.pk).update(**changed):
+            manager.bulk_create([sender(**values)])
+
+
+def _drop(sender, instance, using, **kwargs):
+    """Удаляет копии справочной строки; каскад идет в каждом шарде."""
+    if using != DEFAULT_DB_ALIAS or not is_sharded():
+        return
+    for alias in settings.DATABASE_SHARDS:
+        if alias != using:
+            sender._base_manager.using(alias).filter(pk=instance.pk).delete()
+
+
+def replicate_reference():
+    """Подключает копирование моделей SHARD_REFERENCE_MODELS на шарды."""
+    for label in settings.SHARD_REFERENCE_MODELS:
+        model = apps.get_model(label)
+        post_save.connect(
+            _copy, sender=model, dispatch_uid=f'shard-copy-{label}')
+        post_delete.connect(
+            _drop, sender=model, dispatch_uid=f'shard-drop-{label}')
+
+
+class ShardRouter:
+    """Отправляет запросы к ShardedModel в шард строки из подсказки."""
+
+    def _route(self, model, instance=None, **hints):
+        if (instance is None or not is_sharded()
+                or not issubclass(model, ShardedModel)):
+            return None
+        if isinstance(instance, model):
+            return instance.get_shard()
+        return model.shard_for_related(instance)
+
+    db_for_read = db_for_write = _route
+
+
+def _fetch(alias, queryset):
+    try:
+        return list(queryset.using(alias))
+    finally:
+        # Как после запроса: соединения потоков пула не копятся.
+        connections[alias].close()
+
+
+def _gather(parts):
+    """Выполняет пары (шард, QuerySet) параллельно, по списку на пару."""
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(
+                max_workers=len(settings.DATABASE_SHARDS),
+                thread_name_prefix='shard')
+    return list(_pool.map(lambda part: _fetch(*part), parts))
+
+
+def scatter_gather(queryset, limit, key, reverse=False):
+    """
+    Первые limit строк упорядоченного QuerySet со всех шардов.
+
+    Каждый шард отдает свои первые limit строк, ответы сливаются
+    heapq.merge по key, как отсортированные потоки.
+    """
+    if not is_sharded():
+        return list(queryset[:limit])
+    parts = _gather(
+        (alias, queryset[:limit]) for alias in settings.DATABASE_SHARDS)
+    return list(islice(heapq.merge(*parts, key=key, reverse=reverse), limit))
+
+
+def count(queryset):
+    """COUNT(*) по всем шардам."""
+    if not is_sharded():
+        return queryset.count()
+    return sum(
+        queryset.using(alias).count() for alias in settings.DATABASE_SHARDS)
+
+
+def in_bulk(queryset, ids):
+    """
+    in_bulk по шардам: каждый шард получает только свои id.
+
+    Годится и для values(): ключом тогда служит поле id строки.
+    """
+    if not ids:
+        return {}
+    if not is_sharded():
+        parts = [queryset.filter(pk__in=ids)]
+    else:
+        by_shard = defaultdict(list)
+        for pk in ids:
+            by_shard[shard_by_id(pk)].append(pk)
+        parts = _gather(
+            (alias, queryset.filter(pk__in=part))
+            for alias, part in by_shard.items())
+    objects = {}
+    for rows in parts:
+        objects.update(
+            (row['id'] if isinstance(row, dict) else row.pk, row)
+            for row in rows)
+    return objects
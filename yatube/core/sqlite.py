@@ -0,0 +1,30 @@
+"""
+Настройка соединений SQLite для работы под нагрузкой.
+
+WAL позволяет читателям не ждать писателя, busy_timeout заставляет
+писателей ждать блокировку вместо ошибки "database is locked",
+mmap_size и cache_size держат горячие страницы в памяти.
+Значения берутся из SQLITE_PRAGMAS.
+"""
+from django.conf import settings
+
+PRAGMAS = (
+    'journal_mode',
+    'synchronous',
+    'busy_timeout',
+    'mmap_size',
+    'cache_size',
+    'temp_store',
+)
+
+
+def apply_pragmas(cursor, pragmas=None):
+    """Выполняет PRAGMA из настроек на курсоре DB-API."""
+    if pragmas is None:
+        pragmas = settings.SQLITE_PRAGMAS
+    for name, value in pragmas.items():
+        if name not in PRAGMAS:
+            raise ValueError(f'Неизвестная PRAGMA в SQLITE_PRAGMAS: {name}')
+        if not str(value).lstrip('-').isalnum():
+            raise ValueError(f'Недопустимое значение PRAGMA {name}: {value}')
+        cursor.execute(f'PRAGMA {name} = {value}')
@@ -0,0 +1,75 @@
+import hashlib
+import os
+import posixpath
+
+from django.core.files.storage import FileSystemStorage
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import StoredFile
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Хранилище, называющее файлы по SHA-256 содержимого.
+
+    Файл posts/photo.jpg сохраняется как posts/ab/cd/abcd...jpg: две
+    первые пары символов хеша образуют вложенные каталоги, чтобы в одном
+    каталоге не скапливались миллионы файлов. Одинаковое содержимое
+    хранится один раз, а число ссылок на него ведется в StoredFile;
+    delete() уменьшает счетчик и удаляет файл, когда ссылок не осталось.
+    """
+
+    chunk_size = 64 * 1024
+
+    def digest(self, content):
+        """Хеш содержимого, прочитанного по частям."""
+        sha256 = hashlib.sha256()
+        for chunk in content.chunks(self.chunk_size):
+            sha256.update(chunk)
+        return sha256.hexdigest()
+
+    def hashed_name(self, name, content):
+        directory, filename = posixpath.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+        digest = self.digest(content)
+        return posixpath.join(
+            directory, digest[:2], digest[2:4], digest + extension)
+
+    @staticmethod
+    def _add_ref(name):
+        return StoredFile.objects.filter(name=name).update(refs=F('refs') + 1)
+
+    def _save(self, name, content):
+        name = self.hashed_name(name, content)
+        with transaction.atomic():
+            if self._add_ref(name):
+                return name
+            if not self.exists(name):
+                # При гонке двух одинаковых загрузок вторая получит имя
+                # с суффиксом: дубль лучше потерянного файла.
+                name = super()._save(name, content)
+            try:
+                with transaction.atomic():
+                    StoredFile.objects.create(name=name)
+            except IntegrityError:
+                # Тот же файл только что записала параллельная загрузка.
+                self._add_ref(name)
+        return name
+
+    def delete(self, name):
+        if not name:
+            return
+        with transaction.atomic():
+            if StoredFile.objects.filter(name=name, refs__gt=1).update(
+                    refs=F('refs') - 1):
+                return
+            # Файлы, которых нет в StoredFile, загружены до появления
+            # счетчиков: сколько постов на них ссылается, неизвестно.
+            if not StoredFile.objects.filter(name=name).delete()[0]:
+                return
+        transaction.on_commit(lambda: self._delete_unreferenced(name))
+
+    def _delete_unreferenced(self, name):
+        if not StoredFile.objects.filter(name=name).exists():
+            super().delete(name)
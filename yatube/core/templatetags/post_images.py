@@ -0,0 +1,20 @@
+from django import template
+
+from posts import thumbnails
+
+register = template.Library()
+
+
+@register.simple_tag
+def attach_thumbnails(posts):
+    """Загружает миниатюры всей страницы ленты разом."""
+    thumbnails.attach(posts)
+    return ''
+
+
+@register.inclusion_tag('posts/includes/picture.html')
+def post_picture(post, size='card'):
+    attached = getattr(post, 'thumbnails', None)
+    if attached is not None:
+        return {'picture': attached.get(size)}
+    return {'picture': thumbnails.rendition(post.image, size)}
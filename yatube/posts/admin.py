@@ -1,8 +1,40 @@
-from django.contrib import admin
-from .models import Post, Group, Comment, Follow
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ActionForm
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.contrib.auth import get_user_model
+from django.contrib.auth.admin import UserAdmin
+from django.core.exceptions import ValidationError
+from django.urls import reverse
+from django.utils.html import format_html
 
+from core.admin import ScalableModelAdmin
 
-class PostAdmin(admin.ModelAdmin):
+from . import bulk
+from .models import BulkJob, Post, Group, Comment, Follow
+from .search import matching
+
+User = get_user_model()
+
+
+class PostActionForm(ActionForm):
+    group = forms.ModelChoiceField(
+        Group.objects.all(),
+        label='Группа',
+        required=False,
+        widget=AutocompleteSelect(
+            Post._meta.get_field('group').remote_field, admin.site),
+    )
+
+
+def report_job(modeladmin, request, job):
+    url = reverse('admin:posts_bulkjob_change', args=[job.pk])
+    modeladmin.message_user(request, format_html(
+        'Запущена фоновая операция <a href="{}">{}</a>: {} строк.',
+        url, job, job.total))
+
+
+class PostAdmin(ScalableModelAdmin):
     list_display = (
         'pk',
         'text',
@@ -11,9 +43,53 @@ class PostAdmin(admin.ModelAdmin):
         'group'
     )
     list_editable = ('group',)
+    list_select_related = ('author', 'group')
+    autocomplete_fields = ('author', 'group')
     search_fields = ('text',)
     list_filter = ('pub_date',)
+    date_hierarchy = 'pub_date'
     empty_value_display = '-пусто-'
+    action_form = PostActionForm
+    actions = ('delete_in_background', 'move_to_group')
+
+    def get_actions(self, request):
+        # Стандартное удаление собирает каскад в памяти в одной транзакции.
+        actions = super().get_actions(request)
+        actions.pop('delete_selected', None)
+        return actions
+
+    def delete_in_background(self, request, queryset):
+        job = bulk.enqueue(
+            BulkJob.DELETE, request.user,
+            ids=queryset.values_list('pk', flat=True).iterator())
+        report_job(self, request, job)
+    delete_in_background.short_description = 'Удалить выбранные посты в фоне'
+    delete_in_background.allowed_permissions = ('delete',)
+
+    def move_to_group(self, request, queryset):
+        try:
+            group = PostActionForm.base_fields['group'].clean(
+                request.POST.get('group'))
+        except ValidationError:
+            group = None
+        if group is None:
+            self.message_user(
+                request, 'Выберите группу для переноса.', messages.WARNING)
+            return
+        job = bulk.enqueue(
+            BulkJob.MOVE, request.user,
+            ids=queryset.values_list('pk', flat=True).iterator(),
+            group_id=group.pk)
+        report_job(self, request, job)
+    move_to_group.short_description = 'Перенести выбранные посты в группу'
+    move_to_group.allowed_permissions = ('change',)
+
+    def get_search_results(self, request, queryset, search_term):
+        # Поиск по индексу FTS5 вместо LIKE '%...%' по всей таблице.
+        rows = matching(search_term)
+        if rows is None:
+            return queryset, False
+        return queryset.filter(pk__in=rows.values('post')), False
 
 
 class GroupAdmin(admin.ModelAdmin):
@@ -23,27 +99,73 @@ class GroupAdmin(admin.ModelAdmin):
         'description'
     )
     list_editable = ()
-    search_fields = ('text',)
+    search_fields = ('title', 'slug')
     list_filter = ()
     empty_value_display = '-пусто-'
 
 
-class CommentAdmin(admin.ModelAdmin):
+class CommentAdmin(ScalableModelAdmin):
     list_display = (
         'post',
         'author',
         'text'
     )
+    list_select_related = ('post', 'author')
+    autocomplete_fields = ('post', 'author')
+    date_hierarchy = 'created'
 
 
-class FollowAdmin(admin.ModelAdmin):
+class FollowAdmin(ScalableModelAdmin):
     list_display = (
         'user',
         'author',
     )
+    list_select_related = ('user', 'author')
+    autocomplete_fields = ('user', 'author')
+
+
+class BulkJobAdmin(admin.ModelAdmin):
+    list_display = (
+        'pk',
+        'action',
+        'status',
+        'progress',
+        'created_by',
+        'created',
+        'updated',
+    )
+    list_filter = ('status', 'action')
+    list_select_related = ('created_by',)
+    readonly_fields = (
+        'action', 'params', 'status', 'step', 'last_id', 'done', 'total',
+        'error', 'created_by', 'created', 'updated',
+    )
+
+    def progress(self, job):
+        percent = 100 * job.done // job.total if job.total else 100
+        return f'{job.done} из {job.total} ({percent}%)'
+    progress.short_description = 'Прогресс'
+
+    def has_add_permission(self, request):
+        return False
+
+
+class PurgingUserAdmin(UserAdmin):
+    actions = ('purge_content',)
+
+    def purge_content(self, request, queryset):
+        for user in queryset:
+            job = bulk.enqueue(BulkJob.PURGE, request.user, user_id=user.pk)
+            report_job(self, request, job)
+    purge_content.short_description = (
+        'Удалить в фоне все посты и комментарии пользователей')
+    purge_content.allowed_permissions = ('delete',)
 
 
 admin.site.register(Post, PostAdmin)
 admin.site.register(Group, GroupAdmin)
 admin.site.register(Comment, CommentAdmin)
 admin.site.register(Follow, FollowAdmin)
+admin.site.register(BulkJob, BulkJobAdmin)
+admin.site.unregister(User)
+admin.site.register(User, PurgingUserAdmin)
@@ -0,0 +1,180 @@
+"""
+Массовые операции админки в фоне.
+
+Админка только создает BulkJob и ставит фоновую задачу core.jobs.
+Операция состоит из шагов; каждый шаг выбирает следующие
+BULK_ACTION_BATCH_SIZE id после сохраненного last_id и обрабатывает их
+в своей короткой транзакции. В той же транзакции продлевается
+видимость фоновой задачи: если ее уже взял другой воркер, пачка
+откатывается. Задачи, прерванные падением процесса, досчитывает
+команда resume_bulk_jobs.
+
+Комментарии удаляются одним DELETE без загрузки в Python: сигналы
+комментариев здесь заменяют явные сдвиги счетчиков и версий лент.
+"""
+import json
+import logging
+from collections import Counter
+from itertools import islice
+
+from django.conf import settings
+from django.db import transaction
+
+from core import jobs
+
+from . import counters, feed_cache
+from .models import BulkJob, BulkJobItem, Comment, Post
+
+logger = logging.getLogger(__name__)
+
+
+def _ids_after(queryset, after, limit):
+    return list(queryset.filter(pk__gt=after).order_by('pk').values_list(
+        'pk', flat=True)[:limit])
+
+
+def _selected_posts(job, after, limit):
+    return list(BulkJobItem.objects.filter(
+        job=job, post_id__gt=after,
+    ).order_by('post_id').values_list('post_id', flat=True)[:limit])
+
+
+def _author_comments(job, after, limit):
+    return _ids_after(
+        Comment.objects.filter(author_id=job.options['user_id']),
+        after, limit)
+
+
+def _author_posts(job, after, limit):
+    return _ids_after(
+        Post.objects.filter(author_id=job.options['user_id']), after, limit)
+
+
+def _delete_comments(job, ids):
+    comments = Comment.objects.filter(pk__in=ids)
+    per_post = Counter(comments.values_list('post_id', flat=True))
+    comments._raw_delete(comments.db)
+    for post_id, deleted in per_post.items():
+        counters.bump_post(post_id, -deleted)
+        feed_cache.bump('post', post_id)
+
+
+def _delete_posts(job, ids):
+    # Комментарии уходят вместе с постом, счетчик поста им не нужен.
+    comments = Comment.objects.filter(post_id__in=ids)
+    comments._raw_delete(comments.db)
+    Post.objects.filter(pk__in=ids).delete()
+
+
+def _move_posts(job, ids):
+    group_id = job.options['group_id']
+    rows = list(Post.objects.filter(pk__in=ids).exclude(
+        group_id=group_id).values_list('pk', 'author_id', 'group_id'))
+    if not rows:
+        return
+    Post.objects.filter(pk__in=[pk for pk, _, _ in rows]).update(
+        group_id=group_id)
+    for old_group_id, moved in Counter(row[2] for row in rows).items():
+        counters.bump_group(old_group_id, -moved)
+        feed_cache.bump('group', old_group_id)
+    counters.bump_group(group_id, len(rows))
+    feed_cache.bump('group', group_id)
+    feed_cache.bump('index')
+    for author_id in {author_id for _, author_id, _ in rows}:
+        feed_cache.bump('author', author_id)
+    for pk, _, _ in rows:
+        feed_cache.bump('post', pk)
+
+
+STEPS = {
+    BulkJob.DELETE: ((_selected_posts, _delete_posts),),
+    BulkJob.MOVE: ((_selected_posts, _move_posts),),
+    BulkJob.PURGE: (
+        (_author_comments, _delete_comments),
+        (_author_posts, _delete_posts),
+    ),
+}
+
+
+def _store_selection(job, ids):
+    """Пишет выбранные id пачками в BulkJobItem, возвращает их число."""
+    ids = iter(ids)
+    total = 0
+    while True:
+        batch = list(islice(ids, settings.BULK_ACTION_BATCH_SIZE))
+        if not batch:
+            return total
+        BulkJobItem.objects.bulk_create(
+            [BulkJobItem(job=job, post_id=pk) for pk in batch],
+            ignore_conflicts=True)
+        total += len(batch)
+
+
+def enqueue(action, user=None, ids=None, **options):
+    """
+    Создает операцию и ставит ее выполнение в очередь.
+
+    Выбранные id постов (ids, любой итерируемый объект) хранятся
+    в BulkJobItem, а не в params: пачка находит их поиском по индексу.
+    """
+    with transaction.atomic():
+        job = BulkJob.objects.create(
+            action=action,
+            params=json.dumps(options),
+            created_by=user,
+        )
+        if ids is not None:
+            job.total = _store_selection(job, ids)
+        else:
+            job.total = (
+                Comment.objects.filter(author_id=options['user_id']).count()
+                + Post.objects.filter(author_id=options['user_id']).count()
+            )
+        job.save(update_fields=('total', 'updated'))
+        jobs.enqueue(run, {'job_id': job.pk}, key=f'bulk:{job.pk}')
+    return job
+
+
+@jobs.task
+def run(job_id):
+    """
+    Выполняет задачу с сохраненного места до конца.
+
+    Ошибка пачки откатывает только ее: задача помечается FAILED
+    и при следующем запуске продолжится с той же пачки.
+    """
+    job = BulkJob.objects.get(pk=job_id)
+    if job.status == BulkJob.DONE:
+        return job
+    job.status = BulkJob.RUNNING
+    job.error = ''
+    job.save(update_fields=('status', 'error', 'updated'))
+    steps = STEPS[job.action]
+    try:
+        while job.step < len(steps):
+            source, handle = steps[job.step]
+            with transaction.atomic():
+                ids = source(job, job.last_id, settings.BULK_ACTION_BATCH_SIZE)
+                if ids:
+                    handle(job, ids)
+                    job.last_id = ids[-1]
+                    job.done += len(ids)
+                else:
+                    job.step += 1
+                    job.last_id = 0
+                job.save(update_fields=('step', 'last_id', 'done', 'updated'))
+                jobs.touch()
+    except jobs.LeaseLost:
+        raise
+    except Exception as error:
+        logger.exception('Фоновая операция %s прервалась', job)
+        job.status = BulkJob.FAILED
+        job.error = repr(error)
+        job.save(update_fields=('status', 'error', 'updated'))
+        return job
+    with transaction.atomic():
+        job.items.all().delete()
+        job.status = BulkJob.DONE
+        job.total = max(job.total, job.done)
+        job.save(update_fields=('status', 'total', 'updated'))
+    return job
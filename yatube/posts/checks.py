@@ -0,0 +1,136 @@
+"""
+Проверка планов запросов лент: manage.py check --tag database.
+
+Для каждого типового запроса страниц выполняется EXPLAIN QUERY PLAN.
+Полный просмотр таблицы (SCAN без индекса) и сортировка во временном
+B-дереве означают, что запросу не хватает индекса и он замедлится
+вместе с ростом таблицы. Запросу страницы после курсора, кроме того,
+нужна граница диапазона по дате. Проверка работает только на SQLite.
+"""
+import re
+
+from django.core.checks import Tags, Warning, register
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from django.utils import timezone
+
+from core.paginators import CursorPaginator
+
+from .models import Comment, Follow, Post, TimelineEntry
+from .timeline import heavy_authors_query
+
+PAGE = 11
+
+
+def _feed(queryset, id_field='pk'):
+    """Первая страница ленты и страницы после и перед курсором."""
+    paginator = CursorPaginator(queryset, PAGE - 1, id_field=id_field)
+    cursor = (timezone.now(), 1)
+    newest_first = ('-pub_date', f'-{id_field}')
+    return {
+        'first': queryset.order_by(*newest_first)[:PAGE],
+        'after': paginator.seek(queryset, cursor, 'lt').order_by(
+            *newest_first)[:PAGE],
+        'before': paginator.seek(queryset, cursor, 'gt').order_by(
+            'pub_date', id_field)[:PAGE],
+    }
+
+
+def canonical_queries():
+    """Пары (название, QuerySet) запросов, которые делают страницы."""
+    feeds = {
+        'index': Post.objects.for_feed(),
+        'group': Post.objects.filter(group_id=1).for_feed(),
+        'profile': Post.objects.filter(author_id=1).for_feed(),
+    }
+    queries = [
+        (f'{name} [{variant}]', queryset)
+        for name, feed in feeds.items()
+        for variant, queryset in _feed(feed).items()
+    ]
+    queries += [
+        (f'follow [{variant}]', queryset)
+        for variant, queryset in _feed(
+            TimelineEntry.objects.filter(user_id=1).values_list(
+                'pub_date', 'post_id'),
+            id_field='post_id',
+        ).items()
+    ]
+    comments = Comment.objects.filter(post_id=1).select_related(
+        'author').order_by('created', 'pk')
+    queries += [
+        ('post comments', comments[:PAGE]),
+        ('post comments [after]', CursorPaginator(
+            comments, PAGE - 1, date_field='created',
+        ).seek(comments, (timezone.now(), 1), 'gt')[:PAGE]),
+        ('following', Follow.objects.filter(user_id=1, author_id=2)),
+        ('followers', Follow.objects.filter(author_id=1).values_list(
+            'user_id', flat=True)),
+        ('heavy authors', heavy_authors_query(1)),
+        ('recent posts', Post.objects.filter(author_id=1).order_by(
+            '-pub_date', '-pk').values_list('pub_date', 'pk')[:PAGE]),
+    ]
+    return queries
+
+
+def explain(queryset, using=DEFAULT_DB_ALIAS):
+    """Строки EXPLAIN QUERY PLAN запроса, только для SQLite."""
+    connection = connections[using]
+    sql, params = queryset.query.get_compiler(using).as_sql()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def _table(step):
+    words = step.split()
+    # Старые версии SQLite пишут «SCAN TABLE имя».
+    return words[2] if len(words) > 2 and words[1] == 'TABLE' else words[1]
+
+
+def slow_steps(plan, seek_table=None):
+    """
+    Шаги плана с полным просмотром таблицы или сортировкой.
+
+    Для запроса после курсора seek_table - его таблица: шаг по ней без
+    границы диапазона тоже медленный, будь то SCAN по индексу или
+    SEARCH только по префиксу равенства. Такой шаг идет по индексу
+    от первой строки, и глубокая страница стоит дороже первой.
+    """
+    slow = []
+    for step in plan:
+        if step.startswith('USE TEMP B-TREE') or (
+                step.startswith('SCAN ') and ' USING ' not in step):
+            slow.append(step)
+        elif (seek_table is not None
+              and step.startswith(('SCAN ', 'SEARCH '))
+              and _table(step) == seek_table
+              and not re.search(r'[<>]=?\?', step)):
+            slow.append(step)
+    return slow
+
+
+def is_seek(name):
+    return name.endswith(('[after]', '[before]'))
+
+
+@register(Tags.database)
+def check_query_plans(app_configs=None, **kwargs):
+    connection = connections[DEFAULT_DB_ALIAS]
+    if connection.vendor != 'sqlite':
+        return []
+    messages = []
+    for name, queryset in canonical_queries():
+        try:
+            plan = explain(queryset)
+        except DatabaseError:
+            # Таблиц еще нет: проверять нечего до migrate.
+            return []
+        seek_table = queryset.model._meta.db_table if is_seek(name) else None
+        for step in slow_steps(plan, seek_table):
+            messages.append(Warning(
+                f'Запрос «{name}» без подходящего индекса: {step}',
+                hint='Добавьте составной индекс под фильтр и сортировку.',
+                obj=queryset.model,
+                id='posts.W001',
+            ))
+    return messages
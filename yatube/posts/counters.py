@@ -0,0 +1,58 @@
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import Comment, Follow, Group, Post, Profile
+
+
+def _bump(queryset, field, delta):
+    """
+    Атомарно сдвигает счетчик выражением F.
+
+    Счетчик не уходит ниже нуля: рассинхронизацию чинит команда recount.
+    """
+    if delta < 0:
+        queryset = queryset.filter(**{f'{field}__gte': -delta})
+    return queryset.update(**{field: F(field) + delta})
+
+
+def bump_profile(user_id, field, delta):
+    """Сдвигает счетчик профиля, создавая профиль при необходимости."""
+    if user_id is None:
+        return
+    profiles = Profile.objects.filter(user_id=user_id)
+    if not _bump(profiles, field, delta) and delta > 0:
+        profile, created = Profile.objects.get_or_create(
+            user_id=user_id, defaults={field: delta})
+        if not created:
+            _bump(profiles, field, delta)
+
+
+def bump_group(group_id, delta):
+    if group_id is not None:
+        _bump(Group.objects.filter(pk=group_id), 'posts_count', delta)
+
+
+def bump_post(post_id, delta):
+    if post_id is not None:
+        posts = Post.objects.on_shard(pk=post_id).filter(pk=post_id)
+        _bump(posts, 'comments_count', delta)
+
+
+def count_subquery(model, field):
+    """Подзапрос COUNT(*) строк model, ссылающихся на внешнюю строку."""
+    return Coalesce(Subquery(
+        model.objects.filter(
+            **{field: OuterRef('pk')}
+        ).order_by().values(field).annotate(total=Count('pk')).values(
+            'total'),
+        output_field=IntegerField(),
+    ), 0)
+
+
+COUNTERS = (
+    (Profile, 'posts_count', Post, 'author'),
+    (Profile, 'followers_count', Follow, 'author'),
+    (Profile, 'following_count', Follow, 'user'),
+    (Group, 'posts_count', Post, 'group'),
+    (Post, 'comments_count', Comment, 'post'),
+)
@@ -0,0 +1,119 @@
+import hashlib
+import time
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.middleware.csrf import get_token
+from django.views.decorators.http import condition
+
+from core.replicas import reading_replica
+
+
+def _key(scope, pk=None):
+    return f'posts:feed-version:{scope}' if pk is None else (
+        f'posts:feed-version:{scope}:{pk}')
+
+
+def version(scope, pk=None):
+    """
+    Текущая версия ленты: входит в ключ кешированного фрагмента.
+
+    Версия - время последнего изменения в наносекундах, поэтому после
+    вытеснения ключа она не вернется к уже использованному числу
+    и годится для заголовка Last-Modified. Чтение с реплики новых
+    версий не заводит и получает None, если версии еще нет.
+    """
+    if reading_replica():
+        return cache.get(_key(scope, pk))
+    return cache.get_or_set(_key(scope, pk), time.time_ns, None)
+
+
+def versions(*scopes):
+    """Версии нескольких лент за одно обращение к кешу."""
+    keys = [_key(scope, pk) for scope, pk in scopes]
+    found = cache.get_many(keys)
+    return [
+        found[key] if key in found else version(scope, pk)
+        for key, (scope, pk) in zip(keys, scopes)
+    ]
+
+
+def bump(scope, pk=None):
+    cache.set(_key(scope, pk), time.time_ns(), None)
+
+
+def bump_for_post(post, old_group_id=None, old_author_id=None):
+    """Сбрасывает фрагменты всех лент, в которых виден пост."""
+    bump('index')
+    bump('post', post.pk)
+    for author_id in {post.author_id, old_author_id} - {None}:
+        bump('author', author_id)
+    for group_id in {post.group_id, old_group_id} - {None}:
+        bump('group', group_id)
+
+
+def context(scope, pk=None):
+    """
+    Переменные шаблона для тега {% cache %} ленты.
+
+    Страница с реплики может быть старше версии, поэтому ее фрагмент
+    ключуется именем реплики вместо версии и не сохраняется (таймаут 0):
+    фрагменты под версиями пишет и читает только основная база.
+    """
+    replica = reading_replica()
+    if replica:
+        return {'feed_version': replica, 'feed_cache_timeout': 0}
+    return {
+        'feed_version': version(scope, pk),
+        'feed_cache_timeout': settings.FEED_CACHE_TIMEOUT,
+    }
+
+
+def _csrf_stamp(request):
+    """
+    Отпечаток CSRF-cookie: вход в систему меняет токен.
+
+    Формы страниц вошедшего пользователя несут токен, поэтому после
+    нового входа старая копия страницы в браузере не годится.
+    """
+    get_token(request)
+    token = request.META['CSRF_COOKIE'].encode()
+    return hashlib.sha256(token).hexdigest()[:12]
+
+
+def conditional(scopes):
+    """
+    Отвечает 304 по версиям лент, не вызывая view.
+
+    scopes(request, *args, **kwargs) возвращает пары (scope, pk), от
+    которых зависит страница, или None, если страница не существует.
+    ETag включает пользователя, потому что страница зависит от него,
+    и его CSRF-токен, см. _csrf_stamp; Last-Modified отдается только
+    анонимам. Чтение с реплики идет без них: реплика могла еще не
+    догнать версию.
+    """
+    def stamps(request, *args, **kwargs):
+        if not hasattr(request, '_feed_versions'):
+            found = scopes(request, *args, **kwargs)
+            request._feed_versions = (
+                None if found is None else versions(*found))
+        return request._feed_versions
+
+    def etag(request, *args, **kwargs):
+        found = stamps(request, *args, **kwargs)
+        if found is None or reading_replica():
+            return None
+        parts = [request.user.pk or 0, *found]
+        if request.user.is_authenticated:
+            parts.append(_csrf_stamp(request))
+        return 'W/"{}"'.format('-'.join(map(str, parts)))
+
+    def last_modified(request, *args, **kwargs):
+        found = stamps(request, *args, **kwargs)
+        if (found is None or request.user.is_authenticated
+                or reading_replica()):
+            return None
+        return datetime.fromtimestamp(max(found) / 10 ** 9, timezone.utc)
+
+    return condition(etag_func=etag, last_modified_func=last_modified)
@@ -0,0 +1,91 @@
+"""
+Нормализация картинок постов при загрузке.
+
+Размер проверяется по заголовку файла до декодирования. Большие JPEG
+декодируются сразу в уменьшенном виде (draft), остальное уменьшается
+с предварительным reduce. Поворот из EXIF применяется к пикселям,
+после чего метаданные отбрасываются. ICC-профиль RGB-картинки
+сохраняется, чтобы не исказить цвета; CMYK и другие пространства
+переводятся в sRGB по своему профилю (если Pillow собран с LittleCMS),
+и профиль снимается. Анимация не поддерживается: такие файлы
+отклоняются. Результат - прогрессивный JPEG или, если есть
+прозрачность, PNG.
+"""
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from PIL import Image, ImageOps, features
+
+
+def check_pixels(width, height):
+    if width * height > settings.POST_IMAGE_MAX_PIXELS:
+        raise ValidationError(
+            'Картинка слишком большая: %(width)s×%(height)s точек.',
+            code='too_many_pixels',
+            params={'width': width, 'height': height},
+        )
+
+
+def _has_alpha(image):
+    return image.mode in ('RGBA', 'LA', 'PA') or (
+        image.mode == 'P' and 'transparency' in image.info)
+
+
+def _to_rgb(image, icc_profile):
+    """
+    Переводит картинку в RGB или RGBA и возвращает ее с профилем.
+
+    Профиль описывает цвета исходного режима: после перевода из CMYK
+    или оттенков серого он бы исказил результат, поэтому такие пиксели
+    переводятся в sRGB по профилю, а сам он снимается.
+    """
+    mode = 'RGBA' if _has_alpha(image) else 'RGB'
+    if image.mode in ('RGB', 'RGBA', 'P', 'PA'):
+        return image.convert(mode), icc_profile
+    if icc_profile and mode == 'RGB' and features.check('littlecms2'):
+        from PIL import ImageCms
+        try:
+            return ImageCms.profileToProfile(
+                image,
+                ImageCms.ImageCmsProfile(BytesIO(icc_profile)),
+                ImageCms.createProfile('sRGB'),
+                outputMode='RGB',
+            ), None
+        except ImageCms.PyCMSError:
+            pass
+    return image.convert(mode), None
+
+
+def normalize(upload):
+    """Возвращает уменьшенную копию загрузки без метаданных."""
+    upload.seek(0)
+    image = Image.open(upload)
+    check_pixels(*image.size)
+    if getattr(image, 'n_frames', 1) > 1:
+        raise ValidationError(
+            'Анимированные картинки не поддерживаются.', code='animated')
+    side = settings.POST_IMAGE_MAX_SIDE
+    icc_profile = image.info.get('icc_profile')
+    image.draft('RGB', (side, side))
+    image = ImageOps.exif_transpose(image)
+    image.thumbnail((side, side), Image.LANCZOS, reducing_gap=3.0)
+    image, icc_profile = _to_rgb(image, icc_profile)
+
+    buffer = BytesIO()
+    if image.mode == 'RGBA':
+        image.save(buffer, 'PNG', optimize=True, icc_profile=icc_profile)
+        extension, content_type = '.png', 'image/png'
+    else:
+        image.save(
+            buffer, 'JPEG',
+            quality=settings.POST_IMAGE_QUALITY,
+            optimize=True,
+            progressive=True,
+            icc_profile=icc_profile,
+        )
+        extension, content_type = '.jpg', 'image/jpeg'
+    name = os.path.splitext(os.path.basename(upload.name))[0] + extension
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type)
@@ -0,0 +1,107 @@
+from statistics import median
+from time import perf_counter
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count
+
+from posts.models import Follow, Post, TimelineEntry
+from posts.timeline import FeedPaginator, forget_recent, push_to_followers
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает раздачу постов при записи и слияние лент при чтении '
+        'для одного автора. Все изменения откатываются.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--author',
+            help='username автора, по умолчанию самый популярный')
+        parser.add_argument('--posts', type=int, default=10)
+        parser.add_argument('--readers', type=int, default=100)
+
+    def handle(self, *args, **options):
+        author = self.get_author(options['author'])
+        readers = list(
+            Follow.objects.filter(author=author).values_list(
+                'user_id', flat=True)[:options['readers']]
+        )
+        if not readers:
+            raise CommandError(f'У автора {author.username} нет подписчиков')
+        self.stdout.write(
+            f'Автор {author.username}: '
+            f'{Follow.objects.filter(author=author).count()} подписчиков, '
+            f'{len(readers)} читателей в замере'
+        )
+        with transaction.atomic():
+            self.compare(author, readers, options['posts'])
+            transaction.set_rollback(True)
+
+    def get_author(self, username):
+        if username:
+            try:
+                return User.objects.get(username=username)
+            except User.DoesNotExist:
+                raise CommandError(f'Автор {username} не найден')
+        author = User.objects.annotate(
+            followers=Count('following')
+        ).order_by('-followers').first()
+        if author is None:
+            raise CommandError('В базе нет пользователей')
+        return author
+
+    def compare(self, author, readers, count):
+        Post.objects.bulk_create(
+            Post(author=author, text=f'Тестовый пост {number}')
+            for number in range(count)
+        )
+        posts = list(Post.objects.filter(author=author).order_by(
+            '-pk')[:count])
+
+        started = perf_counter()
+        for post in posts:
+            push_to_followers(post)
+        fanout_write = (perf_counter() - started) / count
+        fanout_read = self.read(readers, heavy_author_ids=())
+
+        TimelineEntry.objects.filter(post__in=posts).delete()
+        started = perf_counter()
+        for post in posts:
+            forget_recent(post.author_id)
+        merge_write = (perf_counter() - started) / count
+        merge_cold = self.read(readers, (author.pk,), warm=False)
+        merge_warm = self.read(readers, (author.pk,))
+
+        self.stdout.write(f'{"стратегия":<24}{"запись, мс":>12}'
+                          f'{"чтение, мс":>12}')
+        rows = (
+            ('раздача при записи', fanout_write, fanout_read),
+            ('слияние, холодный кеш', merge_write, merge_cold),
+            ('слияние, теплый кеш', merge_write, merge_warm),
+        )
+        for name, write, read in rows:
+            self.stdout.write(
+                f'{name:<24}{write * 1000:>12.2f}{read * 1000:>12.2f}')
+
+    def read(self, readers, heavy_author_ids, warm=True):
+        """Медиана времени сборки первой страницы ленты подписок."""
+        timings = []
+        for user_id in readers:
+            if not warm:
+                for author_id in heavy_author_ids:
+                    forget_recent(author_id)
+            paginator = FeedPaginator(
+                TimelineEntry.objects.filter(user_id=user_id),
+                settings.POSTS_QUANTITY,
+                heavy_author_ids=heavy_author_ids,
+            )
+            started = perf_counter()
+            list(paginator.get_page())
+            timings.append(perf_counter() - started)
+        return median(timings)
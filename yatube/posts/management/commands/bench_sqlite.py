@@ -0,0 +1,156 @@
+import os
+import sqlite3
+import tempfile
+import threading
+from time import perf_counter
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils import timezone
+
+from core.sqlite import apply_pragmas
+from posts.models import Post
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает чтение и запись SQLite под конкурентной нагрузкой '
+        'без настроек и с SQLITE_PRAGMAS и SQLITE_TRANSACTION_MODE. '
+        'Нагрузка идет на временную копию базы, сама база не меняется.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=4)
+        parser.add_argument('--writers', type=int, default=2)
+        parser.add_argument('--seconds', type=float, default=5.0)
+
+    def handle(self, *args, **options):
+        connection = connections[DEFAULT_DB_ALIAS]
+        if connection.vendor != 'sqlite':
+            raise CommandError('Замер рассчитан только на SQLite')
+        author_id = User.objects.order_by('pk').values_list(
+            'pk', flat=True).first()
+        if author_id is None:
+            raise CommandError('В базе нет пользователей')
+        read = self.compile(Post.objects.for_feed().order_by(
+            '-pub_date', '-pk')[:11])
+        write = (
+            f'INSERT INTO {Post._meta.db_table} '
+            '(text, pub_date, author_id, group_id, image, comments_count) '
+            "VALUES (?, ?, ?, NULL, '', 0)",
+            author_id,
+        )
+        self.stdout.write(
+            f'Читателей {options["readers"]}, писателей {options["writers"]}, '
+            f'{options["seconds"]:g} с на каждый режим'
+        )
+        for title, pragmas, begin in (
+            ('без настроек', {}, 'BEGIN'),
+            ('SQLITE_PRAGMAS', None,
+             f'BEGIN {settings.SQLITE_TRANSACTION_MODE}'),
+        ):
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, 'bench.sqlite3')
+                self.copy_database(connection, path)
+                result = self.run(
+                    path, pragmas, begin, read, write, options)
+            self.report(title, result, options['seconds'])
+
+    @staticmethod
+    def compile(queryset):
+        sql, params = queryset.query.get_compiler(DEFAULT_DB_ALIAS).as_sql()
+        return sql.replace('%s', '?'), params
+
+    @staticmethod
+    def copy_database(connection, path):
+        connection.ensure_connection()
+        target = sqlite3.connect(path)
+        connection.connection.backup(target)
+        # Базовый режим: журнал отката, как у новой базы SQLite.
+        target.execute('PRAGMA journal_mode = delete')
+        target.close()
+
+    @staticmethod
+    def connect(path, pragmas):
+        # Так соединение открывает Django: автокоммит, таймаут 5 с.
+        db = sqlite3.connect(
+            path, timeout=5, isolation_level=None, check_same_thread=False)
+        apply_pragmas(db.cursor(), pragmas)
+        return db
+
+    def run(self, path, pragmas, begin, read, write, options):
+        results = {'read': [], 'write': [], 'errors': 0}
+        lock = threading.Lock()
+        clock = {}
+        # Отсчет начинается, когда все соединения открыты и прочитали схему.
+        start = threading.Barrier(
+            options['readers'] + options['writers'],
+            action=lambda: clock.update(
+                deadline=perf_counter() + options['seconds']),
+        )
+        sql, author_id = write
+
+        def select(db):
+            db.execute(*read).fetchall()
+
+        def insert(db):
+            db.execute(begin)
+            db.execute(sql, (
+                'Пост замера', timezone.now().isoformat(' '), author_id))
+            db.execute('COMMIT')
+
+        def work(kind, operation):
+            db = self.connect(path, pragmas)
+            select(db)
+            start.wait()
+            timings, errors = self.measure(db, operation, clock['deadline'])
+            db.close()
+            with lock:
+                results[kind] += timings
+                results['errors'] += errors
+
+        threads = [
+            threading.Thread(target=work, args=('read', select))
+            for _ in range(options['readers'])
+        ] + [
+            threading.Thread(target=work, args=('write', insert))
+            for _ in range(options['writers'])
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    @staticmethod
+    def measure(db, operation, deadline):
+        """Время каждой удачной операции до срока и число блокировок."""
+        timings, errors = [], 0
+        while perf_counter() < deadline:
+            started = perf_counter()
+            try:
+                operation(db)
+            except sqlite3.OperationalError:
+                errors += 1
+                if db.in_transaction:
+                    db.execute('ROLLBACK')
+                continue
+            timings.append(perf_counter() - started)
+        return timings, errors
+
+    def report(self, title, result, seconds):
+        def describe(timings):
+            if not timings:
+                return '0/с'
+            p95 = sorted(timings)[int(len(timings) * 0.95)] * 1000
+            return f'{len(timings) / seconds:.0f}/с, p95 {p95:.1f} мс'
+
+        self.stdout.write(
+            f'{title}: чтение {describe(result["read"])}; '
+            f'запись {describe(result["write"])}; '
+            f'ошибок блокировки {result["errors"]}'
+        )
@@ -0,0 +1,27 @@
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+
+from posts import search
+
+
+class Command(BaseCommand):
+    help = (
+        'Заново строит полнотекстовый индекс постов и восстанавливает '
+        'триггеры, которые поддерживают его в актуальном состоянии.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        if connection.vendor != 'sqlite':
+            self.stderr.write('Индекс FTS5 есть только в SQLite.')
+            return
+        started = perf_counter()
+        with transaction.atomic(using=options['database']):
+            search.rebuild(connection)
+        self.stdout.write(
+            f'Индекс перестроен за {perf_counter() - started:.1f} с')
@@ -0,0 +1,56 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, Max
+
+from posts.counters import COUNTERS, count_subquery
+from posts.models import Profile
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает денормализованные счетчики постов, комментариев '
+        'и подписок пачками по диапазонам первичного ключа.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        created = self.create_profiles(batch_size)
+        self.stdout.write(f'Создано профилей: {created}')
+        for model, field, related, related_field in COUNTERS:
+            changed = self.recount(
+                model, field, related, related_field, batch_size)
+            self.stdout.write(
+                f'{model._meta.label}.{field}: исправлено {changed}')
+
+    def create_profiles(self, batch_size):
+        created = 0
+        last_pk = User.objects.aggregate(last=Max('pk'))['last'] or 0
+        for start in range(0, last_pk + 1, batch_size):
+            missing = User.objects.filter(
+                pk__gte=start, pk__lt=start + batch_size, profile=None
+            ).values_list('pk', flat=True)
+            profiles = [Profile(user_id=pk) for pk in missing]
+            Profile.objects.bulk_create(profiles, ignore_conflicts=True)
+            created += len(profiles)
+        return created
+
+    def recount(self, model, field, related, related_field, batch_size):
+        """Обновляет только разошедшиеся значения, пачка за транзакцию."""
+        changed = 0
+        last_pk = model.objects.aggregate(last=Max('pk'))['last'] or 0
+        for start in range(0, last_pk + 1, batch_size):
+            with transaction.atomic():
+                changed += model.objects.filter(
+                    pk__gte=start, pk__lt=start + batch_size
+                ).annotate(
+                    actual=count_subquery(related, related_field)
+                ).exclude(**{field: F('actual')}).update(
+                    **{field: count_subquery(related, related_field)}
+                )
+        return changed
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from posts import bulk
+from posts.models import BulkJob
+
+
+class Command(BaseCommand):
+    help = (
+        'Досчитывает фоновые операции админки, прерванные падением '
+        'процесса или ошибкой, с места остановки.'
+    )
+
+    def handle(self, *args, **options):
+        pending = BulkJob.objects.exclude(status=BulkJob.DONE).order_by('pk')
+        for job_id in pending.values_list('pk', flat=True):
+            job = bulk.run(job_id)
+            self.stdout.write(
+                f'{job}: {job.get_status_display()}, '
+                f'{job.done} из {job.total}')
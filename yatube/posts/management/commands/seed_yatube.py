@@ -0,0 +1,303 @@
+import random
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from io import BytesIO
+from itertools import accumulate
+from time import perf_counter
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection, connections, router, transaction
+from django.db.models import F, Max
+from django.utils import timezone
+from PIL import Image
+
+from core.models import StoredFile
+from posts.models import Comment, Follow, Group, Post, Profile, TimelineEntry
+
+User = get_user_model()
+
+WORDS = (
+    'яндекс практикум лента пост автор группа подписка комментарий '
+    'картинка текст новость жизнь город кот собака код django python '
+    'утро вечер чай кофе книга фильм музыка поход море горы работа'
+).split()
+
+
+@contextmanager
+def explicit_dates(*fields):
+    """Отключает auto_now_add, чтобы сохранить сгенерированные даты."""
+    saved = [(field, field.auto_now_add) for field in fields]
+    for field, _ in saved:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, value in saved:
+            field.auto_now_add = value
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполняет базу синтетическими пользователями, группами, постами, '
+        'комментариями и степенным графом подписок для нагрузочных тестов.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--groups', type=int, default=20)
+        parser.add_argument('--posts', type=int, default=10000)
+        parser.add_argument('--comments', type=int, default=20000)
+        parser.add_argument(
+            '--follows', type=int, default=20,
+            help='среднее число подписок на пользователя')
+        parser.add_argument(
+            '--alpha', type=float, default=1.2,
+            help='показатель степенного закона популярности авторов')
+        parser.add_argument(
+            '--image-ratio', type=float, default=0.0,
+            help='доля постов с картинкой')
+        parser.add_argument('--days', type=int, default=365)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--prefix', default='seed')
+        parser.add_argument(
+            '--skip-derived', action='store_true',
+            help='не пересчитывать счетчики и ленты подписок')
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.prefix = options['prefix']
+        self.start = timezone.make_aware(datetime(2020, 1, 1))
+        self.span = timedelta(days=options['days']).total_seconds()
+
+        user_ids = self.seed_users(options['users'])
+        group_ids = self.seed_groups(options['groups'])
+        weights = self.popularity(user_ids, options['alpha'])
+        post_ids = self.seed_posts(
+            options['posts'], user_ids, weights, group_ids,
+            options['image_ratio'])
+        self.seed_comments(options['comments'], user_ids, post_ids)
+        self.seed_follows(options['follows'], user_ids, weights)
+        if not options['skip_derived']:
+            self.timed('Счетчики', lambda: call_command(
+                'recount', batch_size=self.batch_size, stdout=self.stdout))
+            self.timed('Ленты подписок', self.build_timelines)
+
+    def timed(self, label, action):
+        started = perf_counter()
+        rows = action()
+        elapsed = perf_counter() - started
+        if rows is None:
+            self.stdout.write(f'{label}: {elapsed:.1f} с')
+        else:
+            self.stdout.write(
+                f'{label}: {rows} строк за {elapsed:.1f} с '
+                f'({rows / max(elapsed, 1e-9):.0f} строк/с)')
+
+    def insert(self, model, rows):
+        """Вставляет объекты пачками, каждая пачка в своей транзакции."""
+        batch = []
+        total = 0
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                total += self.flush(model, batch)
+                batch = []
+        if batch:
+            total += self.flush(model, batch)
+        return total
+
+    def flush(self, model, batch):
+        """
+        Вставляет пачку и возвращает число действительно вставленных строк.
+
+        ignore_conflicts молча пропускает дубли, поэтому строки считаются
+        по rowcount каждого INSERT, а не по длине пачки.
+        """
+        inserted = 0
+
+        def count_rows(execute, sql, params, many, context):
+            nonlocal inserted
+            result = execute(sql, params, many, context)
+            inserted += max(context['cursor'].rowcount, 0)
+            return result
+
+        using = router.db_for_write(model)
+        with transaction.atomic(using=using), \
+                connections[using].execute_wrapper(count_rows):
+            model.objects.bulk_create(batch, ignore_conflicts=True)
+        return inserted
+
+    def new_ids(self, model, action):
+        """Выполняет вставку и возвращает диапазон новых первичных ключей."""
+        first = (model.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+        action()
+        last = model.objects.aggregate(last=Max('pk'))['last'] or 0
+        return range(first, last + 1)
+
+    def ids_by(self, model, field, values):
+        """
+        Первичные ключи строк с field из values.
+
+        При повторном запуске с тем же префиксом строки уже есть и не
+        вставляются, поэтому ключи ищутся по именам, а не по Max(pk).
+        """
+        values = set(values)
+        rows = model.objects.filter(**{
+            f'{field}__startswith': self.prefix,
+        }).order_by('pk').values_list('pk', field)
+        return [pk for pk, value in rows.iterator() if value in values]
+
+    def random_date(self):
+        return self.start + timedelta(seconds=self.rng.random() * self.span)
+
+    def text(self, low, high):
+        return ' '.join(self.rng.choices(WORDS, k=self.rng.randint(low, high)))
+
+    def seed_users(self, count):
+        password = make_password(self.prefix)
+        names = [f'{self.prefix}{number}' for number in range(count)]
+        self.timed('Пользователи', lambda: self.insert(User, (
+            User(username=name, password=password) for name in names)))
+        ids = self.ids_by(User, 'username', names)
+        self.insert(Profile, (Profile(user_id=pk) for pk in ids))
+        return ids
+
+    def seed_groups(self, count):
+        slugs = [f'{self.prefix}-group-{number}' for number in range(count)]
+        self.timed('Группы', lambda: self.insert(Group, (
+            Group(
+                title=f'Группа {number}',
+                slug=slug,
+                description=self.text(5, 20),
+            )
+            for number, slug in enumerate(slugs)
+        )))
+        return self.ids_by(Group, 'slug', slugs)
+
+    def popularity(self, user_ids, alpha):
+        """Накопленные веса Ципфа: немногие авторы получают почти всё."""
+        ranks = list(range(1, len(user_ids) + 1))
+        self.rng.shuffle(ranks)
+        return list(accumulate(1 / rank ** alpha for rank in ranks))
+
+    def seed_images(self, count):
+        field = Post._meta.get_field('image')
+        names = []
+        for number in range(count):
+            image = Image.new('RGB', (960, 339), tuple(
+                self.rng.randrange(256) for _ in range(3)))
+            buffer = BytesIO()
+            image.save(buffer, 'JPEG')
+            names.append(field.storage.save(
+                field.generate_filename(None, f'{self.prefix}_{number}.jpg'),
+                ContentFile(buffer.getvalue())))
+        return names
+
+    def count_image_refs(self, names, used):
+        """Приводит счетчики ссылок картинок к числу постов с ними."""
+        storage = Post._meta.get_field('image').storage
+        for name in names:
+            if used[name]:
+                StoredFile.objects.filter(name=name).update(
+                    refs=F('refs') + used[name] - 1)
+            else:
+                storage.delete(name)
+
+    def seed_posts(self, count, user_ids, weights, group_ids, image_ratio):
+        images = self.seed_images(10) if image_ratio else []
+        used = Counter()
+        group_ids = list(group_ids)
+
+        def posts():
+            for _ in range(count):
+                author_id, = self.rng.choices(user_ids, cum_weights=weights)
+                has_group = group_ids and self.rng.random() < 0.5
+                has_image = images and self.rng.random() < image_ratio
+                image = self.rng.choice(images) if has_image else ''
+                used[image] += 1
+                yield Post(
+                    text=self.text(5, 60),
+                    author_id=author_id,
+                    group_id=self.rng.choice(group_ids) if has_group else None,
+                    image=image,
+                    pub_date=self.random_date(),
+                )
+
+        with explicit_dates(Post._meta.get_field('pub_date')):
+            ids = self.new_ids(Post, lambda: self.timed(
+                'Посты', lambda: self.insert(Post, posts())))
+        self.count_image_refs(images, used)
+        return ids
+
+    def seed_comments(self, count, user_ids, post_ids):
+        if not post_ids:
+            return
+
+        def comments():
+            for _ in range(count):
+                yield Comment(
+                    post_id=self.rng.choice(post_ids),
+                    author_id=self.rng.choice(user_ids),
+                    text=self.text(3, 30),
+                    created=self.random_date(),
+                )
+
+        with explicit_dates(Comment._meta.get_field('created')):
+            self.timed('Комментарии', lambda: self.insert(
+                Comment, comments()))
+
+    def seed_follows(self, mean, user_ids, weights):
+        def follows():
+            for user_id in user_ids:
+                wanted = min(
+                    int(self.rng.expovariate(1 / mean)) if mean else 0,
+                    len(user_ids) - 1,
+                )
+                authors = set(self.rng.choices(
+                    user_ids, cum_weights=weights, k=wanted))
+                authors.discard(user_id)
+                for author_id in authors:
+                    yield Follow(user_id=user_id, author_id=author_id)
+
+        self.timed('Подписки', lambda: self.insert(Follow, follows()))
+
+    def build_timelines(self):
+        """
+        Раскладывает последние посты авторов в ленты их подписчиков.
+
+        Строки копируются одним INSERT ... SELECT на автора, не проходя
+        через Python.
+        """
+        heavy = set(Profile.objects.filter(
+            followers_count__gte=settings.FEED_FANOUT_THRESHOLD
+        ).values_list('user_id', flat=True))
+        authors = list(Follow.objects.order_by('author_id').values_list(
+            'author_id', flat=True).distinct())
+        sql = (
+            f'INSERT INTO {TimelineEntry._meta.db_table} '
+            '(user_id, post_id, pub_date) '
+            'SELECT follow.user_id, recent.id, recent.pub_date '
+            f'FROM {Follow._meta.db_table} follow, ('
+            f'  SELECT id, pub_date FROM {Post._meta.db_table} '
+            '  WHERE author_id = %s ORDER BY pub_date DESC, id DESC LIMIT %s'
+            ') recent WHERE follow.author_id = %s '
+            'ON CONFLICT DO NOTHING'
+        )
+        total = 0
+        for start in range(0, len(authors), self.batch_size):
+            with transaction.atomic(), connection.cursor() as cursor:
+                for author_id in authors[start:start + self.batch_size]:
+                    if author_id in heavy:
+                        continue
+                    cursor.execute(sql, (
+                        author_id, settings.TIMELINE_BACKFILL, author_id))
+                    total += cursor.rowcount
+        return total
@@ -0,0 +1,48 @@
+# Generated by Django 2.2.16 on 2026-10-17 05:04
+
+from django.db import migrations, models
+
+# AlterField в SQLite пересоздает таблицу целиком и теряет триггеры
+# поиска, поэтому индексы создаются напрямую, а AlterField меняет
+# только состояние моделей.
+INDEXES = (
+    ('posts_comment_created_37e64f18', 'posts_comment', 'created'),
+    ('posts_post_pub_date_131c7f8d', 'posts_post', 'pub_date'),
+)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0009_post_search_index'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(
+                    f'CREATE INDEX "{name}" ON "{table}" ("{column}")',
+                    f'DROP INDEX "{name}"',
+                )
+                for name, table, column in INDEXES
+            ],
+            state_operations=[
+                migrations.AlterField(
+                    model_name='comment',
+                    name='created',
+                    field=models.DateTimeField(
+                        auto_now_add=True, db_index=True),
+                ),
+                migrations.AlterField(
+                    model_name='post',
+                    name='pub_date',
+                    field=models.DateTimeField(
+                        auto_now_add=True,
+                        db_index=True,
+                        help_text='Дата публикации поста',
+                        verbose_name='Дата пуликации',
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 2.2.16 on 2026-10-17 05:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0015_timeline_post_do_nothing'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BulkJobItem',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('post_id', models.BigIntegerField(verbose_name='id поста')),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='posts.BulkJob')),
+            ],
+            options={
+                'verbose_name': 'Пост фоновой операции',
+                'verbose_name_plural': 'Посты фоновой операции',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='bulkjobitem',
+            constraint=models.UniqueConstraint(fields=('job', 'post_id'), name='bulk_item_unique'),
+        ),
+    ]
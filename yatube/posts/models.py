@@ -1,5 +1,12 @@
+import json
+
 from django.contrib.auth import get_user_model
 from django.db import models
+from django.db.models import Lookup
+
+from core.sharding import (ShardedModel, ShardedQuerySet, shard_by_id,
+                           shard_by_key)
+from core.storage import ContentAddressedStorage
 
 User = get_user_model()
 
@@ -13,6 +20,8 @@ class Group(models.Model):
     slug = models.SlugField('Адрес', unique=True, help_text='Адрес группы')
     description = models.TextField(
         'Описание', help_text='Описание группы')
+    posts_count = models.PositiveIntegerField(
+        'Число постов', default=0, editable=False)
 
     class Meta:
         verbose_name = 'Группа'
@@ -21,11 +30,29 @@ class Group(models.Model):
         return self.title
 
 
-class Post(models.Model):
+class PostQuerySet(ShardedQuerySet):
+    FEED_FIELDS = (
+        'text',
+        'pub_date',
+        'image',
+        'author__username',
+        'author__first_name',
+        'author__last_name',
+        'group__title',
+        'group__slug',
+    )
+
+    def for_feed(self):
+        """Посты с автором и группой одним запросом и только нужные поля."""
+        return self.select_related('author', 'group').only(*self.FEED_FIELDS)
+
+
+class Post(ShardedModel):
     text = models.TextField('Текст', help_text='Текст поста')
     pub_date = models.DateTimeField('Дата пуликации',
                                     help_text='Дата публикации поста',
-                                    auto_now_add=True,)
+                                    auto_now_add=True,
+                                    db_index=True)
     author = models.ForeignKey(
         User,
         verbose_name='Автор',
@@ -46,19 +73,48 @@ class Post(models.Model):
     image = models.ImageField(
         'Картинка',
         upload_to='posts/',
+        storage=ContentAddressedStorage(),
         blank=True
     )
+    comments_count = models.PositiveIntegerField(
+        'Число комментариев', default=0, editable=False)
+
+    objects = PostQuerySet.as_manager()
 
     class Meta:
         ordering = ('-pub_date',)
         verbose_name = 'Пост'
         verbose_name_plural = 'Посты'
+        indexes = [
+            models.Index(
+                fields=('group', '-pub_date', '-id'),
+                name='post_group_date_idx'),
+            models.Index(
+                fields=('author', '-pub_date', '-id'),
+                name='post_author_date_idx'),
+            # Посты с картинкой: сброс лент после построения миниатюр.
+            models.Index(fields=('image',), name='post_image_idx'),
+        ]
 
     def __str__(self):
         return (self.text[:15])
 
+    def get_shard(self):
+        # Посты автора лежат вместе: профиль читает один шард.
+        return shard_by_key(self.author_id)
+
+    @classmethod
+    def shard_for_related(cls, instance):
+        if isinstance(instance, User):
+            return shard_by_key(instance.pk)
+        return None
 
-class Comment(models.Model):
+
+class CommentQuerySet(ShardedQuerySet):
+    pass
+
+
+class Comment(ShardedModel):
     post = models.ForeignKey(Post,
                              on_delete=models.CASCADE,
                              related_name='comments',
@@ -71,14 +127,29 @@ class Comment(models.Model):
         'Текст комментария',
         help_text='Введите текст комментария'
     )
-    created = models.DateTimeField(auto_now_add=True)
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    objects = CommentQuerySet.as_manager()
 
     def __str__(self):
         return (f'Комментарий {self.author.username} к посту {self.post.id}')
 
+    def get_shard(self):
+        # Комментарии лежат в шарде поста: страница поста читает один шард.
+        return shard_by_id(self.post_id)
+
+    @classmethod
+    def shard_for_related(cls, instance):
+        if isinstance(instance, Post):
+            return shard_by_id(instance.pk)
+        return None
+
     class Meta:
         constraints = [models.UniqueConstraint(
             fields=('post', 'author'), name='unique_object')]
+        indexes = [models.Index(
+            fields=('post', 'created', 'id'),
+            name='comment_post_created_idx')]
 
 
 class Follow(models.Model):
@@ -92,7 +163,162 @@ class Follow(models.Model):
     class Meta:
         constraints = [models.UniqueConstraint(
             fields=('user', 'author'), name='unique_object')]
+        # Подписчики автора: раздача постов и счетчики без чтения таблицы.
+        indexes = [models.Index(
+            fields=('author', 'user'), name='follow_author_user_idx')]
 
     def __str__(self) -> str:
         return (f'Подписка {self.user.username}'
                 f' на автора {self.author.username}')
+
+
+class Profile(models.Model):
+    """Счетчики пользователя, которые иначе пришлось бы считать COUNT(*)."""
+    user = models.OneToOneField(User,
+                                on_delete=models.CASCADE,
+                                primary_key=True,
+                                related_name='profile')
+    posts_count = models.PositiveIntegerField('Число постов', default=0)
+    followers_count = models.PositiveIntegerField(
+        'Число подписчиков', default=0)
+    following_count = models.PositiveIntegerField('Число подписок', default=0)
+
+    class Meta:
+        verbose_name = 'Профиль'
+        verbose_name_plural = 'Профили'
+
+    def __str__(self) -> str:
+        return f'Профиль {self.user_id}'
+
+
+class TimelineEntry(models.Model):
+    """Запись материализованной ленты подписок пользователя."""
+    user = models.ForeignKey(User,
+                             on_delete=models.CASCADE,
+                             related_name='timeline')
+    # Пост может лежать в другом шарде: без ограничения внешнего ключа,
+    # записи удаляет сигнал, а не каскад в базе поста.
+    post = models.ForeignKey(Post,
+                             on_delete=models.DO_NOTHING,
+                             related_name='timeline_entries',
+                             db_constraint=False)
+    pub_date = models.DateTimeField('Дата публикации')
+
+    class Meta:
+        ordering = ('-pub_date', '-post')
+        constraints = [models.UniqueConstraint(
+            fields=('user', 'post'), name='unique_timeline_entry')]
+        indexes = [models.Index(
+            fields=('user', '-pub_date', '-post'),
+            name='timeline_user_date_idx')]
+
+    def __str__(self) -> str:
+        return f'Пост {self.post_id} в ленте {self.user_id}'
+
+
+class BulkJob(models.Model):
+    """
+    Фоновая массовая операция админки.
+
+    Строки обрабатываются пачками по возрастанию id. Шаг и последний
+    обработанный id сохраняются в той же транзакции, что и пачка, поэтому
+    после сбоя работа продолжается с места остановки.
+    """
+    DELETE = 'delete'
+    MOVE = 'move'
+    PURGE = 'purge'
+    ACTIONS = (
+        (DELETE, 'Удаление постов'),
+        (MOVE, 'Перенос постов в группу'),
+        (PURGE, 'Удаление постов и комментариев автора'),
+    )
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = (
+        (QUEUED, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Готово'),
+        (FAILED, 'Ошибка'),
+    )
+
+    action = models.CharField('Операция', max_length=16, choices=ACTIONS)
+    params = models.TextField('Параметры', default='{}')
+    status = models.CharField(
+        'Состояние', max_length=16, choices=STATUSES, default=QUEUED)
+    step = models.PositiveSmallIntegerField('Шаг', default=0)
+    last_id = models.BigIntegerField('Последний id', default=0)
+    done = models.PositiveIntegerField('Обработано', default=0)
+    total = models.PositiveIntegerField('Всего', default=0)
+    error = models.TextField('Ошибка', blank=True)
+    created_by = models.ForeignKey(User,
+                                   verbose_name='Кто запустил',
+                                   on_delete=models.SET_NULL,
+                                   null=True,
+                                   related_name='+')
+    created = models.DateTimeField('Создана', auto_now_add=True)
+    updated = models.DateTimeField('Изменена', auto_now=True)
+
+    class Meta:
+        ordering = ('-pk',)
+        verbose_name = 'Фоновая операция'
+        verbose_name_plural = 'Фоновые операции'
+
+    def __str__(self) -> str:
+        return f'{self.get_action_display()} #{self.pk}'
+
+    @property
+    def options(self):
+        """Параметры операции: словарь из JSON в поле params."""
+        return json.loads(self.params)
+
+
+class BulkJobItem(models.Model):
+    """Пост из выборки фоновой операции: выборка читается поиском по id."""
+    job = models.ForeignKey(BulkJob,
+                            on_delete=models.CASCADE,
+                            related_name='items')
+    post_id = models.BigIntegerField('id поста')
+
+    class Meta:
+        verbose_name = 'Пост фоновой операции'
+        verbose_name_plural = 'Посты фоновой операции'
+        constraints = [models.UniqueConstraint(
+            fields=('job', 'post_id'), name='bulk_item_unique')]
+
+
+class SearchTextField(models.TextField):
+    """Колонка виртуальной таблицы FTS5 с поиском через MATCH."""
+
+
+@SearchTextField.register_lookup
+class Match(Lookup):
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', lhs_params + rhs_params
+
+
+class PostSearchIndex(models.Model):
+    """
+    Полнотекстовый индекс постов: виртуальная таблица FTS5.
+
+    Таблица хранит только индекс, текст читается из posts_post.
+    Синхронизацию ведут триггеры, см. posts.search.
+    """
+    post = models.OneToOneField(
+        Post,
+        primary_key=True,
+        db_column='rowid',
+        on_delete=models.DO_NOTHING,
+        related_name='+',
+    )
+    text = SearchTextField()
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = 'posts_post_fts'
@@ -0,0 +1,159 @@
+"""
+Полнотекстовый поиск по постам на SQLite FTS5.
+
+posts_post_fts - индекс с внешним содержимым: текст хранится только
+в posts_post, а триггеры на вставку, удаление и изменение текста
+поддерживают индекс в той же транзакции, что и сам пост, в том числе
+при bulk_create и queryset.update().
+"""
+import hashlib
+import re
+import secrets
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Page
+from django.db import connection
+
+from core.paginators import CursorPaginator, decode_cursor, encode_cursor
+
+from .models import Post, PostSearchIndex
+
+TABLE = PostSearchIndex._meta.db_table
+
+SCHEMA = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} USING fts5("
+    f"text, content='posts_post', content_rowid='id', "
+    f"tokenize='unicode61 remove_diacritics 2')",
+    f"CREATE TRIGGER IF NOT EXISTS {TABLE}_insert "
+    f"AFTER INSERT ON posts_post BEGIN "
+    f"INSERT INTO {TABLE}(rowid, text) VALUES (new.id, new.text); END",
+    f"CREATE TRIGGER IF NOT EXISTS {TABLE}_delete "
+    f"AFTER DELETE ON posts_post BEGIN "
+    f"INSERT INTO {TABLE}({TABLE}, rowid, text) "
+    f"VALUES ('delete', old.id, old.text); END",
+    f"CREATE TRIGGER IF NOT EXISTS {TABLE}_update "
+    f"AFTER UPDATE OF text ON posts_post BEGIN "
+    f"INSERT INTO {TABLE}({TABLE}, rowid, text) "
+    f"VALUES ('delete', old.id, old.text); "
+    f"INSERT INTO {TABLE}(rowid, text) VALUES (new.id, new.text); END",
+)
+
+# Префикс короче этого совпадает со слишком многими словами.
+MIN_PREFIX = 3
+
+
+def install(using=connection):
+    """Создает индекс и триггеры, если их нет."""
+    if using.vendor != 'sqlite':
+        return
+    with using.cursor() as cursor:
+        for statement in SCHEMA:
+            cursor.execute(statement)
+
+
+def restore_triggers(using=connection):
+    """
+    Возвращает триггеры после миграций.
+
+    Меняя поля, SQLite пересоздает таблицу posts_post и теряет ее
+    триггеры. Индекс при этом не устаревает: id постов сохраняются.
+    """
+    if using.vendor == 'sqlite' and (
+            TABLE in using.introspection.table_names()):
+        install(using)
+
+
+def rebuild(using=connection):
+    """Заново строит индекс по posts_post и сжимает его."""
+    install(using)
+    with using.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {TABLE}({TABLE}) VALUES ('rebuild')")
+        cursor.execute(f"INSERT INTO {TABLE}({TABLE}) VALUES ('optimize')")
+
+
+def expression(query):
+    """
+    Безопасный запрос FTS5 из пользовательского ввода.
+
+    Каждое слово берется в кавычки, поэтому операторы FTS5 в вводе
+    не работают; последнее слово ищется как префикс.
+    """
+    words = re.findall(r'\w+', query.lower())
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    if len(words[-1]) >= MIN_PREFIX:
+        terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def matching(query):
+    """Строки индекса, подходящие под запрос, или None для пустого."""
+    match = expression(query)
+    if match is None:
+        return None
+    return PostSearchIndex.objects.filter(text__match=match)
+
+
+def ranked(query):
+    """
+    Строки индекса по запросу от самых релевантных, или None для пустого.
+
+    ORDER BY rank с LIMIT FTS5 выполняет сам: bm25 считается для всех
+    совпадений, но в памяти держатся только лучшие строки.
+    """
+    rows = matching(query)
+    if rows is None:
+        return None
+    return rows.order_by('rank')
+
+
+class SearchPaginator(CursorPaginator):
+    """
+    Результаты поиска по убыванию релевантности.
+
+    Первая страница запоминает в кеше id SEARCH_MAX_RESULTS лучших
+    совпадений под случайным номером выдачи. Курсор - пара (номер
+    выдачи, позиция в ней): bm25 меняется вместе с корпусом, а список
+    нет, поэтому страницы одной выдачи не повторяют и не теряют строк.
+    Из базы поднимаются только посты текущей страницы.
+    """
+
+    parse_value = int
+
+    def __init__(self, object_list, per_page, query=''):
+        super().__init__(object_list, per_page)
+        self.query_digest = hashlib.sha256(query.encode()).hexdigest()[:16]
+
+    def results(self, token):
+        """id постов выдачи token; истекшая выдача ранжируется заново."""
+        key = f'posts:search:{self.query_digest}:{token}'
+        ids = cache.get(key)
+        if ids is None:
+            ids = list(self.object_list.values_list(
+                'post', flat=True)[:settings.SEARCH_MAX_RESULTS])
+            cache.set(key, ids, settings.SEARCH_SNAPSHOT_TIMEOUT)
+        return ids
+
+    def get_page(self, after=None, before=None):
+        cursor = decode_cursor(before, int) if before else None
+        if cursor is not None:
+            token, end = cursor
+            start = max(end - self.per_page, 0)
+        else:
+            cursor = decode_cursor(after, int) if after else None
+            token, start = cursor or (secrets.randbits(63), 0)
+            start = max(start, 0)
+        end = start + self.per_page
+        results = self.results(token)
+        ids = results[start:end]
+        self.has_next = end < len(results)
+        self.number = 2 if start else 1
+        posts = Post.objects.for_feed().in_bulk(ids)
+        page = Page(
+            [posts[pk] for pk in ids if pk in posts], self.number, self)
+        page.next_cursor = (
+            encode_cursor(token, end) if self.has_next else None)
+        page.previous_cursor = encode_cursor(token, start) if start else None
+        return page
@@ -0,0 +1,228 @@
+from django.contrib.auth import get_user_model
+from django.db import connections
+from django.conf import settings
+from django.db.models.signals import (
+    post_delete, post_migrate, post_save, pre_delete, pre_save)
+from django.dispatch import receiver
+
+from . import counters, feed_cache, search, thumbnails, timeline
+from .models import Comment, Follow, Group, Post, Profile, TimelineEntry
+
+User = get_user_model()
+
+
+@receiver(post_save, sender=User)
+def create_profile(sender, instance, created, **kwargs):
+    if created:
+        Profile.objects.get_or_create(user=instance)
+
+
+# Поля пользователя, которые видны в лентах и профиле.
+SHOWN_USER_FIELDS = {'username', 'first_name', 'last_name'}
+
+
+@receiver(post_save, sender=User)
+def reset_author_pages(sender, instance, created, update_fields=None,
+                       **kwargs):
+    """
+    Сбрасывает ленты с постами пользователя, когда меняется его имя.
+
+    Сохранения только last_login при входе и другие служебные
+    update_fields ленты не трогают.
+    """
+    if created or (update_fields and not SHOWN_USER_FIELDS & update_fields):
+        return
+    feed_cache.bump('author', instance.pk)
+    feed_cache.bump('index')
+    group_ids = Post.objects.on_shard(key=instance.pk).filter(
+        author_id=instance.pk, group__isnull=False,
+    ).order_by().values_list('group_id', flat=True).distinct()
+    for group_id in group_ids:
+        feed_cache.bump('group', group_id)
+
+
+@receiver(pre_save, sender=Post)
+def remember_saved_state(sender, instance, **kwargs):
+    instance._saved_author_id = instance._saved_group_id = None
+    instance._saved_image = None
+    # Новый файл еще не сохранен: FileField запишет его после сигнала.
+    instance._image_uploaded = not instance.image._committed
+    if instance.pk is not None:
+        (instance._saved_author_id, instance._saved_group_id,
+         instance._saved_image) = (
+            Post.objects.on_shard(pk=instance.pk).filter(
+                pk=instance.pk
+            ).values_list('author_id', 'group_id', 'image').first()
+            or (None, None, None))
+
+
+@receiver(post_save, sender=Post)
+def count_post(sender, instance, created, **kwargs):
+    if created:
+        counters.bump_profile(instance.author_id, 'posts_count', 1)
+        counters.bump_group(instance.group_id, 1)
+        return
+    if instance._saved_author_id != instance.author_id:
+        counters.bump_profile(instance._saved_author_id, 'posts_count', -1)
+        counters.bump_profile(instance.author_id, 'posts_count', 1)
+    if instance._saved_group_id != instance.group_id:
+        counters.bump_group(instance._saved_group_id, -1)
+        counters.bump_group(instance.group_id, 1)
+
+
+@receiver(post_delete, sender=Post)
+def uncount_post(sender, instance, **kwargs):
+    counters.bump_profile(instance.author_id, 'posts_count', -1)
+    counters.bump_group(instance.group_id, -1)
+
+
+@receiver(post_save, sender=Post)
+def push_post_to_timelines(sender, instance, created, **kwargs):
+    if created:
+        timeline.fan_out(instance)
+
+
+@receiver(post_delete, sender=Post)
+def forget_recent_posts(sender, instance, **kwargs):
+    timeline.forget_recent(instance.author_id)
+
+
+@receiver(post_delete, sender=Post)
+def drop_timeline_entries(sender, instance, **kwargs):
+    # Ленты лежат в default, а пост мог удаляться в своем шарде.
+    TimelineEntry.objects.filter(post_id=instance.pk).delete()
+
+
+@receiver(post_save, sender=Post)
+def reset_feed_fragments(sender, instance, **kwargs):
+    feed_cache.bump_for_post(
+        instance,
+        getattr(instance, '_saved_group_id', None),
+        getattr(instance, '_saved_author_id', None),
+    )
+
+
+@receiver(post_delete, sender=Post)
+def reset_deleted_post_fragments(sender, instance, **kwargs):
+    feed_cache.bump_for_post(instance)
+
+
+@receiver(post_save, sender=Post)
+def release_replaced_image(sender, instance, created, **kwargs):
+    """
+    Освобождает прежнюю картинку поста после замены.
+
+    Повторная загрузка того же содержимого дает то же имя, но уже
+    добавила ссылку, поэтому старая ссылка освобождается и тогда.
+    """
+    saved = getattr(instance, '_saved_image', None)
+    if created or not saved:
+        return
+    if (saved != instance.image.name
+            or getattr(instance, '_image_uploaded', False)):
+        instance.image.storage.delete(saved)
+
+
+@receiver(post_delete, sender=Post)
+def release_image(sender, instance, **kwargs):
+    if instance.image:
+        instance.image.storage.delete(instance.image.name)
+
+
+@receiver(post_save, sender=Post)
+def build_thumbnails(sender, instance, **kwargs):
+    thumbnails.schedule(instance.image.name)
+
+
+def _group_author_ids(group_id):
+    """Авторы постов группы во всех шардах."""
+    author_ids = set()
+    for alias in settings.DATABASE_SHARDS:
+        author_ids.update(Post.objects.using(alias).filter(
+            group_id=group_id,
+        ).order_by().values_list('author_id', flat=True).distinct())
+    return author_ids
+
+
+@receiver(pre_delete, sender=Group)
+def remember_group_authors(sender, instance, **kwargs):
+    # После удаления group_id постов обнуляется UPDATE без сигналов.
+    instance._author_ids = _group_author_ids(instance.pk)
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def reset_group_fragments(sender, instance, **kwargs):
+    """
+    Сбрасывает ленты, где видны название и ссылка группы.
+
+    Кроме страницы группы это главная и профили авторов ее постов.
+    """
+    feed_cache.bump('group', instance.pk)
+    feed_cache.bump('index')
+    author_ids = getattr(instance, '_author_ids', None)
+    if author_ids is None:
+        author_ids = _group_author_ids(instance.pk)
+    for author_id in author_ids:
+        feed_cache.bump('author', author_id)
+
+
+@receiver(post_save, sender=Comment)
+def count_comment(sender, instance, created, **kwargs):
+    if created:
+        counters.bump_post(instance.post_id, 1)
+
+
+@receiver(post_delete, sender=Comment)
+def uncount_comment(sender, instance, **kwargs):
+    counters.bump_post(instance.post_id, -1)
+
+
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def reset_post_page(sender, instance, **kwargs):
+    feed_cache.bump('post', instance.post_id)
+
+
+@receiver(post_save, sender=Follow)
+def count_follow(sender, instance, created, **kwargs):
+    if created:
+        counters.bump_profile(instance.author_id, 'followers_count', 1)
+        counters.bump_profile(instance.user_id, 'following_count', 1)
+
+
+@receiver(post_delete, sender=Follow)
+def uncount_follow(sender, instance, **kwargs):
+    counters.bump_profile(instance.author_id, 'followers_count', -1)
+    counters.bump_profile(instance.user_id, 'following_count', -1)
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def reset_follow_profiles(sender, instance, **kwargs):
+    # Профили обоих показывают счетчики подписок.
+    feed_cache.bump('author', instance.user_id)
+    feed_cache.bump('author', instance.author_id)
+
+
+@receiver(post_save, sender=Follow)
+def backfill_timeline(sender, instance, created, **kwargs):
+    if created:
+        timeline.backfill(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def prune_timeline(sender, instance, **kwargs):
+    timeline.prune(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def catch_up_followers(sender, instance, **kwargs):
+    # Счетчик подписчиков уже уменьшен в uncount_follow.
+    timeline.follower_lost(instance.author_id)
+
+
+@receiver(post_migrate)
+def restore_search_triggers(sender, using, **kwargs):
+    if sender.name == 'posts':
+        search.restore_triggers(connections[using])
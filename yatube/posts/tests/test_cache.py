@@ -0,0 +1,110 @@
+import os
+import shutil
+import tempfile
+import time
+from unittest import mock
+
+from django.core.cache import caches
+from django.test import SimpleTestCase, override_settings
+
+from core.cache import TwoLevelCache
+
+TEMP_DIR = tempfile.mkdtemp()
+
+CACHES = {
+    'default': {
+        'BACKEND': 'core.cache.TwoLevelCache',
+        'LOCATION': 'first',
+        'OPTIONS': {'L2': 'shared', 'SYNC_INTERVAL': 0},
+    },
+    'shared': {
+        'BACKEND': 'core.cache.SQLiteCache',
+        'LOCATION': os.path.join(TEMP_DIR, 'cache.sqlite3'),
+    },
+}
+
+
+@override_settings(CACHES=CACHES)
+class TwoLevelCacheTest(SimpleTestCase):
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(TEMP_DIR, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        caches['shared'].clear()
+        # Два экземпляра с разными L1 заменяют два процесса с общим L2.
+        self.first = caches['default']
+        self.second = TwoLevelCache(
+            'second', {'OPTIONS': {'L2': 'shared', 'SYNC_INTERVAL': 0}})
+        self.first.clear()
+        self.second.clear()
+        self.before = self.first.stats()
+
+    def delta(self):
+        after = self.first.stats()
+        return {name: after[name] - self.before[name] for name in after}
+
+    def test_repeated_read_hits_l1(self):
+        """Повторное чтение обслуживается памятью процесса"""
+        self.first.set('key', 'value')
+        self.assertEqual(self.first.get('key'), 'value')
+        self.assertEqual(self.first.get('key'), 'value')
+        self.assertEqual(self.first.get('missing'), None)
+        self.assertEqual(self.delta(), {
+            'l1_hits': 1, 'l1_misses': 2, 'l2_hits': 1, 'l2_misses': 1,
+        })
+
+    def test_write_invalidates_other_process(self):
+        """Запись в одном процессе сбрасывает L1 другого"""
+        self.first.set('key', 'old')
+        self.assertEqual(self.second.get('key'), 'old')
+        self.first.set('key', 'new')
+        self.assertEqual(self.second.get('key'), 'new')
+        self.first.add('counter', 1)
+        self.assertEqual(self.second.get('counter'), 1)
+        self.first.incr('counter')
+        self.assertEqual(self.second.get('counter'), 2)
+        self.first.delete('key')
+        self.assertIsNone(self.second.get('key'))
+
+    def test_clear_invalidates_other_process(self):
+        """Очистка общего кеша сбрасывает L1 всех процессов"""
+        self.first.set('key', 'value')
+        self.assertEqual(self.second.get('key'), 'value')
+        self.first.clear()
+        self.assertIsNone(self.second.get('key'))
+
+    def test_l1_keeps_copies(self):
+        """Изменение прочитанного объекта не портит кеш"""
+        self.first.set('key', ['value'])
+        self.first.get('key').append('changed')
+        self.assertEqual(self.first.get('key'), ['value'])
+
+    def test_l1_respects_short_timeout(self):
+        """Ключ с коротким таймаутом не переживает в L1 свой срок"""
+        start, clock = time.time(), [0]
+        with mock.patch('time.time', lambda: start + clock[0]), \
+                mock.patch('time.monotonic', lambda: start + clock[0]):
+            self.first.set('short', 'value', timeout=5)
+            self.assertEqual(self.first.get('short'), 'value')
+            self.assertEqual(self.second.get_many(['short']),
+                             {'short': 'value'})
+            self.first.get_or_set('other', 'value', timeout=5)
+            self.assertEqual(self.second.get('other'), 'value')
+            clock[0] = 6
+            for process in (self.first, self.second):
+                self.assertIsNone(process.get('short'))
+                self.assertIsNone(process.get('other'))
+            self.first.set('zero', 'value', timeout=0)
+            self.assertIsNone(self.first.get('zero'))
+
+    def test_get_many(self):
+        """get_many читает из L2 только то, чего нет в L1"""
+        self.first.set_many({'a': 1, 'b': 2})
+        self.first.get('a')
+        self.assertEqual(
+            self.first.get_many(['a', 'b', 'c']), {'a': 1, 'b': 2})
+        self.assertEqual(self.delta(), {
+            'l1_hits': 1, 'l1_misses': 3, 'l2_hits': 2, 'l2_misses': 1,
+        })
@@ -1,11 +1,14 @@
 import shutil
 import tempfile
+from io import BytesIO
+from unittest import mock
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import Client, TestCase, override_settings
 from django.urls import reverse
+from PIL import Image
 from posts.forms import CommentForm, PostForm
 
 from ..models import Comment, Group, Post
@@ -164,3 +167,82 @@ class CommentFormTests(TestCase):
         self.guest_client = Client()
         self.author_client = Client()
         self.author_client.force_login(self.user)
+
+
+@override_settings(
+    MEDIA_ROOT=TEMP_MEDIA_ROOT,
+    POST_IMAGE_MAX_SIDE=100,
+    POST_IMAGE_MAX_PIXELS=1000 * 1000,
+)
+class PostImageNormalizationTest(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    @staticmethod
+    def upload(size, mode='RGB', fmt='JPEG', name='photo.jpg', **params):
+        buffer = BytesIO()
+        Image.new(mode, size).save(buffer, fmt, **params)
+        return SimpleUploadedFile(name, buffer.getvalue())
+
+    def clean(self, upload):
+        form = PostForm(data={'text': 'Текст'}, files={'image': upload})
+        self.assertTrue(form.is_valid(), form.errors)
+        image = form.cleaned_data['image']
+        return image, Image.open(image)
+
+    def test_large_photo_downscaled_and_stripped(self):
+        """Фото уменьшается, поворачивается по EXIF и теряет метаданные"""
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        exif[0x010F] = 'Camera'
+        upload = self.upload((400, 300), exif=exif.tobytes())
+        image, decoded = self.clean(upload)
+        self.assertEqual(decoded.size, (75, 100))
+        self.assertEqual(decoded.format, 'JPEG')
+        self.assertTrue(decoded.info.get('progressive'))
+        self.assertNotIn('exif', decoded.info)
+        self.assertEqual(image.name, 'photo.jpg')
+
+    def test_transparent_image_kept_as_png(self):
+        """Картинка с прозрачностью сохраняется в PNG"""
+        image, decoded = self.clean(
+            self.upload((50, 50), 'RGBA', 'PNG', 'logo.png'))
+        self.assertEqual(decoded.format, 'PNG')
+        self.assertEqual(decoded.mode, 'RGBA')
+
+    def test_icc_profile_kept_for_rgb_only(self):
+        """Профиль RGB сохраняется, профиль CMYK не переносится в RGB"""
+        profile = b'\x00' * 128
+        for mode, fmt, name, kept in (
+            ('RGB', 'JPEG', 'photo.jpg', True),
+            ('RGBA', 'PNG', 'logo.png', True),
+            ('CMYK', 'JPEG', 'print.jpg', False),
+        ):
+            with self.subTest(mode=mode):
+                _, decoded = self.clean(self.upload(
+                    (20, 20), mode, fmt, name, icc_profile=profile))
+                self.assertEqual(
+                    decoded.info.get('icc_profile') == profile, kept)
+                self.assertIn(decoded.mode, ('RGB', 'RGBA'))
+
+    def test_animated_image_rejected(self):
+        """Анимированная картинка отклоняется, а не сплющивается"""
+        buffer = BytesIO()
+        frames = [Image.new('P', (10, 10), color) for color in (0, 1)]
+        frames[0].save(
+            buffer, 'GIF', save_all=True, append_images=frames[1:])
+        form = PostForm(data={'text': 'Текст'}, files={
+            'image': SimpleUploadedFile('anim.gif', buffer.getvalue())})
+        self.assertFalse(form.is_valid())
+        self.assertEqual(form.errors.as_data()['image'][0].code, 'animated')
+
+    def test_too_many_pixels_rejected(self):
+        """Картинка с лишними пикселями отклоняется до декодирования"""
+        upload = self.upload((2000, 1000), '1', 'PNG', 'bomb.png')
+        with mock.patch('PIL.ImageFile.ImageFile.load') as load:
+            form = PostForm(data={'text': 'Текст'}, files={'image': upload})
+            self.assertFalse(form.is_valid())
+        self.assertIn('image', form.errors)
+        load.assert_not_called()
@@ -0,0 +1,204 @@
+import datetime
+import shutil
+import tempfile
+from io import StringIO
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from core import jobs
+from core.models import Job
+
+from .. import thumbnails
+from ..models import Post
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+User = get_user_model()
+
+calls = []
+
+
+@jobs.task
+def record(value):
+    calls.append(value)
+
+
+@jobs.task
+def explode():
+    raise RuntimeError('сбой')
+
+
+@jobs.task
+def heartbeat(steal=False):
+    job = Job.objects.get(name=heartbeat.job_name)
+    # Время видимости на исходе, а другой воркер, может быть, уже здесь.
+    Job.objects.filter(pk=job.pk).update(available_at=timezone.now())
+    if steal:
+        jobs.claim()
+    jobs.touch()
+    calls.append(
+        Job.objects.get(pk=job.pk).available_at > timezone.now())
+
+
+class JobQueueTest(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def test_enqueued_job_runs_once(self):
+        """Воркер выполняет задачу и отмечает ее выполненной"""
+        job = jobs.enqueue(record, {'value': 1})
+        self.assertEqual(jobs.work(burst=True), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.DONE, 1))
+        self.assertEqual(jobs.work(burst=True), 0)
+        self.assertEqual(calls, [1])
+
+    def test_priority_order(self):
+        """Задачи с большим приоритетом берутся первыми"""
+        jobs.enqueue(record, {'value': 'обычная'})
+        jobs.enqueue(record, {'value': 'срочная'}, priority=10)
+        jobs.enqueue(record, {'value': 'отложенная'}, priority=20, delay=60)
+        jobs.work(burst=True)
+        self.assertEqual(calls, ['срочная', 'обычная'])
+
+    def test_retry_with_backoff(self):
+        """Упавшая задача повторяется все позже, потом помечается FAILED"""
+        job = jobs.enqueue(explode, max_attempts=2)
+        with self.assertLogs('core.jobs', 'ERROR'):
+            jobs.work(burst=True)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.QUEUED, 1))
+        self.assertGreater(
+            job.available_at,
+            timezone.now() + datetime.timedelta(
+                seconds=jobs.backoff(1) - 1))
+        self.assertIn('сбой', job.error)
+        self.assertEqual(jobs.backoff(2), 2 * jobs.backoff(1))
+        Job.objects.filter(pk=job.pk).update(available_at=timezone.now())
+        with self.assertLogs('core.jobs', 'ERROR'):
+            jobs.work(burst=True)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+
+    def test_visibility_timeout(self):
+        """Задачу без отчета после таймаута берет другой воркер"""
+        job = jobs.enqueue(record, {'value': 1})
+        stale = jobs.claim()
+        self.assertIsNone(jobs.claim())
+        Job.objects.filter(pk=job.pk).update(available_at=timezone.now())
+        fresh = jobs.claim()
+        self.assertEqual((fresh.pk, fresh.attempts), (job.pk, 2))
+        # Опоздавший воркер не перезаписывает чужую попытку.
+        self.assertEqual(jobs._finish(stale, status=Job.FAILED), 0)
+        self.assertTrue(jobs.perform(fresh))
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.DONE)
+
+    def test_touch_extends_visibility(self):
+        """Долгая задача продлевает видимость и не уходит второму воркеру"""
+        job = jobs.enqueue(heartbeat)
+        self.assertEqual(jobs.work(burst=True), 1)
+        self.assertEqual(calls, [True])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.DONE, 1))
+
+    def test_touch_after_lease_lost(self):
+        """Попытка, у которой задачу забрали, прекращается без отчета"""
+        job = jobs.enqueue(heartbeat, {'steal': True})
+        with self.assertLogs('core.jobs', 'WARNING'):
+            self.assertEqual(jobs.work(burst=True), 0)
+        self.assertEqual(calls, [])
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.RUNNING, 2))
+
+    def test_idempotency_key(self):
+        """Ключ не дает поставить задачу второй раз, пока первая не прошла"""
+        first = jobs.enqueue(record, {'value': 1}, key='ключ')
+        second = jobs.enqueue(record, {'value': 2}, key='ключ')
+        self.assertEqual(first.pk, second.pk)
+        jobs.work(burst=True)
+        third = jobs.enqueue(record, {'value': 3}, key='ключ')
+        self.assertNotEqual(third.pk, first.pk)
+        jobs.work(burst=True)
+        self.assertEqual(calls, [1, 3])
+
+    def test_run_workers_command(self):
+        """Команда run_workers --burst выполняет очередь и завершается"""
+        jobs.enqueue(record, {'value': 1})
+        out = StringIO()
+        call_command('run_workers', processes=1, burst=True, stdout=out)
+        self.assertEqual(calls, [1])
+        self.assertIn('Выполнено задач: 1', out.getvalue())
+
+    def test_purge_keeps_recent_jobs(self):
+        """Очистка удаляет только давно выполненные задачи"""
+        old = jobs.enqueue(record, {'value': 1})
+        recent = jobs.enqueue(record, {'value': 2})
+        jobs.work(burst=True)
+        Job.objects.filter(pk=old.pk).update(
+            updated=timezone.now() - datetime.timedelta(
+                seconds=settings.JOB_KEEP_DONE + 1))
+        self.assertEqual(jobs.purge(), 1)
+        self.assertEqual(
+            list(Job.objects.values_list('pk', flat=True)), [recent.pk])
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class QueuedSideEffectsTest(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            username='Yasha1', email='yasha@example.com', password='secret')
+
+    def test_password_reset_email_queued(self):
+        """Письмо сброса пароля уходит из воркера, а не из запроса"""
+        response = self.client.post(
+            reverse('users:password_reset_form'),
+            {'email': 'yasha@example.com'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(len(mail.outbox), 0)
+        job = Job.objects.get()
+        self.assertEqual(job.name, 'core.tasks.send_email')
+        jobs.work(burst=True)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['yasha@example.com'])
+        self.assertIn('/reset/', mail.outbox[0].body)
+
+    def test_thumbnails_built_by_worker(self):
+        """Миниатюры строит фоновая задача, повторно она не ставится"""
+        post = Post.objects.create(
+            author=self.user,
+            text='Пост с картинкой',
+            image=SimpleUploadedFile(
+                'small.gif',
+                b'GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\xff\xff\xff'
+                b'!\xf9\x04\x01\x00\x00\x00\x00,\x00\x00\x00\x00\x01\x00'
+                b'\x01\x00\x00\x02\x02D\x01\x00;',
+                'image/gif'),
+        )
+        etag = self.client.get(reverse('posts:index'))['ETag']
+        job = Job.objects.get()
+        self.assertEqual(job.key, f'thumbnails:{post.image.name}')
+        picture = thumbnails.rendition(post.image, 'card')
+        self.assertEqual(picture['src'], post.image.url)
+        jobs.work(burst=True)
+        picture = thumbnails.rendition(post.image, 'card')
+        self.assertNotEqual(picture['src'], post.image.url)
+        # Закешированная лента с оригиналом больше не отдается.
+        response = self.client.get(
+            reverse('posts:index'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, picture['srcset'])
@@ -1,7 +1,22 @@
+import datetime
+import re
+import shutil
+import tempfile
+from io import StringIO
+from unittest import mock
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import models
+from django.db.models import Max, Min
+from django.test import TestCase, TransactionTestCase, override_settings
+
+from core.models import StoredFile, index_seek
 
-from ..models import Comment, Follow, Group, Post
+from ..models import Comment, Follow, Group, Post, Profile
 
 User = get_user_model()
 
@@ -23,6 +38,59 @@ class PostModelTest(TestCase):
         self.assertEqual(expected_post_text, str(post))
 
 
+class IndexSeekTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='Yasha1')
+        moments = (
+            (2020, 12, 31, 23), (2021, 1, 1, 0), (2021, 1, 1, 5),
+            (2021, 3, 15, 12), (2023, 7, 1, 8),
+        )
+        for number, moment in enumerate(moments):
+            post = Post.objects.create(author=cls.user, text=f'Пост {number}')
+            Post.objects.filter(pk=post.pk).update(pub_date=datetime.datetime(
+                *moment, tzinfo=datetime.timezone.utc))
+
+    def test_dates_match_distinct(self):
+        """dates() по индексу совпадает с обычным DISTINCT"""
+        for kind in ('year', 'month', 'day'):
+            for order in ('ASC', 'DESC'):
+                for queryset in map(index_seek, (
+                    Post.objects.all(),
+                    Post.objects.filter(pub_date__year=2021),
+                    Post.objects.none(),
+                )):
+                    with self.subTest(kind=kind, order=order):
+                        self.assertEqual(
+                            list(queryset.dates('pub_date', kind, order)),
+                            list(models.QuerySet.dates(
+                                queryset, 'pub_date', kind, order)),
+                        )
+
+    def test_min_max_in_one_query(self):
+        """MIN и MAX считаются одним запросом и совпадают с обычными"""
+        queryset = index_seek(Post.objects.filter(pub_date__year=2021))
+        with self.assertNumQueries(1):
+            found = queryset.aggregate(
+                first=Min('pub_date'), last=Max('pub_date'))
+        self.assertEqual(found, models.QuerySet.aggregate(
+            queryset, first=Min('pub_date'), last=Max('pub_date')))
+        with self.assertNumQueries(0):
+            queryset.dates('pub_date', 'year')
+
+    def test_managers_stay_stock(self):
+        """Менеджеры моделей считают aggregate() и dates() как обычно"""
+        queryset = Post.objects.filter(pub_date__year=2021)
+        self.assertIsInstance(queryset.dates('pub_date', 'year'),
+                              models.QuerySet)
+        self.assertIsInstance(
+            index_seek(queryset).filter(text__startswith='Пост'),
+            type(queryset))
+        queryset.aggregate(last=Max('pub_date'))
+        self.assertNotIn('_known_edges', queryset.__dict__)
+
+
 class GroupModelTest(TestCase):
     @classmethod
     def setUpClass(cls):
@@ -72,3 +140,212 @@ class FollowModelTest(TestCase):
         self.assertEqual(expected_user_username, str(follow.user.username))
         expected_author_username = follow.author.username
         self.assertEqual(expected_author_username, str(follow.author.username))
+
+
+class CountersTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='author')
+        cls.user = User.objects.create_user(username='follower')
+        cls.group = Group.objects.create(
+            title='Тестовый тайтл',
+            slug='test-slug',
+            description='Тестовое описание группы',
+        )
+        cls.other_group = Group.objects.create(
+            title='Другой тайтл',
+            slug='other-slug',
+            description='Другое описание группы',
+        )
+
+    def assertCounters(self, instance, **expected):
+        instance.refresh_from_db()
+        for field, value in expected.items():
+            with self.subTest(field=field):
+                self.assertEqual(getattr(instance, field), value)
+
+    def test_post_counters(self):
+        """Посты автора и группы считаются при создании и удалении"""
+        post = Post.objects.create(
+            author=self.author, text='Тестовый текст', group=self.group)
+        self.assertCounters(self.author.profile, posts_count=1)
+        self.assertCounters(self.group, posts_count=1)
+        post.group = self.other_group
+        post.save()
+        self.assertCounters(self.group, posts_count=0)
+        self.assertCounters(self.other_group, posts_count=1)
+        post.delete()
+        self.assertCounters(self.author.profile, posts_count=0)
+        self.assertCounters(self.other_group, posts_count=0)
+
+    def test_author_change_counted(self):
+        """Смена автора поста переносит его в счетчик нового автора"""
+        post = Post.objects.create(author=self.author, text='Тестовый текст')
+        post.author = self.user
+        post.save()
+        self.assertCounters(self.author.profile, posts_count=0)
+        self.assertCounters(self.user.profile, posts_count=1)
+
+    def test_comment_counter(self):
+        """Комментарии поста считаются при создании и удалении"""
+        post = Post.objects.create(author=self.author, text='Тестовый текст')
+        comment = Comment.objects.create(
+            post=post, author=self.user, text='Тестовый комментарий')
+        self.assertCounters(post, comments_count=1)
+        comment.delete()
+        self.assertCounters(post, comments_count=0)
+
+    def test_follow_counters(self):
+        """Подписчики и подписки считаются при подписке и отписке"""
+        follow = Follow.objects.create(user=self.user, author=self.author)
+        self.assertCounters(self.author.profile, followers_count=1)
+        self.assertCounters(self.user.profile, following_count=1)
+        follow.delete()
+        self.assertCounters(self.author.profile, followers_count=0)
+        self.assertCounters(self.user.profile, following_count=0)
+
+    def test_recount_repairs_drift(self):
+        """Команда recount чинит разошедшиеся счетчики"""
+        Post.objects.bulk_create([
+            Post(author=self.author, text='Тестовый текст', group=self.group)
+            for _ in range(3)
+        ])
+        Profile.objects.filter(user=self.user).delete()
+        call_command('recount', batch_size=1, stdout=StringIO())
+        self.assertCounters(self.author.profile, posts_count=3)
+        self.assertCounters(self.group, posts_count=3)
+        self.assertTrue(Profile.objects.filter(user=self.user).exists())
+
+    def test_seed_yatube_fills_consistent_data(self):
+        """Команда seed_yatube создает данные с верными счетчиками"""
+        call_command(
+            'seed_yatube', users=30, groups=3, posts=100, comments=50,
+            follows=5, batch_size=7, stdout=StringIO())
+        self.assertEqual(
+            Post.objects.filter(author__username__startswith='seed').count(),
+            100)
+        for profile in Profile.objects.filter(
+                user__username__startswith='seed'):
+            with self.subTest(user=profile.user_id):
+                self.assertEqual(
+                    profile.posts_count,
+                    Post.objects.filter(author_id=profile.user_id).count())
+                self.assertEqual(
+                    profile.followers_count,
+                    Follow.objects.filter(author_id=profile.user_id).count())
+
+    def test_seed_yatube_rerun_counts_inserted_rows(self):
+        """Повторный запуск с тем же префиксом не падает и не врет о строках"""
+        options = dict(
+            users=10, groups=2, posts=20, comments=200, follows=2,
+            skip_derived=True)
+        call_command('seed_yatube', stdout=StringIO(), **options)
+        out = StringIO()
+        call_command('seed_yatube', stdout=out, **options)
+        self.assertIn('Пользователи: 0 строк', out.getvalue())
+        self.assertEqual(
+            Post.objects.filter(author__username__startswith='seed').count(),
+            40)
+        comments = re.search(r'Комментарии: (\d+) строк', out.getvalue())
+        self.assertLess(int(comments.group(1)), 200)
+
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+SMALL_GIF = (
+    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+    b'\x0A\x00\x3B'
+)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ImageStorageTest(TransactionTestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        # Миниатюры здесь не нужны, пул потоков не запускаем.
+        patcher = mock.patch('posts.thumbnails._submit')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.user = User.objects.create_user(username='Yasha1')
+
+    def create_post(self, name='small.gif', content=SMALL_GIF):
+        return Post.objects.create(
+            author=self.user,
+            text='Тестовый текст',
+            image=SimpleUploadedFile(name, content, 'image/gif'),
+        )
+
+    def test_identical_images_stored_once(self):
+        """Одинаковые картинки хранятся одним файлом в шардах по хешу"""
+        first = self.create_post('first.gif')
+        second = self.create_post('second.GIF')
+        name = first.image.name
+        self.assertEqual(second.image.name, name)
+        self.assertRegex(
+            name, r'^posts/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.gif$')
+        self.assertEqual(StoredFile.objects.get(name=name).refs, 2)
+
+    def test_concurrent_identical_upload(self):
+        """Параллельная загрузка того же файла добавляет ссылку"""
+        post = self.create_post()
+        storage, name = post.image.storage, post.image.name
+        StoredFile.objects.filter(name=name).delete()
+
+        def racer_saved(path):
+            # Другая загрузка успела записать строку после нашего UPDATE.
+            if path != name:
+                return False
+            StoredFile.objects.create(name=name)
+            return True
+
+        with mock.patch.object(storage, 'exists', side_effect=racer_saved):
+            saved = storage.save(
+                'posts/again.gif', ContentFile(SMALL_GIF, 'again.gif'))
+        self.assertEqual(saved, name)
+        self.assertEqual(StoredFile.objects.get(name=name).refs, 2)
+
+    def test_file_deleted_with_last_reference(self):
+        """Файл удаляется вместе с последним постом, ссылающимся на него"""
+        first = self.create_post()
+        second = self.create_post()
+        storage = first.image.storage
+        name = first.image.name
+        first.delete()
+        self.assertTrue(storage.exists(name))
+        second.delete()
+        self.assertFalse(storage.exists(name))
+        self.assertFalse(StoredFile.objects.filter(name=name).exists())
+
+    def test_replaced_image_released(self):
+        """Замена картинки освобождает старый файл"""
+        post = self.create_post()
+        storage = post.image.storage
+        old_name = post.image.name
+        post.image = SimpleUploadedFile(
+            'other.gif', SMALL_GIF + b'\x00', 'image/gif')
+        post.save()
+        self.assertNotEqual(post.image.name, old_name)
+        self.assertFalse(storage.exists(old_name))
+        self.assertTrue(storage.exists(post.image.name))
+
+    def test_same_image_reupload_keeps_one_reference(self):
+        """Повторная загрузка той же картинки не добавляет ссылку"""
+        post = self.create_post()
+        storage, name = post.image.storage, post.image.name
+        post.image = SimpleUploadedFile('again.gif', SMALL_GIF, 'image/gif')
+        post.save()
+        self.assertEqual(post.image.name, name)
+        self.assertEqual(StoredFile.objects.get(name=name).refs, 1)
+        post.save()
+        self.assertEqual(StoredFile.objects.get(name=name).refs, 1)
+        post.delete()
+        self.assertFalse(storage.exists(name))
@@ -0,0 +1,243 @@
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Q
+from django.test import (Client, TestCase, TransactionTestCase,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from ..checks import (canonical_queries, check_query_plans, explain,
+                      slow_steps)
+from ..models import Comment, Follow, Group, Post
+
+User = get_user_model()
+
+ROWS = (1, 10, 100)
+
+
+class QueryBudgetTest(TestCase):
+    """Число SQL-запросов страницы не зависит от числа постов и комментариев"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.admin = User.objects.create_superuser(
+            username='admin', email='admin@example.com', password='admin')
+        cls.reader = User.objects.create_user(username='reader')
+
+    def setUp(self):
+        cache.clear()
+        self.reader_client = Client()
+        self.reader_client.force_login(self.reader)
+        self.admin_client = Client()
+        self.admin_client.force_login(self.admin)
+
+    def seed(self, rows):
+        author = User.objects.create_user(username=f'author{rows}')
+        group = Group.objects.create(
+            title=f'Группа {rows}',
+            slug=f'group-{rows}',
+            description='Тестовое описание',
+        )
+        Follow.objects.create(user=self.reader, author=author)
+        posts = [
+            Post.objects.create(
+                author=author, text=f'Пост {number}', group=group)
+            for number in range(rows)
+        ]
+        post = posts[-1]
+        for number in range(rows):
+            commentator = User.objects.create(
+                username=f'commentator{rows}_{number}')
+            Comment.objects.create(
+                post=post, author=commentator, text='Комментарий')
+            Follow.objects.create(user=commentator, author=author)
+        return author, group, post
+
+    def assertQueriesAtMost(self, budget, request, *args, **kwargs):
+        cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            response = request(*args, **kwargs)
+        queries = '\n'.join(
+            f'{number}. {query["sql"]}'
+            for number, query in enumerate(context.captured_queries, 1)
+        )
+        self.assertLessEqual(
+            len(context), budget,
+            f'{args[0]}: {len(context)} запросов при бюджете {budget}\n'
+            f'{queries}'
+        )
+        return response
+
+    def test_pages_query_budget(self):
+        """Страницы укладываются в бюджет запросов при 1, 10 и 100 строках"""
+        for rows in ROWS:
+            author, group, post = self.seed(rows)
+            budgets = {
+                reverse('posts:index'): 3,
+                reverse('posts:group', args=[group.slug]): 5,
+                reverse('posts:profile', args=[author.username]): 6,
+                reverse('posts:post_detail', args=[post.pk]): 5,
+                reverse('posts:post_comments', args=[post.pk]): 4,
+                reverse('posts:follow_index'): 5,
+                reverse('api:posts'): 3,
+                reverse('api:group_posts', args=[group.slug]): 5,
+                reverse('api:profile_posts', args=[author.username]): 5,
+                reverse('api:post', args=[post.pk]): 4,
+                reverse('api:comments', args=[post.pk]): 4,
+                reverse('api:follow'): 5,
+            }
+            for url, budget in budgets.items():
+                with self.subTest(rows=rows, url=url):
+                    self.assertQueriesAtMost(
+                        budget, self.reader_client.get, url)
+
+    def test_writes_query_budget(self):
+        """Комментарий и подписка укладываются в бюджет запросов"""
+        for rows in ROWS:
+            author, group, post = self.seed(rows)
+            Follow.objects.filter(user=self.reader, author=author).delete()
+            with self.subTest(rows=rows, view='add_comment'):
+                self.assertQueriesAtMost(
+                    5,
+                    self.reader_client.post,
+                    reverse('posts:add_comment', args=[post.pk]),
+                    {'text': 'Новый комментарий'},
+                )
+            with self.subTest(rows=rows, view='profile_follow'):
+                self.assertQueriesAtMost(
+                    12,
+                    self.reader_client.get,
+                    reverse('posts:profile_follow', args=[author.username]),
+                )
+
+    def test_admin_changelists_query_budget(self):
+        """Списки в админке укладываются в бюджет запросов"""
+        for rows in ROWS:
+            self.seed(rows)
+            budgets = {
+                reverse('admin:posts_post_changelist'): 5,
+                reverse('admin:posts_group_changelist'): 5,
+                reverse('admin:posts_comment_changelist'): 5,
+                reverse('admin:posts_follow_changelist'): 5,
+            }
+            for url, budget in budgets.items():
+                with self.subTest(rows=rows, url=url):
+                    self.assertQueriesAtMost(
+                        budget, self.admin_client.get, url)
+
+    @override_settings(ADMIN_EXACT_COUNT_LIMIT=5)
+    def test_admin_counts_estimated(self):
+        """Большие таблицы в админке не считаются COUNT(*) целиком"""
+        author, group, post = self.seed(10)
+        url = reverse('admin:posts_post_changelist')
+        with CaptureQueriesContext(connection) as context:
+            response = self.admin_client.get(url)
+        self.assertEqual(response.context['cl'].result_count, 10)
+        self.assertFalse(any(
+            'COUNT(*) AS' in query['sql']
+            for query in context.captured_queries))
+        # Оценка по разбросу id не замечает удаленных строк.
+        Post.objects.filter(author=author).order_by('pk')[1].delete()
+        response = self.admin_client.get(url)
+        self.assertEqual(response.context['cl'].result_count, 10)
+        response = self.admin_client.get(url, {'q': 'Пост'})
+        self.assertEqual(response.context['cl'].result_count, 5)
+
+    def test_revalidation_query_budget(self):
+        """Повторная проверка страницы анонимом стоит не больше запроса"""
+        author, group, post = self.seed(10)
+        for url in (
+            reverse('posts:index'),
+            reverse('posts:group', args=[group.slug]),
+            reverse('posts:profile', args=[author.username]),
+            reverse('posts:post_detail', args=[post.pk]),
+        ):
+            with self.subTest(url=url):
+                etag = self.client.get(url)['ETag']
+                with CaptureQueriesContext(connection) as context:
+                    response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+                self.assertLessEqual(len(context), 1)
+
+
+class QueryPlanTest(TestCase):
+    """Запросы лент идут по индексам: проверка manage.py check"""
+
+    def test_canonical_queries_use_indexes(self):
+        """Типовые запросы страниц не просматривают таблицы целиком"""
+        self.assertEqual(check_query_plans(), [])
+
+    def test_cursor_pages_bounded(self):
+        """Страницы после и перед курсором ищут диапазон по дате"""
+        queries = dict(canonical_queries())
+        for name in ('index', 'group', 'profile'):
+            for variant, bound in (('after', '<'), ('before', '>')):
+                with self.subTest(name=name, variant=variant):
+                    plan = explain(queries[f'{name} [{variant}]'])
+                    self.assertTrue(any(
+                        step.startswith('SEARCH posts_post ')
+                        and f'pub_date{bound}?' in step
+                        for step in plan
+                    ), plan)
+
+    def test_comment_chunks_bounded(self):
+        """Следующая порция комментариев ищет диапазон по дате"""
+        plan = explain(dict(canonical_queries())['post comments [after]'])
+        self.assertTrue(any(
+            step.startswith('SEARCH posts_comment ')
+            and 'post_id=?' in step and 'created>?' in step
+            for step in plan
+        ), plan)
+
+    def test_unbounded_seek_detected(self):
+        """Поиск после курсора без границы по дате находится"""
+        now = timezone.now()
+        unbounded = Q(pub_date__lt=now) | Q(pub_date=now, pk__lt=1)
+        for queryset in (
+            Post.objects.filter(unbounded),
+            Post.objects.filter(unbounded, group_id=1),
+        ):
+            plan = explain(queryset.order_by('-pub_date', '-pk')[:11])
+            with self.subTest(plan=plan):
+                self.assertEqual(slow_steps(plan), [])
+                self.assertEqual(len(slow_steps(plan, 'posts_post')), 1)
+
+    def test_full_scan_detected(self):
+        """Полный просмотр и сортировка без индекса находятся"""
+        plan = explain(
+            Post.objects.filter(text='Пост').order_by('comments_count'))
+        self.assertEqual(len(slow_steps(plan)), 2)
+
+
+class SQLiteTuningTest(TestCase):
+    """Соединения SQLite настраиваются из SQLITE_PRAGMAS"""
+
+    def pragma(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def test_pragmas_applied(self):
+        """PRAGMA из настроек действуют на соединении Django"""
+        self.assertEqual(self.pragma('busy_timeout'), 5000)
+        self.assertEqual(self.pragma('cache_size'), -64 * 1024)
+        self.assertEqual(self.pragma('temp_store'), 2)
+        self.assertEqual(self.pragma('synchronous'), 1)
+
+
+class SQLiteBenchmarkTest(TransactionTestCase):
+    def test_benchmark_command(self):
+        """Замер нагрузки проходит оба режима на копии базы"""
+        User.objects.create_user(username='author')
+        out = StringIO()
+        call_command(
+            'bench_sqlite', readers=1, writers=1, seconds=0.1, stdout=out)
+        self.assertIn('без настроек', out.getvalue())
+        self.assertIn('SQLITE_PRAGMAS', out.getvalue())
+        self.assertFalse(Post.objects.exists())
@@ -1,15 +1,32 @@
+import os
 import shutil
+import sqlite3
 import tempfile
+from io import StringIO
+from unittest import mock, skipUnless
 
 from django import forms
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.core.cache import cache
+from django.core.cache import cache, caches
+from django.core.cache.utils import make_template_fragment_key
+from django.core.files.storage import default_storage
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import Client, TestCase, override_settings
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test import (Client, TestCase, TransactionTestCase,
+                         override_settings)
 from django.urls import reverse
+from PIL import features
 
-from ..models import Comment, Follow, Group, Post
+from core import jobs, replicas, sharding
+from core.models import Job
+from core.paginators import encode_cursor
+from core.replicas import PIN_COOKIE, ReplicaRouter
+
+from .. import bulk, feed_cache, thumbnails
+from ..models import (BulkJob, Comment, Follow, Group, Post, Profile,
+                      TimelineEntry)
 
 from yatube.settings import POSTS_QUANTITY
 
@@ -90,9 +107,35 @@ class PaginatorViewsTest(TestCase):
         self.assertEqual(len(response.context['page_obj']), POSTS_QUANTITY)
 
     def test_second_page_contains_three_records_in_index(self):
+        response = self.authorized_client.get(reverse('posts:index'))
+        next_cursor = response.context['page_obj'].next_cursor
         response = self.authorized_client.get(
-            reverse('posts:index') + '?page=2')
-        self.assertEqual(len(response.context['page_obj']), POSTS_QUANTITY)
+            reverse('posts:index') + f'?after={next_cursor}')
+        page_obj = response.context['page_obj']
+        self.assertEqual(len(page_obj), self.count_posts - POSTS_QUANTITY)
+        self.assertFalse(page_obj.has_next())
+        self.assertTrue(page_obj.has_previous())
+
+    def test_previous_cursor_returns_first_page(self):
+        """Курсор before возвращает те же посты, что и первая страница"""
+        url = reverse('posts:group', kwargs={'slug': self.group.slug})
+        first_page = self.authorized_client.get(url).context['page_obj']
+        second_page = self.authorized_client.get(
+            url + f'?after={first_page.next_cursor}').context['page_obj']
+        response = self.authorized_client.get(
+            url + f'?before={second_page.previous_cursor}')
+        page_obj = response.context['page_obj']
+        self.assertEqual(list(page_obj), list(first_page))
+        self.assertFalse(page_obj.has_previous())
+
+    def test_broken_cursor_returns_first_page(self):
+        """Битый курсор не ломает страницу, а отдает первую страницу"""
+        response = self.authorized_client.get(
+            reverse('posts:profile', args=[self.user.username])
+            + '?after=broken')
+        page_obj = response.context['page_obj']
+        self.assertEqual(len(page_obj), POSTS_QUANTITY)
+        self.assertFalse(page_obj.has_previous())
 
 
 class PostContextTests(TestCase):
@@ -208,7 +251,7 @@ class PostImageExistTest(TestCase):
         self.author_client.force_login(self.user)
 
     def test_post_with_image_exist(self):
-        self.assertTrue(Post.objects.filter(image='posts/small.gif'))
+        self.assertTrue(Post.objects.filter(image=self.post.image.name))
 
     def test_index_show_correct_image_in_context(self):
         """В Шаблоне index картинка передается в словаре context"""
@@ -216,7 +259,7 @@ class PostImageExistTest(TestCase):
         response = self.author_client.get(reverse('posts:index'))
         test_object = response.context['page_obj'][0]
         post_image = test_object.image
-        self.assertEqual(post_image, 'posts/small.gif')
+        self.assertEqual(post_image, self.post.image.name)
 
     def test_post_detail_image_exist(self):
         """В шаблоне post_detail картинка передается в словаре context"""
@@ -225,7 +268,7 @@ class PostImageExistTest(TestCase):
         )
         test_object = response.context['post']
         post_image = test_object.image
-        self.assertEqual(post_image, 'posts/small.gif')
+        self.assertEqual(post_image, self.post.image.name)
 
     def test_group_and_profile_image_exist(self):
         """В шаблонах group и profile картинка передается в словаре context"""
@@ -238,7 +281,7 @@ class PostImageExistTest(TestCase):
                 response = self.author_client.get(reverse(names, args=[args]))
                 test_object = response.context['page_obj'][0]
                 post_image = test_object.image
-                self.assertEqual(post_image, 'posts/small.gif')
+                self.assertEqual(post_image, self.post.image.name)
 
 
 class FollowTest(TestCase):
@@ -302,6 +345,110 @@ class FollowTest(TestCase):
         response = self.follower_client.get(reverse('posts:follow_index'))
         self.assertEqual = (len(response.context['page_obj']), 0)
 
+    def test_new_post_pushed_to_follower_timeline(self):
+        """Новый пост автора попадает в ленту подписчика"""
+        post = Post.objects.create(author=self.author, text='Новый пост')
+        self.assertTrue(
+            TimelineEntry.objects.filter(
+                user=self.follower, post=post, pub_date=post.pub_date
+            ).exists()
+        )
+        response = self.follower_client.get(reverse('posts:follow_index'))
+        self.assertEqual(response.context['page_obj'][0], post)
+
+    def test_follow_backfills_and_unfollow_prunes_timeline(self):
+        """Подписка заполняет ленту, отписка очищает ее"""
+        self.assertTrue(
+            TimelineEntry.objects.filter(
+                user=self.follower, post=self.post).exists()
+        )
+        self.follower_client.get(
+            reverse('posts:profile_unfollow', args=[self.author.username]))
+        self.assertFalse(
+            TimelineEntry.objects.filter(user=self.follower).exists())
+        self.follower_client.get(
+            reverse('posts:profile_follow', args=[self.author.username]))
+        self.assertTrue(
+            TimelineEntry.objects.filter(
+                user=self.follower, post=self.post).exists()
+        )
+
+
+@override_settings(FEED_FANOUT_THRESHOLD=1)
+class MergedFeedTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.follower = User.objects.create_user(username='follower')
+        cls.star = User.objects.create_user(username='star')
+        Follow.objects.create(user=cls.follower, author=cls.star)
+
+    def setUp(self):
+        cache.clear()
+        self.follower_client = Client()
+        self.follower_client.force_login(self.follower)
+
+    def test_heavy_author_posts_merged_on_read(self):
+        """Посты популярного автора не раздаются, а сливаются при чтении"""
+        posts = [
+            Post.objects.create(author=self.star, text=f'Пост {number}')
+            for number in range(POSTS_QUANTITY + 2)
+        ]
+        self.assertFalse(TimelineEntry.objects.exists())
+        response = self.follower_client.get(reverse('posts:follow_index'))
+        first_page = response.context['page_obj']
+        self.assertEqual(
+            list(first_page), posts[::-1][:POSTS_QUANTITY])
+        response = self.follower_client.get(
+            reverse('posts:follow_index')
+            + f'?after={first_page.next_cursor}')
+        self.assertEqual(
+            list(response.context['page_obj']), posts[::-1][POSTS_QUANTITY:])
+
+    def walk_feed(self):
+        """Посты всех страниц ленты подписок по курсору."""
+        found, url = [], reverse('posts:follow_index')
+        while True:
+            page = self.follower_client.get(url).context['page_obj']
+            found += list(page)
+            if page.next_cursor is None:
+                return found
+            url = reverse('posts:follow_index') + f'?after={page.next_cursor}'
+
+    @override_settings(FEED_MERGE_DEPTH=3)
+    def test_heavy_author_posts_past_merge_depth(self):
+        """Посты глубже закешированного списка ищутся в базе"""
+        posts = [
+            Post.objects.create(author=self.star, text=f'Пост {number}')
+            for number in range(POSTS_QUANTITY * 2 + 1)
+        ]
+        self.assertEqual(self.walk_feed(), posts[::-1])
+        cursor = encode_cursor(posts[0].pub_date, posts[0].pk)
+        response = self.follower_client.get(
+            reverse('posts:follow_index') + f'?before={cursor}')
+        self.assertEqual(
+            list(response.context['page_obj']),
+            posts[1:POSTS_QUANTITY + 1][::-1])
+
+    @override_settings(FEED_FANOUT_THRESHOLD=2)
+    def test_author_below_threshold_backfilled(self):
+        """Когда автор перестает быть популярным, его посты раздаются"""
+        other = User.objects.create_user(username='other')
+        follow = Follow.objects.create(user=other, author=self.star)
+        posts = [
+            Post.objects.create(author=self.star, text=f'Пост {number}')
+            for number in range(3)
+        ]
+        self.assertFalse(TimelineEntry.objects.exists())
+        follow.delete()
+        self.assertEqual(jobs.work(burst=True), 1)
+        self.assertEqual(
+            set(TimelineEntry.objects.filter(
+                user=self.follower).values_list('post_id', flat=True)),
+            {post.pk for post in posts},
+        )
+        self.assertEqual(self.walk_feed(), posts[::-1])
+
 
 class CommentTest(TestCase):
     @classmethod
@@ -338,6 +485,74 @@ class CommentTest(TestCase):
         self.assertEqual(response, 1)
 
 
+@override_settings(COMMENTS_CHUNK_SIZE=2)
+class CommentChunkTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='Yasha1')
+        cls.post = Post.objects.create(text='Пост', author=cls.author)
+        cls.comments = [
+            Comment.objects.create(
+                post=cls.post,
+                author=User.objects.create_user(username=f'reader{number}'),
+                text=f'Комментарий {number}',
+            )
+            for number in range(5)
+        ]
+
+    def setUp(self):
+        cache.clear()
+
+    def test_first_chunk_inline(self):
+        """Страница поста показывает только первую порцию комментариев"""
+        response = self.client.get(
+            reverse('posts:post_detail', args=[self.post.pk]))
+        self.assertEqual(
+            response.context['comments'], self.comments[:2])
+        self.assertContains(
+            response,
+            reverse('posts:post_comments', args=[self.post.pk])
+            + f'?after={response.context["next_cursor"]}')
+        self.assertNotContains(response, 'Комментарий 2')
+
+    def test_next_chunks(self):
+        """Порции по (created, id) идут до конца, у последней нет ссылки"""
+        url = reverse('posts:post_comments', args=[self.post.pk])
+        cursor, seen = None, []
+        for expected in (self.comments[:2], self.comments[2:4],
+                         self.comments[4:]):
+            response = self.client.get(
+                url, {'after': cursor} if cursor else {})
+            self.assertEqual(response.context['comments'], expected)
+            self.assertTemplateNotUsed(response, 'base.html')
+            seen += expected
+            cursor = response.context['next_cursor']
+        self.assertIsNone(cursor)
+        self.assertNotContains(response, 'comments-more')
+        self.assertEqual(seen, self.comments)
+
+    def test_json_chunk(self):
+        """Порция отдается в JSON вместе с курсором следующей"""
+        url = reverse('posts:post_comments', args=[self.post.pk])
+        first = self.client.get(url, {'format': 'json'}).json()
+        self.assertEqual(
+            [comment['id'] for comment in first['comments']],
+            [comment.pk for comment in self.comments[:2]])
+        self.assertEqual(first['comments'][0]['author'], 'reader0')
+        second = self.client.get(
+            url, {'format': 'json', 'after': first['next']}).json()
+        self.assertEqual(
+            [comment['text'] for comment in second['comments']],
+            ['Комментарий 2', 'Комментарий 3'])
+
+    def test_missing_post(self):
+        """Комментарии несуществующего поста - 404"""
+        response = self.client.get(
+            reverse('posts:post_comments', args=[self.post.pk + 100]))
+        self.assertEqual(response.status_code, 404)
+
+
 class CacheTest(TestCase):
     @classmethod
     def setUpClass(cls):
@@ -359,3 +574,761 @@ class CacheTest(TestCase):
         cache.clear()
         posts_count = Post.objects.count()
         self.assertEqual(len(response.context['page_obj']), posts_count)
+
+    def test_new_post_shown_right_after_write(self):
+        """Новый пост виден на главной сразу, несмотря на кеш"""
+        cache.clear()
+        self.author_client.get(reverse('posts:index'))
+        Post.objects.create(author=self.author, text='Свежий пост')
+        response = self.author_client.get(reverse('posts:index'))
+        self.assertContains(response, 'Свежий пост')
+
+    def test_cached_fragment_depends_on_cursor(self):
+        """Кеш главной страницы различает страницы ленты"""
+        cache.clear()
+        for number in range(POSTS_QUANTITY):
+            Post.objects.create(author=self.author, text=f'Пост {number}')
+        first_page = self.author_client.get(reverse('posts:index'))
+        next_cursor = first_page.context['page_obj'].next_cursor
+        second_page = self.author_client.get(
+            reverse('posts:index') + f'?after={next_cursor}')
+        self.assertContains(second_page, 'Тестовый текст')
+        self.assertNotContains(first_page, 'Тестовый текст')
+
+    def test_odd_cursor_reuses_first_page(self):
+        """Битый курсор в URL не заводит отдельный фрагмент кеша"""
+        cache.clear()
+        self.author_client.get(reverse('posts:index') + '?after=мусор')
+        key = make_template_fragment_key(
+            'index_page', [feed_cache.version('index'), ''])
+        self.assertIsNotNone(cache.get(key))
+
+    def test_rename_resets_author_pages(self):
+        """Новое имя автора сразу видно на главной и в профиле"""
+        cache.clear()
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:profile', args=[self.author.username]),
+        )
+        etags = {url: self.author_client.get(url)['ETag'] for url in urls}
+        self.author.first_name = 'Яков'
+        self.author.save()
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.author_client.get(
+                    url, HTTP_IF_NONE_MATCH=etags[url])
+                self.assertContains(response, 'Яков')
+
+    def test_group_rename_resets_fragments(self):
+        """Новое название и адрес группы сразу видны в кешированной ленте"""
+        cache.clear()
+        group = Group.objects.create(
+            title='Старое название', slug='old-slug', description='')
+        Post.objects.create(author=self.author, text='В группе', group=group)
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:profile', args=[self.author.username]),
+        )
+        for url in urls:
+            self.assertContains(self.author_client.get(url), 'Старое название')
+        group.title = 'Новое название'
+        group.slug = 'new-slug'
+        group.save()
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.author_client.get(url)
+                self.assertContains(response, 'Новое название')
+                self.assertContains(
+                    response, reverse('posts:group', args=['new-slug']))
+                self.assertNotContains(response, 'old-slug')
+
+    def test_last_login_keeps_pages(self):
+        """Служебное сохранение пользователя не сбрасывает ленты"""
+        version = feed_cache.version('author', self.author.pk)
+        self.author.save(update_fields=['last_login'])
+        self.assertEqual(
+            feed_cache.version('author', self.author.pk), version)
+
+
+class ConditionalGetTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='Yasha1')
+        cls.group = Group.objects.create(
+            title='Тестовый тайтл',
+            slug='test-slug',
+            description='Тестовое описание',
+        )
+        cls.post = Post.objects.create(
+            author=cls.author,
+            text='Тестовый текст',
+            group=cls.group,
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.urls = (
+            reverse('posts:index'),
+            reverse('posts:group', args=[self.group.slug]),
+            reverse('posts:profile', args=[self.author.username]),
+            reverse('posts:post_detail', args=[self.post.pk]),
+        )
+
+    def revalidate(self, url, client=None):
+        response = (client or self.client).get(url)
+        return (client or self.client).get(
+            url,
+            HTTP_IF_NONE_MATCH=response['ETag'],
+            HTTP_IF_MODIFIED_SINCE=response.get('Last-Modified', ''),
+        ), response
+
+    def test_not_modified(self):
+        """Неизменившаяся страница отдается как 304 без шаблона"""
+        for url in self.urls:
+            with self.subTest(url=url):
+                response, _ = self.revalidate(url)
+                self.assertEqual(response.status_code, 304)
+                self.assertIsNone(response.context)
+
+    def test_last_modified_for_anonymous(self):
+        """Аноним получает Last-Modified и 304 по If-Modified-Since"""
+        for url in self.urls:
+            with self.subTest(url=url):
+                last_modified = self.client.get(url)['Last-Modified']
+                response = self.client.get(
+                    url, HTTP_IF_MODIFIED_SINCE=last_modified)
+                self.assertEqual(response.status_code, 304)
+
+    def test_new_post_changes_validators(self):
+        """Новый пост автора меняет ETag всех его страниц"""
+        first = {url: self.client.get(url)['ETag'] for url in self.urls}
+        Post.objects.create(
+            author=self.author, text='Новый пост', group=self.group)
+        for url in self.urls:
+            with self.subTest(url=url):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=first[url])
+                self.assertEqual(response.status_code, 200)
+
+    def test_comment_changes_post_detail(self):
+        """Новый комментарий меняет ETag страницы поста"""
+        url = reverse('posts:post_detail', args=[self.post.pk])
+        etag = self.client.get(url)['ETag']
+        Comment.objects.create(
+            post=self.post, author=self.author, text='Комментарий')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, 'Комментарий')
+
+    def test_etag_depends_on_user(self):
+        """Другой пользователь не получает чужую страницу из кеша"""
+        url = reverse('posts:index')
+        etag = self.client.get(url)['ETag']
+        author_client = Client()
+        author_client.force_login(self.author)
+        response = author_client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('Last-Modified'))
+
+    def test_etag_changes_with_csrf_token(self):
+        """После нового входа форма со старым CSRF-токеном не отдается"""
+        url = reverse('posts:post_detail', args=[self.post.pk])
+        author_client = Client()
+        author_client.force_login(self.author)
+        response, first = self.revalidate(url, author_client)
+        self.assertEqual(response.status_code, 304)
+        author_client.cookies[settings.CSRF_COOKIE_NAME] = 'x' * 64
+        response = author_client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+
+    def test_group_change_revalidates_feeds(self):
+        """Правка и удаление группы меняют ETag главной и профиля"""
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:profile', args=[self.author.username]),
+            reverse('posts:post_detail', args=[self.post.pk]),
+        )
+        etags = {url: self.client.get(url)['ETag'] for url in urls}
+        group = Group.objects.get(pk=self.group.pk)
+        group.title = 'Новый тайтл'
+        group.save()
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etags[url])
+                self.assertContains(response, 'Новый тайтл')
+                etags[url] = response['ETag']
+        group.delete()
+        for url in urls:
+            with self.subTest(url=url, deleted=True):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etags[url])
+                self.assertNotContains(response, 'Новый тайтл')
+
+    def test_missing_page(self):
+        """Несуществующие страницы по-прежнему отдают 404"""
+        for url in (
+            reverse('posts:group', args=['missing']),
+            reverse('posts:profile', args=['missing']),
+            reverse('posts:post_detail', args=[10 ** 6]),
+        ):
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url).status_code, 404)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ThumbnailTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='Yasha1')
+        cls.post = Post.objects.create(
+            text='Тестовый текст',
+            author=cls.user,
+            image=SimpleUploadedFile(
+                name='thumb.gif',
+                content=(
+                    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+                    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+                    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+                    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+                    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+                    b'\x0A\x00\x3B'
+                ),
+                content_type='image/gif',
+            ),
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_original_until_generated(self):
+        """Пока миниатюры нет, страница отдает оригинал"""
+        picture = thumbnails.rendition(self.post.image, 'card')
+        self.assertEqual(picture['src'], self.post.image.url)
+        self.assertEqual(picture['srcset'], '')
+
+    def test_pages_use_generated_thumbnail(self):
+        """После генерации страницы отдают srcset готовых вариантов"""
+        renditions = thumbnails.generate(self.post.image.name)
+        picture = thumbnails.rendition(self.post.image, 'card')
+        self.assertIn(picture, renditions.values())
+        self.assertNotEqual(picture['src'], self.post.image.url)
+        for width in settings.POST_THUMBNAIL_WIDTHS:
+            self.assertIn(f' {width}w', picture['srcset'])
+        for url in (
+            reverse('posts:index'),
+            reverse('posts:post_detail', args=[self.post.pk]),
+        ):
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertContains(response, f'src="{picture["src"]}"')
+                self.assertContains(response, picture['srcset'])
+
+    def test_renditions_named_by_content(self):
+        """Одинаковые картинки дают одни и те же файлы вариантов"""
+        copy = default_storage.save(
+            'posts/copy.gif', default_storage.open(self.post.image.name))
+        first, = thumbnails.generate(self.post.image.name).values()
+        second, = thumbnails.generate(copy).values()
+        self.assertEqual(first, second)
+
+    @skipUnless(features.check('webp'), 'Pillow собран без WebP')
+    def test_webp_source(self):
+        """Варианты WebP отдаются через <source>"""
+        picture, = thumbnails.generate(self.post.image.name).values()
+        self.assertEqual(picture['sources'][0]['type'], 'image/webp')
+        self.assertIn('.webp 960w', picture['sources'][0]['srcset'])
+
+    def test_feed_page_looks_up_thumbnails_once(self):
+        """Миниатюры страницы ленты ищутся одним обращением к кешу"""
+        for number in range(POSTS_QUANTITY):
+            Post.objects.create(
+                text=f'Пост {number}', author=self.user,
+                image=self.post.image.name)
+        thumbnails.generate(self.post.image.name)
+        with mock.patch.object(
+                thumbnails, 'cache', wraps=thumbnails.cache) as spy:
+            response = self.client.get(reverse('posts:index'))
+        self.assertEqual(spy.get_many.call_count, 1)
+        self.assertEqual(spy.get.call_count, 0)
+        picture = thumbnails.rendition(self.post.image, 'card')
+        self.assertContains(
+            response, f'src="{picture["src"]}"', count=POSTS_QUANTITY)
+
+
+class SearchTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='Yasha1')
+        cls.admin = User.objects.create_superuser(
+            username='admin', email='admin@example.com', password='admin')
+
+    def search(self, query, **params):
+        response = self.client.get(
+            reverse('posts:search'), {'q': query, **params})
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def found(self, query):
+        page_obj = self.search(query).context['page_obj']
+        return [post.text for post in page_obj]
+
+    def test_index_follows_writes(self):
+        """Индекс следует за созданием, правкой и удалением постов"""
+        post = Post.objects.create(author=self.user, text='Рыжий котёнок')
+        Post.objects.create(author=self.user, text='Серая собака')
+        self.assertEqual(self.found('котёнок'), ['Рыжий котёнок'])
+        self.assertEqual(self.found('кот'), ['Рыжий котёнок'])
+        post.text = 'Рыжий хомяк'
+        post.save()
+        self.assertEqual(self.found('котёнок'), [])
+        self.assertEqual(self.found('хомяк'), ['Рыжий хомяк'])
+        post.delete()
+        self.assertEqual(self.found('хомяк'), [])
+
+    def test_results_ranked(self):
+        """Более релевантный пост стоит выше"""
+        Post.objects.create(
+            author=self.user,
+            text='кот и много других слов про погоду и новости дня')
+        Post.objects.create(author=self.user, text='кот кот кот')
+        self.assertEqual(self.found('кот')[0], 'кот кот кот')
+
+    def test_cursor_pagination(self):
+        """Результаты листаются курсором, запрос сохраняется в ссылках"""
+        for number in range(POSTS_QUANTITY + 3):
+            Post.objects.create(author=self.user, text=f'море {number}')
+        first = self.search('море')
+        next_cursor = first.context['page_obj'].next_cursor
+        self.assertContains(first, 'q=%D0%BC%D0%BE%D1%80%D0%B5&amp;after=')
+        second = self.search('море', after=next_cursor)
+        texts = [post.text for post in first.context['page_obj']] + [
+            post.text for post in second.context['page_obj']]
+        self.assertEqual(len(texts), POSTS_QUANTITY + 3)
+        self.assertEqual(len(set(texts)), POSTS_QUANTITY + 3)
+
+    def test_old_relevant_post_found(self):
+        """Старый релевантный пост не вытесняется новыми совпадениями"""
+        Post.objects.create(author=self.user, text='кот кот кот')
+        for number in range(POSTS_QUANTITY + 3):
+            Post.objects.create(
+                author=self.user, text=f'кот и много других слов {number}')
+        self.assertEqual(self.found('кот')[0], 'кот кот кот')
+
+    def test_pages_stable_while_corpus_changes(self):
+        """Новые совпадения не сдвигают страницы начатой выдачи"""
+        for number in range(POSTS_QUANTITY + 3):
+            Post.objects.create(author=self.user, text=f'море {number}')
+        first = self.search('море').context['page_obj']
+        Post.objects.create(author=self.user, text='море море море')
+        second = self.search(
+            'море', after=first.next_cursor).context['page_obj']
+        texts = [post.text for post in first] + [post.text for post in second]
+        self.assertEqual(len(set(texts)), POSTS_QUANTITY + 3)
+        self.assertNotIn('море море море', texts)
+        self.assertEqual(self.found('море')[0], 'море море море')
+
+    def test_query_syntax_is_escaped(self):
+        """Операторы FTS5 в запросе не ломают поиск"""
+        Post.objects.create(author=self.user, text='NEAR AND OR')
+        for query in ('"', 'AND', 'кот OR', '*', 'text:NEAR', '(('):
+            with self.subTest(query=query):
+                self.search(query)
+        self.assertEqual(self.found('AND OR'), ['NEAR AND OR'])
+        self.assertIsNone(self.search('  ').context['page_obj'])
+
+    def test_admin_search_uses_index(self):
+        """Поиск в админке находит посты через тот же индекс"""
+        Post.objects.create(author=self.user, text='Рыжий котёнок')
+        Post.objects.create(author=self.user, text='Серая собака')
+        self.client.force_login(self.admin)
+        response = self.client.get(
+            reverse('admin:posts_post_changelist'), {'q': 'котёнок'})
+        self.assertEqual(
+            [post.text for post in response.context['cl'].result_list],
+            ['Рыжий котёнок'])
+
+    def test_rebuild_command(self):
+        """Команда rebuild_search_index восстанавливает индекс"""
+        Post.objects.create(author=self.user, text='Рыжий котёнок')
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO posts_post_fts(posts_post_fts) "
+                "VALUES ('delete-all')")
+        self.assertEqual(self.found('котёнок'), [])
+        call_command('rebuild_search_index', stdout=StringIO())
+        self.assertEqual(self.found('котёнок'), ['Рыжий котёнок'])
+
+
+@override_settings(BULK_ACTION_BATCH_SIZE=2)
+class BulkActionTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.admin = User.objects.create_superuser(
+            username='admin', email='admin@example.com', password='admin')
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(
+            title='Старая', slug='old', description='Тестовое описание')
+        cls.target = Group.objects.create(
+            title='Новая', slug='new', description='Тестовое описание')
+
+    def setUp(self):
+        self.client.force_login(self.admin)
+        self.posts = [
+            Post.objects.create(
+                author=self.author, text=f'Пост {number}', group=self.group)
+            for number in range(5)
+        ]
+        self.reader_post = Post.objects.create(
+            author=self.reader, text='Пост читателя')
+        for post in self.posts:
+            Comment.objects.create(
+                post=post, author=self.reader, text='Комментарий')
+        Comment.objects.create(
+            post=self.reader_post, author=self.author, text='Ответ')
+
+    def act(self, action, posts, **data):
+        self.client.post(reverse('admin:posts_post_changelist'), {
+            'action': action,
+            '_selected_action': [post.pk for post in posts],
+            **data,
+        })
+        return BulkJob.objects.order_by('pk').last()
+
+    def test_delete_in_background(self):
+        """Удаление в админке ставит задачу, задача удаляет пачками"""
+        job = self.act('delete_in_background', self.posts[:3])
+        self.assertEqual(job.status, BulkJob.QUEUED)
+        self.assertEqual(Post.objects.count(), 6)
+        self.assertEqual(job.options, {})
+        self.assertEqual(job.items.count(), 3)
+        job = bulk.run(job.pk)
+        self.assertEqual((job.status, job.done, job.total), (
+            BulkJob.DONE, 3, 3))
+        self.assertFalse(job.items.exists())
+        self.assertEqual(Post.objects.filter(author=self.author).count(), 2)
+        self.assertFalse(Comment.objects.filter(post__in=self.posts[:3]))
+        self.group.refresh_from_db()
+        self.assertEqual(self.group.posts_count, 2)
+        self.assertEqual(
+            Profile.objects.get(user=self.author).posts_count, 2)
+
+    def test_move_to_group(self):
+        """Перенос в группу сдвигает счетчики обеих групп"""
+        job = self.act(
+            'move_to_group', self.posts[:4], group=self.target.pk)
+        bulk.run(job.pk)
+        self.assertEqual(
+            Post.objects.filter(group=self.target).count(), 4)
+        self.group.refresh_from_db()
+        self.target.refresh_from_db()
+        self.assertEqual(
+            (self.group.posts_count, self.target.posts_count), (1, 4))
+
+    def test_move_requires_group(self):
+        """Без выбранной группы задача не создается"""
+        self.act('move_to_group', self.posts)
+        self.assertFalse(BulkJob.objects.exists())
+
+    def test_purge_user_content(self):
+        """Очистка удаляет посты и комментарии автора"""
+        self.client.post(reverse('admin:auth_user_changelist'), {
+            'action': 'purge_content',
+            '_selected_action': [self.author.pk],
+        })
+        job = bulk.run(BulkJob.objects.get().pk)
+        self.assertEqual((job.status, job.done), (BulkJob.DONE, 6))
+        self.assertFalse(Post.objects.filter(author=self.author))
+        self.assertFalse(Comment.objects.filter(author=self.author))
+        self.reader_post.refresh_from_db()
+        self.assertEqual(self.reader_post.comments_count, 0)
+
+    def test_lost_lease_rolls_back_batch(self):
+        """Если задачу забрал другой воркер, пачка откатывается"""
+        job = self.act('delete_in_background', self.posts)
+        lost = jobs.LeaseLost('другой воркер')
+        with mock.patch.object(jobs, 'touch', side_effect=lost):
+            with self.assertRaises(jobs.LeaseLost):
+                bulk.run(job.pk)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.done), (BulkJob.RUNNING, 0))
+        self.assertEqual(Post.objects.filter(author=self.author).count(), 5)
+
+    def test_resume_after_failure(self):
+        """После сбоя задача продолжается с первой необработанной пачки"""
+        job = self.act('delete_in_background', self.posts)
+        delete_posts = bulk._delete_posts
+        calls = []
+
+        def fail_second_batch(job, ids):
+            calls.append(ids)
+            if len(calls) == 2:
+                raise RuntimeError('сбой')
+            delete_posts(job, ids)
+
+        steps = {BulkJob.DELETE: ((bulk._selected_posts, fail_second_batch),)}
+        with mock.patch.dict(bulk.STEPS, steps), self.assertLogs(
+                'posts.bulk', 'ERROR'):
+            job = bulk.run(job.pk)
+        self.assertEqual((job.status, job.done), (BulkJob.FAILED, 2))
+        self.assertEqual(Post.objects.filter(author=self.author).count(), 3)
+        out = StringIO()
+        call_command('resume_bulk_jobs', stdout=out)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.done), (BulkJob.DONE, 5))
+        self.assertFalse(Post.objects.filter(author=self.author))
+        self.assertIn('5 из 5', out.getvalue())
+
+
+def attach_copy(alias, directory):
+    """Подключает под именем alias файловую копию тестовой базы."""
+    path = os.path.join(directory, f'{alias}.sqlite3')
+    connection.ensure_connection()
+    target = sqlite3.connect(path)
+    connection.connection.backup(target)
+    target.close()
+    connections.databases[alias] = {
+        'ENGINE': 'core.backends.sqlite3', 'NAME': path}
+
+
+def detach(alias):
+    connections[alias].close()
+    del connections[alias]
+    del connections.databases[alias]
+    # Потоки пула шардов помнят соединение со старым файлом.
+    if sharding._pool is not None:
+        sharding._pool.shutdown()
+        sharding._pool = None
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaTest(TransactionTestCase):
+    """Реплика - копия тестовой базы, сделанная до новых записей."""
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='author')
+        self.group = Group.objects.create(title='Группа', slug='group')
+        Post.objects.create(
+            text='Старый пост', author=self.author, group=self.group)
+        self.directory = tempfile.mkdtemp()
+        attach_copy('replica', self.directory)
+        self.client = Client()
+        self.client.force_login(self.author)
+
+    def tearDown(self):
+        detach('replica')
+        shutil.rmtree(self.directory)
+
+    def test_reads_go_to_replica(self):
+        """Страницы лент читают посты с реплики, формы - с основной базы"""
+        Post.objects.create(text='Новый пост', author=self.author)
+        for url in (
+            reverse('posts:index'),
+            reverse('posts:group', args=[self.group.slug]),
+            reverse('posts:profile', args=[self.author.username]),
+        ):
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertContains(response, 'Старый пост')
+                self.assertNotContains(response, 'Новый пост')
+        post = Post.objects.get(text='Новый пост')
+        response = self.client.get(
+            reverse('posts:post_edit', args=[post.pk]))
+        self.assertContains(response, 'Новый пост')
+
+    def test_writer_pinned_to_primary(self):
+        """После записи автор читает из основной базы, остальные - нет"""
+        response = self.client.post(
+            reverse('posts:post_create'), {'text': 'Свежий пост'})
+        self.assertIn(PIN_COOKIE, response.cookies)
+        index = reverse('posts:index')
+        self.assertContains(self.client.get(index), 'Свежий пост')
+        cache.clear()
+        self.assertNotContains(Client().get(index), 'Свежий пост')
+
+    def test_pin_expires(self):
+        """Закрепление действует PRIMARY_PIN_SECONDS секунд"""
+        self.client.post(
+            reverse('posts:post_create'), {'text': 'Свежий пост'})
+        cache.clear()
+        with override_settings(PRIMARY_PIN_SECONDS=0):
+            response = self.client.get(reverse('posts:index'))
+        self.assertNotContains(response, 'Свежий пост')
+
+    def test_reads_without_writes_not_pinned(self):
+        """Чтение лент не закрепляет пользователя"""
+        response = self.client.get(reverse('posts:index'))
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+
+    def test_service_writes_not_pinned(self):
+        """Запись в очередь задач при чтении не закрепляет читателя"""
+        router = ReplicaRouter()
+        replicas._state.wrote = False
+        router.db_for_write(Job)
+        self.assertFalse(replicas._state.wrote)
+        router.db_for_write(Post)
+        self.assertTrue(replicas._state.wrote)
+        replicas._state.wrote = False
+
+    def test_replica_page_not_cached(self):
+        """Страница с отстающей реплики не кешируется и идет без ETag"""
+        Post.objects.create(text='Новый пост', author=self.author)
+        reader = Client()
+        index = reverse('posts:index')
+        response = reader.get(index)
+        self.assertNotContains(response, 'Новый пост')
+        self.assertFalse(response.has_header('ETag'))
+        self.assertFalse(response.has_header('Last-Modified'))
+        with override_settings(DATABASE_REPLICAS=[]):
+            self.assertContains(reader.get(index), 'Новый пост')
+
+    def test_replica_read_leaves_shared_cache(self):
+        """Чтение с реплики не пишет в кеш ни фрагменты, ни версии"""
+        Post.objects.create(text='Новый пост', author=self.author)
+        cache.clear()
+        backend = caches['default']
+        reader = Client()
+        index = reverse('posts:index')
+        with mock.patch.object(
+                backend, 'set', wraps=backend.set) as written:
+            self.assertNotContains(reader.get(index), 'Новый пост')
+        self.assertIsNone(cache.get('posts:feed-version:index'))
+        for call in written.call_args_list:
+            key, _, timeout = call[0]
+            self.assertEqual(timeout, 0)
+            self.assertEqual(
+                key, make_template_fragment_key('index_page', ['replica', '']))
+        with override_settings(DATABASE_REPLICAS=[]):
+            self.assertContains(reader.get(index), 'Новый пост')
+
+
+@override_settings(DATABASE_SHARDS=['default', 'shard'])
+class ShardingTest(TransactionTestCase):
+    """Второй шард - копия пустой базы, справочные строки копируются."""
+
+    def setUp(self):
+        cache.clear()
+        self.directory = tempfile.mkdtemp()
+        attach_copy('shard', self.directory)
+        self.group = Group.objects.create(title='Группа', slug='group')
+        self.authors = {}
+        while len(self.authors) < 2:
+            author = User.objects.create_user(
+                username=f'author{User.objects.count()}')
+            self.authors.setdefault(sharding.shard_by_key(author.pk), author)
+
+    def tearDown(self):
+        detach('shard')
+        shutil.rmtree(self.directory)
+
+    def create_posts(self, count):
+        return [
+            Post.objects.create(
+                text=f'Пост {number}',
+                author=self.authors[('default', 'shard')[number % 2]],
+                group=self.group,
+            )
+            for number in range(count)
+        ]
+
+    def test_posts_stored_on_author_shard(self):
+        """Пост и его комментарии лежат в шарде автора, id указывает шард"""
+        post, other = self.create_posts(2)
+        self.assertEqual(
+            list(Post.objects.using('shard').values_list('pk', flat=True)),
+            [other.pk])
+        self.assertEqual(sharding.shard_by_id(other.pk), 'shard')
+        self.assertEqual(sharding.shard_by_id(post.pk), 'default')
+        client = Client()
+        client.force_login(self.authors['default'])
+        client.post(
+            reverse('posts:add_comment', args=[other.pk]),
+            {'text': 'Комментарий'})
+        comment = Comment.objects.using('shard').get()
+        self.assertEqual(sharding.shard_by_id(comment.pk), 'shard')
+        self.assertFalse(Comment.objects.exists())
+        other.refresh_from_db()
+        self.assertEqual(other.comments_count, 1)
+        response = client.get(reverse('posts:post_detail', args=[other.pk]))
+        self.assertContains(response, 'Комментарий')
+
+    def test_feeds_merge_shards(self):
+        """Главная и группа сливают шарды по дате, профиль читает один"""
+        posts = self.create_posts(POSTS_QUANTITY + 3)
+        newest_first = [post.pk for post in reversed(posts)]
+        for url in (
+            reverse('posts:index'),
+            reverse('posts:group', args=[self.group.slug]),
+        ):
+            with self.subTest(url=url):
+                first = Client().get(url).context['page_obj']
+                self.assertEqual(
+                    [post.pk for post in first],
+                    newest_first[:POSTS_QUANTITY])
+                second = Client().get(
+                    url, {'after': first.next_cursor}).context['page_obj']
+                self.assertEqual(
+                    [post.pk for post in second],
+                    newest_first[POSTS_QUANTITY:])
+        author = self.authors['shard']
+        page = Client().get(
+            reverse('posts:profile', args=[author.username])
+        ).context['page_obj']
+        self.assertEqual(
+            {post.author_id for post in page.object_list}, {author.pk})
+
+    def test_reference_rows_copied_to_shards(self):
+        """Пользователь и группа, созданные после шарда, видны на нем"""
+        author = None
+        while author is None or sharding.shard_by_key(author.pk) != 'shard':
+            author = User.objects.create_user(
+                username=f'late{User.objects.count()}')
+        group = Group.objects.create(title='Новая группа', slug='late')
+        client = Client()
+        client.force_login(author)
+        response = client.post(
+            reverse('posts:post_create'),
+            {'text': 'Пост нового автора', 'group': group.pk})
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(
+            Post.objects.using('shard').filter(author=author).exists())
+        self.assertContains(
+            Client().get(reverse('posts:index')), 'Пост нового автора')
+        author.first_name = 'Новое имя'
+        author.save(update_fields=['first_name'])
+        self.assertEqual(
+            User.objects.using('shard').get(pk=author.pk).first_name,
+            'Новое имя')
+        author.delete()
+        self.assertFalse(User.objects.using('shard').filter(
+            pk=author.pk).exists())
+        self.assertFalse(Post.objects.using('shard').filter(
+            author_id=author.pk).exists())
+
+    def test_deleted_post_leaves_no_timeline_entries(self):
+        """Удаление поста в шарде убирает его из лент в default"""
+        reader = User.objects.create_user(username='reader')
+        Follow.objects.create(user=reader, author=self.authors['shard'])
+        post = Post.objects.create(
+            text='Пост', author=self.authors['shard'])
+        self.assertTrue(TimelineEntry.objects.filter(post_id=post.pk).exists())
+        post.delete()
+        self.assertFalse(
+            TimelineEntry.objects.filter(post_id=post.pk).exists())
+
+    def test_unfollow_prunes_timeline_on_other_shard(self):
+        """Отписка убирает из ленты посты автора из другого шарда"""
+        reader = User.objects.create_user(username='reader')
+        follow = Follow.objects.create(
+            user=reader, author=self.authors['shard'])
+        Post.objects.create(text='Пост', author=self.authors['shard'])
+        self.assertEqual(TimelineEntry.objects.filter(user=reader).count(), 1)
+        follow.delete()
+        self.assertFalse(TimelineEntry.objects.filter(user=reader).exists())
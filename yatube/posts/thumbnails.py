@@ -0,0 +1,162 @@
+"""
+Миниатюры картинок постов.
+
+Для каждого размера из POST_THUMBNAILS строится набор ширин
+POST_THUMBNAIL_WIDTHS в форматах POST_THUMBNAIL_FORMATS. Файлы
+называются по хешу содержимого, поэтому их можно кешировать навсегда.
+Всё строится фоновой задачей core.jobs после сохранения картинки:
+описание набора кладется в кеш, ленты с этой картинкой сбрасываются.
+Шаблоны только читают описание: если миниатюр еще нет, отдается
+оригинал и ставится задача, так что PIL на чтении не работает.
+"""
+import hashlib
+from io import BytesIO
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps, features
+
+from core import jobs
+
+from . import feed_cache
+from .models import Post
+
+FORMATS = {
+    'webp': ('WEBP', 'image/webp', 'webp'),
+    'jpeg': ('JPEG', 'image/jpeg', 'jpg'),
+}
+
+
+def _key(name, size):
+    return f'posts:rendition:{size}:{name}'
+
+
+def formats():
+    """Форматы из настроек, которые умеет кодировать установленный Pillow."""
+    return [
+        name for name in settings.POST_THUMBNAIL_FORMATS
+        if name != 'webp' or features.check('webp')
+    ]
+
+
+def _store(content, size, extension):
+    digest = hashlib.sha256(content).hexdigest()
+    name = f'cache/thumbnails/{size}/{digest[:2]}/{digest[2:18]}.{extension}'
+    if not default_storage.exists(name):
+        default_storage.save(name, ContentFile(content))
+    return default_storage.url(name)
+
+
+def _encode(image, pil_format):
+    buffer = BytesIO()
+    image.save(
+        buffer, pil_format, quality=settings.POST_THUMBNAIL_QUALITY)
+    return buffer.getvalue()
+
+
+def _render(image, size, width, height):
+    """
+    Набор вариантов одного размера.
+
+    Последний формат из настроек уходит в <img>, остальные в <source>.
+    Каждый вариант обрезается по центру и масштабируется, как раньше
+    делал crop="center" upscale=True.
+    """
+    widths = sorted(
+        {w for w in settings.POST_THUMBNAIL_WIDTHS if w < width} | {width})
+    fitted = [
+        (w, ImageOps.fit(
+            image, (w, round(height * w / width)), Image.LANCZOS))
+        for w in widths
+    ]
+    sources = []
+    for name in formats():
+        pil_format, mime, extension = FORMATS[name]
+        urls = [
+            (w, _store(_encode(variant, pil_format), size, extension))
+            for w, variant in fitted
+        ]
+        sources.append({
+            'type': mime,
+            'src': urls[-1][1],
+            'srcset': ', '.join(f'{url} {w}w' for w, url in urls),
+        })
+    fallback = sources.pop()
+    return {**fallback, 'sources': sources}
+
+
+def _original(image):
+    return {'src': image.url, 'srcset': '', 'sources': []}
+
+
+@jobs.task
+def generate(name):
+    """Строит варианты всех размеров и запоминает их описание."""
+    with default_storage.open(name) as source:
+        image = Image.open(source)
+        image.load()
+    image = image.convert('RGB')
+    renditions = {
+        _key(name, size): _render(image, size, width, height)
+        for size, (width, height) in settings.POST_THUMBNAILS.items()
+    }
+    cache.set_many(renditions, None)
+    _reset_feeds(name)
+    return renditions
+
+
+def _reset_feeds(name):
+    # Ленты с этой картинкой закешированы с оригиналом: сбрасываем их.
+    for alias in settings.DATABASE_SHARDS:
+        for post in Post.objects.using(alias).filter(image=name).only(
+                'author', 'group'):
+            feed_cache.bump_for_post(post)
+
+
+def _submit(name):
+    # Метка в кеше избавляет страницы от запроса к очереди на каждый показ.
+    if cache.add(f'posts:rendition:queued:{name}', True,
+                 settings.JOB_VISIBILITY_TIMEOUT):
+        jobs.enqueue(generate, {'name': name}, key=f'thumbnails:{name}')
+
+
+def schedule(name):
+    """Ставит построение миниатюр в очередь фоновых задач."""
+    if name:
+        _submit(name)
+
+
+def rendition(image, size):
+    """Описание готовых вариантов или оригинал, пока их нет."""
+    if not image:
+        return None
+    found = cache.get(_key(image.name, size))
+    if found is None:
+        schedule(image.name)
+        return _original(image)
+    return found
+
+
+def attach(posts):
+    """
+    Находит миниатюры всех постов страницы одним обращением к кешу.
+
+    Описания кладутся в post.thumbnails по именам размеров.
+    """
+    wanted = {}
+    for post in posts:
+        post.thumbnails = {}
+        if post.image:
+            for size in settings.POST_THUMBNAILS:
+                wanted.setdefault(
+                    _key(post.image.name, size), []).append((post, size))
+    found = cache.get_many(wanted) if wanted else {}
+    for key, targets in wanted.items():
+        for post, size in targets:
+            if key in found:
+                post.thumbnails[size] = found[key]
+            else:
+                schedule(post.image.name)
+                post.thumbnails[size] = _original(post.image)
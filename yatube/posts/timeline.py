@@ -0,0 +1,238 @@
+import heapq
+from collections import namedtuple
+from itertools import islice
+
+from django.conf import settings
+from django.core.cache import cache
+
+from core import jobs, sharding
+from core.paginators import CursorPaginator
+from core.replicas import reading_replica
+
+from .models import Follow, Post, Profile, TimelineEntry
+
+FeedKey = namedtuple('FeedKey', ('pub_date', 'post_id'))
+
+
+def _bulk_insert(entries):
+    TimelineEntry.objects.bulk_create(entries, ignore_conflicts=True)
+
+
+def is_heavy(author_id):
+    """Автор со множеством подписчиков: его посты сливаются при чтении."""
+    return Profile.objects.filter(
+        user_id=author_id,
+        followers_count__gte=settings.FEED_FANOUT_THRESHOLD,
+    ).exists()
+
+
+def heavy_authors_query(user):
+    return Follow.objects.filter(
+        user=user,
+        author__profile__followers_count__gte=settings.FEED_FANOUT_THRESHOLD,
+    ).values_list('author_id', flat=True)
+
+
+def heavy_authors(user):
+    """id авторов из подписок пользователя, не раздающих посты при записи."""
+    return list(heavy_authors_query(user))
+
+
+def push_to_followers(post):
+    """Раскладывает пост в ленты всех подписчиков автора."""
+    followers = Follow.objects.filter(
+        author_id=post.author_id
+    ).values_list('user_id', flat=True)
+    batch = []
+    for user_id in followers.iterator():
+        batch.append(TimelineEntry(
+            user_id=user_id, post_id=post.pk, pub_date=post.pub_date))
+        if len(batch) >= settings.TIMELINE_BATCH_SIZE:
+            _bulk_insert(batch)
+            batch = []
+    if batch:
+        _bulk_insert(batch)
+
+
+def fan_out(post):
+    """Раздает новый пост подписчикам, если автор не слишком популярен."""
+    forget_recent(post.author_id)
+    if not is_heavy(post.author_id):
+        push_to_followers(post)
+
+
+def backfill(user_id, author_id):
+    """Добавляет в ленту последние посты автора после подписки."""
+    if is_heavy(author_id):
+        return
+    posts = Post.objects.on_shard(key=author_id).filter(
+        author_id=author_id
+    ).order_by('-pub_date', '-pk').values_list(
+        'pk', 'pub_date'
+    )[:settings.TIMELINE_BACKFILL]
+    _bulk_insert([
+        TimelineEntry(user_id=user_id, post_id=pk, pub_date=pub_date)
+        for pk, pub_date in posts
+    ])
+
+
+@jobs.task
+def backfill_followers(author_id):
+    """
+    Добавляет последние посты автора в ленты всех его подписчиков.
+
+    Посты, написанные, пока автор был популярен, не раздавались при
+    записи: без этого они пропали бы из лент, когда он опустится
+    ниже порога.
+    """
+    if is_heavy(author_id):
+        return
+    posts = list(Post.objects.on_shard(key=author_id).filter(
+        author_id=author_id
+    ).order_by('-pub_date', '-pk').values_list(
+        'pk', 'pub_date'
+    )[:settings.TIMELINE_BACKFILL])
+    followers = Follow.objects.filter(
+        author_id=author_id
+    ).values_list('user_id', flat=True)
+    batch = []
+    for user_id in followers.iterator():
+        batch.extend(
+            TimelineEntry(user_id=user_id, post_id=pk, pub_date=pub_date)
+            for pk, pub_date in posts
+        )
+        if len(batch) >= settings.TIMELINE_BATCH_SIZE:
+            _bulk_insert(batch)
+            batch = []
+            jobs.touch()
+    if batch:
+        _bulk_insert(batch)
+
+
+def follower_lost(author_id):
+    """Ставит backfill_followers, если автор только что стал обычным."""
+    if Profile.objects.filter(
+        user_id=author_id,
+        followers_count=settings.FEED_FANOUT_THRESHOLD - 1,
+    ).exists():
+        jobs.enqueue(
+            backfill_followers, {'author_id': author_id},
+            key=f'timeline:backfill:{author_id}')
+
+
+def prune(user_id, author_id):
+    """
+    Убирает из ленты посты автора после отписки.
+
+    Ленты лежат в default, а посты - в шарде автора, поэтому JOIN
+    невозможен: id постов читаются из шарда пачками.
+    """
+    post_ids = Post.objects.on_shard(key=author_id).filter(
+        author_id=author_id
+    ).values_list('pk', flat=True).iterator()
+    while True:
+        batch = list(islice(post_ids, settings.TIMELINE_BATCH_SIZE))
+        if not batch:
+            return
+        TimelineEntry.objects.filter(
+            user_id=user_id, post_id__in=batch).delete()
+
+
+def _recent_key(author_id):
+    return f'posts:recent:{author_id}'
+
+
+def forget_recent(author_id):
+    cache.delete(_recent_key(author_id))
+
+
+def recent_posts(author_id):
+    """Последние FEED_MERGE_DEPTH ключей постов автора, от новых к старым."""
+    key = _recent_key(author_id)
+    keys = cache.get(key)
+    if keys is None:
+        keys = [
+            FeedKey(*row) for row in Post.objects.on_shard(
+                key=author_id
+            ).filter(author_id=author_id).order_by(
+                '-pub_date', '-pk'
+            ).values_list(
+                'pub_date', 'pk'
+            )[:settings.FEED_MERGE_DEPTH]
+        ]
+        if not reading_replica():
+            cache.set(key, keys, settings.FEED_MERGE_CACHE_TIMEOUT)
+    return keys
+
+
+class FeedPaginator(CursorPaginator):
+    """
+    Лента подписок: материализованная часть плюс слияние при чтении.
+
+    Посты популярных авторов не раздаются в TimelineEntry, а берутся
+    из закешированных списков последних постов каждого такого автора
+    и сливаются с лентой через heapq. Глубже закешированного списка
+    посты автора ищутся в базе. Из базы поднимаются только посты
+    итоговой страницы: из posts, по умолчанию Post.objects.for_feed().
+    """
+
+    def __init__(self, object_list, per_page, heavy_author_ids=(),
+                 posts=None):
+        super().__init__(object_list, per_page, id_field='post_id')
+        self.heavy_author_ids = heavy_author_ids
+        self.posts = Post.objects.for_feed() if posts is None else posts
+
+    def _rows(self, cursor, lookup, ordering):
+        limit = self.per_page + 1
+        newest_first = lookup == 'lt'
+        entries = self.seek(self.object_list, cursor, lookup).order_by(
+            *ordering).values_list('pub_date', 'post_id')[:limit]
+        streams = [map(FeedKey._make, entries)]
+        for author_id in self.heavy_author_ids:
+            streams.append(
+                self._author_keys(author_id, cursor, lookup))
+        seen = set()
+        merged = (
+            item for item in heapq.merge(*streams, reverse=newest_first)
+            if not (item.post_id in seen or seen.add(item.post_id))
+        )
+        return list(islice(merged, limit))
+
+    def _author_keys(self, author_id, cursor, lookup):
+        """
+        Ключи постов популярного автора после курсора, не больше limit.
+
+        Список из кеша полон, если в нем меньше FEED_MERGE_DEPTH постов
+        или курсор внутри него; иначе страница уходит глубже, и посты
+        ищутся в базе по индексу автора.
+        """
+        limit = self.per_page + 1
+        cached = recent_posts(author_id)
+        if lookup == 'lt':
+            keys = [item for item in cached if cursor is None or item < cursor]
+            covered = len(keys) >= limit
+            ordering = ('-pub_date', '-pk')
+        else:
+            keys = [item for item in cached if item > cursor][::-1]
+            covered = len(keys) < len(cached)
+            ordering = ('pub_date', 'pk')
+        if covered or len(cached) < settings.FEED_MERGE_DEPTH:
+            return keys[:limit]
+        posts = Post.objects.on_shard(key=author_id).filter(
+            author_id=author_id)
+        posts = CursorPaginator(posts, self.per_page).seek(
+            posts, cursor, lookup)
+        return [
+            FeedKey(*row) for row in posts.order_by(
+                *ordering).values_list('pub_date', 'pk')[:limit]
+        ]
+
+    def get_page(self, after=None, before=None):
+        page = super().get_page(after=after, before=before)
+        posts = sharding.in_bulk(
+            self.posts, [item.post_id for item in page.object_list])
+        page.object_list = [
+            posts[item.post_id] for item in page.object_list
+            if item.post_id in posts
+        ]
+        return page
@@ -1,72 +1,171 @@
-from django.core.paginator import Paginator
+from django.conf import settings
+from django.http import Http404, JsonResponse
 from django.shortcuts import get_object_or_404, redirect, render
 from django.contrib.auth.decorators import login_required
 
 
+from core.paginators import (CursorPaginator, ShardedCursorPaginator,
+                             decode_cursor, encode_cursor)
+from core.replicas import replica_reads
+
+from . import feed_cache
 from .forms import CommentForm, PostForm
-from .models import Follow, Group, Post, User
+from .models import Comment, Follow, Group, Post, TimelineEntry, User
+from .search import SearchPaginator, ranked
+from .timeline import FeedPaginator, heavy_authors
 
 from yatube.settings import POSTS_QUANTITY
 
 
-def paginate(request, queryset):
-    paginator = Paginator(queryset, POSTS_QUANTITY)
-    page_number = request.GET.get
-    page_obj = paginator.get_page(page_number)
+def paginate(request, queryset, paginator_class=CursorPaginator, **kwargs):
+    paginator = paginator_class(queryset, POSTS_QUANTITY, **kwargs)
+    page_obj = paginator.get_page(
+        after=request.GET.get('after'),
+        before=request.GET.get('before'),
+    )
     return page_obj
 
 
+def comment_chunk(comments, after=None):
+    """
+    Порция COMMENTS_CHUNK_SIZE комментариев по (created, id) после курсора.
+
+    Возвращает список комментариев и курсор следующей порции или None.
+    """
+    size = settings.COMMENTS_CHUNK_SIZE
+    comments = comments.select_related('author').only(
+        'text', 'created', 'post', 'author__username'
+    ).order_by('created', 'pk')
+    paginator = CursorPaginator(comments, size, date_field='created')
+    cursor = decode_cursor(after) if after else None
+    rows = list(paginator.seek(comments, cursor, 'gt')[:size + 1])
+    if len(rows) <= size:
+        return rows, None
+    last = rows[size - 1]
+    return rows[:size], encode_cursor(last.created, last.pk)
+
+
+def index_scopes(request):
+    return [('index', None)]
+
+
+def group_scopes(request, slug):
+    pk = Group.objects.filter(slug=slug).values_list('pk', flat=True).first()
+    return None if pk is None else [('group', pk)]
+
+
+def profile_scopes(request, username):
+    pk = User.objects.filter(
+        username=username).values_list('pk', flat=True).first()
+    return None if pk is None else [('author', pk)]
+
+
+def post_scopes(request, post_id):
+    author_id = Post.objects.on_shard(pk=post_id).filter(
+        pk=post_id).values_list('author_id', flat=True).first()
+    if author_id is None:
+        return None
+    # Страница поста показывает и число постов автора.
+    return [('post', post_id), ('author', author_id)]
+
+
+@replica_reads
+@feed_cache.conditional(index_scopes)
 def index(request):
-    posts = Post.objects.all()
-    page_obj = paginate(request, posts)
+    posts = Post.objects.for_feed()
+    page_obj = paginate(request, posts, ShardedCursorPaginator)
     context = {
-        'page_obj': page_obj
+        'page_obj': page_obj,
+        **feed_cache.context('index'),
     }
     return render(request, 'posts/index.html', context)
 
 
+@replica_reads
+@feed_cache.conditional(group_scopes)
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
-    posts = group.posts.all()
-    page_obj = paginate(request, posts)
+    posts = group.posts.for_feed()
+    page_obj = paginate(request, posts, ShardedCursorPaginator)
     context = {
         'group': group,
-        'page_obj': page_obj
+        'page_obj': page_obj,
+        **feed_cache.context('group', group.pk),
     }
     return render(request, 'posts/group_list.html', context)
 
 
+@replica_reads
+@feed_cache.conditional(profile_scopes)
 def profile(request, username):
-    author = get_object_or_404(User, username=username)
-    posts = author.posts.all()
+    author = get_object_or_404(
+        User.objects.select_related('profile'), username=username)
+    posts = author.posts.for_feed()
     page_obj = paginate(request, posts)
-    try:
-        following = Follow.objects.get(user=request.user, author=author)
-    except Exception:
-        following = False
+    following = request.user.is_authenticated and Follow.objects.filter(
+        user=request.user, author=author).exists()
     context = {
         'author': author,
         'page_obj': page_obj,
-        'following': following
+        'following': following,
+        **feed_cache.context('author', author.pk),
     }
     return render(request, 'posts/profile.html', context)
 
 
+@replica_reads
+@feed_cache.conditional(post_scopes)
 def post_detail(request, post_id):
-    post = get_object_or_404(Post, id=post_id)
+    post = get_object_or_404(
+        Post.objects.on_shard(pk=post_id).select_related(
+            'author__profile', 'group'),
+        id=post_id)
     form = CommentForm(request.POST or None)
-    comments = post.comments.all()
+    comments, next_cursor = comment_chunk(post.comments.all())
     context = {
         'post': post,
         'form': form,
         'comments': comments,
+        'next_cursor': next_cursor,
     }
     return render(request, 'posts/post_detail.html', context)
 
 
+@replica_reads
+@feed_cache.conditional(post_scopes)
+def post_comments(request, post_id):
+    """Следующая порция комментариев: фрагмент HTML или JSON."""
+    comments, next_cursor = comment_chunk(
+        Comment.objects.on_shard(pk=post_id).filter(post_id=post_id),
+        request.GET.get('after'),
+    )
+    if not comments and not Post.objects.on_shard(pk=post_id).filter(
+            pk=post_id).exists():
+        raise Http404
+    if request.GET.get('format') == 'json':
+        return JsonResponse({
+            'comments': [
+                {
+                    'id': comment.pk,
+                    'author': comment.author.username,
+                    'text': comment.text,
+                    'created': comment.created,
+                }
+                for comment in comments
+            ],
+            'next': next_cursor,
+        })
+    context = {
+        'post_id': post_id,
+        'comments': comments,
+        'next_cursor': next_cursor,
+    }
+    return render(request, 'posts/includes/comment_chunk.html', context)
+
+
 @login_required
 def post_create(request):
-    form = PostForm(request.POST or None)
+    form = PostForm(request.POST or None, files=request.FILES or None)
     if form.is_valid():
         post = form.save(commit=False)
         post.author = request.user
@@ -77,8 +176,8 @@ def post_create(request):
 
 @login_required
 def post_edit(request, post_id):
-    post = get_object_or_404(Post, pk=post_id)
-    if post.author != request.user:
+    post = get_object_or_404(Post.objects.on_shard(pk=post_id), pk=post_id)
+    if post.author_id != request.user.pk:
         return redirect('posts:post_detail', post_id=post_id)
     form = PostForm(
         request.POST or None,
@@ -99,7 +198,7 @@ def post_edit(request, post_id):
 
 @login_required
 def add_comment(request, post_id):
-    post = get_object_or_404(Post, id=post_id)
+    post = get_object_or_404(Post.objects.on_shard(pk=post_id), id=post_id)
     form = CommentForm(request.POST or None)
     if form.is_valid():
         comment = form.save(commit=False)
@@ -109,12 +208,16 @@ def add_comment(request, post_id):
     return redirect('posts:post_detail', post_id=post_id)
 
 
+@replica_reads
 @login_required
 def follow_index(request):
-    posts = Post.objects.filter(author__following__user=request.user)
-    paginator = Paginator(posts, POSTS_QUANTITY)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    entries = TimelineEntry.objects.filter(user=request.user)
+    page_obj = paginate(
+        request,
+        entries,
+        paginator_class=FeedPaginator,
+        heavy_author_ids=heavy_authors(request.user),
+    )
     context = {
         'page_obj': page_obj
     }
@@ -122,6 +225,20 @@ def follow_index(request):
     return render(request, 'posts/follow.html', context)
 
 
+def search(request):
+    query = request.GET.get('q', '').strip()
+    rows = ranked(query)
+    page_obj = None
+    if rows is not None:
+        page_obj = paginate(
+            request, rows, paginator_class=SearchPaginator, query=query)
+    context = {
+        'query': query,
+        'page_obj': page_obj,
+    }
+    return render(request, 'posts/search.html', context)
+
+
 @login_required
 def profile_follow(request, username):
     author_follow = get_object_or_404(User, username=username)
@@ -1,5 +1,10 @@
 from django.contrib.auth import get_user_model
-from django.contrib.auth.forms import PasswordChangeForm, UserCreationForm
+from django.contrib.auth.forms import (PasswordChangeForm, PasswordResetForm,
+                                       UserCreationForm)
+from django.template import loader
+
+from core import jobs
+from core.tasks import send_email
 
 User = get_user_model()
 
@@ -20,3 +25,22 @@ class PasswordChange(PasswordChangeForm):
             'new_password1',
             'new_password2',
         )
+
+
+class QueuedPasswordResetForm(PasswordResetForm):
+    """Письмо со ссылкой сброса отправляет фоновая задача, а не запрос."""
+
+    def send_mail(self, subject_template_name, email_template_name,
+                  context, from_email, to_email,
+                  html_email_template_name=None):
+        subject = loader.render_to_string(subject_template_name, context)
+        html = None
+        if html_email_template_name is not None:
+            html = loader.render_to_string(html_email_template_name, context)
+        jobs.enqueue(send_email, {
+            'subject': ''.join(subject.splitlines()),
+            'body': loader.render_to_string(email_template_name, context),
+            'from_email': from_email,
+            'to': [to_email],
+            'html': html,
+        }, priority=10)
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/2.2/ref/settings/
 """
 
 import os
+import sys
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -37,6 +38,7 @@ ALLOWED_HOSTS = [
 
 INSTALLED_APPS = [
     'about.apps.AboutConfig',
+    'api.apps.ApiConfig',
     'core.apps.CoreConfig',
     'users.apps.UsersConfig',
     'posts.apps.PostsConfig',
@@ -56,6 +58,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'core.replicas.ReplicaMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -88,11 +91,16 @@ WSGI_APPLICATION = 'yatube.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        'ENGINE': 'core.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
     }
 }
 
+DATABASE_ROUTERS = [
+    'core.sharding.ShardRouter',
+    'core.replicas.ReplicaRouter',
+]
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -144,12 +152,87 @@ EMAIL_BACKEND = 'django.core.mail.backends.filebased.EmailBackend'
 EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
 
 POSTS_QUANTITY: int = 10
+# Комментарии на странице поста подгружаются порциями.
+COMMENTS_CHUNK_SIZE: int = 50
+# Размер страницы JSON API: по умолчанию и наибольший для ?limit=.
+API_PAGE_SIZE: int = 20
+API_MAX_PAGE_SIZE: int = 100
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 CACHES = {
     'default': {
+        'BACKEND': 'core.cache.TwoLevelCache',
+        'LOCATION': 'yatube',
+        'OPTIONS': {
+            'L2': 'shared',
+            'L1_MAX_ENTRIES': 1000,
+            'L1_TIMEOUT': 60,
+            'SYNC_INTERVAL': 1,
+            'STAMP_BUCKETS': 64,
+        },
+    },
+    'shared': {
+        'BACKEND': 'core.cache.SQLiteCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache.sqlite3'),
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+        },
+    },
+}
+
+# Тесты чистят кеш: общий файл cache.sqlite3 они не трогают, L2 у них
+# в памяти процесса.
+TESTING = sys.argv[1:2] == ['test'] or 'pytest' in sys.modules
+if TESTING:
+    CACHES['shared'] = {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'yatube-tests',
     }
+
+TIMELINE_BACKFILL: int = 200
+TIMELINE_BATCH_SIZE: int = 1000
+FEED_FANOUT_THRESHOLD: int = 10000
+FEED_MERGE_DEPTH: int = 200
+FEED_MERGE_CACHE_TIMEOUT: int = 300
+FEED_CACHE_TIMEOUT: int = 60 * 60 * 6
+POST_THUMBNAILS = {
+    'card': (960, 339),
+}
+POST_THUMBNAIL_WIDTHS = (320, 640, 960)
+POST_THUMBNAIL_FORMATS = ('webp', 'jpeg')
+POST_THUMBNAIL_QUALITY: int = 85
+POST_IMAGE_MAX_PIXELS: int = 50_000_000
+POST_IMAGE_MAX_SIDE: int = 2048
+POST_IMAGE_QUALITY: int = 85
+# Сколько лучших совпадений поиска листается и сколько хранится их список.
+SEARCH_MAX_RESULTS: int = 1000
+SEARCH_SNAPSHOT_TIMEOUT: int = 60 * 30
+ADMIN_EXACT_COUNT_LIMIT: int = 10_000
+BULK_ACTION_BATCH_SIZE: int = 500
+# busy_timeout идет первым: смена journal_mode тоже ждет блокировку.
+SQLITE_PRAGMAS = {
+    'busy_timeout': 5000,
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,
+    'temp_store': 'memory',
 }
+SQLITE_TRANSACTION_MODE = 'IMMEDIATE'
+# Псевдонимы реплик из DATABASES, пустой список - все в default.
+DATABASE_REPLICAS = []
+REPLICA_APPS = ('posts',)
+PRIMARY_PIN_SECONDS: int = 10
+# Базы с постами и комментариями, см. core.sharding.
+DATABASE_SHARDS = ['default']
+# Справочные таблицы, копии которых держит каждый шард.
+SHARD_REFERENCE_MODELS = ('auth.User', 'posts.Group')
+# Фоновые задачи core.jobs, интервалы в секундах.
+JOB_WORKERS: int = 2
+JOB_VISIBILITY_TIMEOUT: int = 5 * 60
+JOB_MAX_ATTEMPTS: int = 5
+JOB_RETRY_BACKOFF: int = 10
+JOB_POLL_INTERVAL: float = 1.0
+JOB_KEEP_DONE: int = 7 * 24 * 60 * 60